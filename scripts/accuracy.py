@@ -0,0 +1,328 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import lazy
+import outline
+import run
+import scan
+import synthetic
+
+# Loaded on first use, so outline-only comparisons do not wait for it
+o3d = lazy.lazy_import("open3d")
+
+
+# Options of a pipeline configuration: the footprint engine of outline.main, or
+# outline.main_tiled at pixel_size; the category samples (see run.categorySamples);
+# Poisson depth and density filter, or planar walls, floor and ceiling
+DEFAULTS = {
+    "engine": "raster",
+    "pixel_size": None,
+    "voxel_size": 0.03,
+    "sample_size": None,
+    "depth": 9,
+    "density_percentile": 5,
+    "planar": False,
+}
+
+# Named configurations, each the options it changes from DEFAULTS
+CONFIGURATIONS = {
+    "reference": {},
+    "hull": {"engine": "hull"},
+    "tiled": {"pixel_size": 0.01},
+    "planar": {"planar": True},
+    "depth8": {"depth": 8},
+    "budget": {"sample_size": 100_000},
+}
+
+# Points sampled on each mesh for the mesh-to-mesh distances
+MESH_SAMPLES = 20_000
+
+
+def configuration(spec):
+    # Options of a configuration given by name, as a JSON object of options, or as a dict
+    if isinstance(spec, dict):
+        changes = spec
+    elif spec in CONFIGURATIONS:
+        changes = CONFIGURATIONS[spec]
+    else:
+        changes = json.loads(spec)
+    unknown = set(changes) - set(DEFAULTS)
+    if unknown:
+        raise ValueError("Unknown options: " + ", ".join(sorted(unknown)))
+    return {**DEFAULTS, **changes}
+
+
+def run_configuration(df, options, meshes=True):
+    """
+    Outline and category meshes of a scan under one configuration, timed.
+
+    Parameters:
+        df (pd.DataFrame or scan.ScanIndex): The scan.
+        options (dict): Options, see DEFAULTS.
+        meshes (bool): Also build the walls, floor, ceiling and window meshes.
+
+    Returns:
+        dict: outline (as outline.main, the footprint a list of rooms when tiled),
+            arrays ((vertices, triangles, colors) per category, or None) and
+            seconds of each of the two stages.
+    """
+    start = time.perf_counter()
+    if options["pixel_size"]:
+        outline_result = outline.main_tiled(df, options["pixel_size"])
+    else:
+        outline_result = outline.main(df, engine=options["engine"])
+    seconds = {"outline": time.perf_counter() - start}
+
+    arrays = None
+    if meshes:
+        start = time.perf_counter()
+        samples = run.categorySamples(df, options["voxel_size"], options["sample_size"])
+        arrays = run.categoryMeshArrays(samples, None, None, options["depth"], options["density_percentile"],
+                                        outline_result if options["planar"] else None)
+        seconds["mesh"] = time.perf_counter() - start
+    return {"outline": outline_result, "arrays": arrays, "seconds": seconds}
+
+
+def rooms(footprint):
+    # Room polygons of an outline, without a repeated closing point
+    return [np.asarray(p, dtype=np.float64)[:, :2] for p in (footprint if isinstance(footprint, list) else [footprint])]
+
+
+def boundary_distances(points, polygons):
+    # Distance of each point to the nearest edge of the closed polygons
+    return np.min([outline.project_points_to_polyline(points, np.vstack((p, p[:1])))[1] for p in polygons], axis=0)
+
+
+def match_windows(reference, candidate):
+    # (reference, candidate) index pairs of windows, nearest midpoints first, each window matched at most once
+    if not len(reference) or not len(candidate):
+        return []
+    a = np.array([np.mean(e, axis=0) for e in reference])
+    b = np.array([np.mean(e, axis=0) for e in candidate])
+    distances = np.linalg.norm(a[:, np.newaxis] - b[np.newaxis], axis=2)
+    pairs, used_a, used_b = [], set(), set()
+    for i, j in zip(*np.unravel_index(np.argsort(distances, axis=None), distances.shape)):
+        if i not in used_a and j not in used_b:
+            pairs.append((int(i), int(j)))
+            used_a.add(i)
+            used_b.add(j)
+    return sorted(pairs)
+
+
+def compare_outlines(reference, candidate):
+    """
+    Geometric error of a candidate outline against a reference one.
+
+    Parameters:
+        reference (tuple): (final_fp, room_height, final_endpoint_lst, z_bound) of the reference.
+        candidate (tuple): The same of the candidate.
+
+    Returns:
+        dict: Footprint IoU; mean and largest distance in metres from the vertices of
+            each footprint to the other's edges; floor and ceiling height deltas;
+            window counts and, over the matched windows, the largest and mean
+            endpoint displacement and the largest z bound delta.
+    """
+    ref_fp, ref_height, ref_windows, ref_z = reference
+    cand_fp, cand_height, cand_windows, cand_z = candidate
+    ref_rooms, cand_rooms = rooms(ref_fp), rooms(cand_fp)
+    # Both directions: vertices missing from one footprint show up in the other's distances
+    vertex_distances = np.concatenate((boundary_distances(np.vstack(cand_rooms), ref_rooms),
+                                       boundary_distances(np.vstack(ref_rooms), cand_rooms)))
+    result = {
+        "iou": outline.polygon_iou(ref_rooms, cand_rooms),
+        "vertex_mean": float(vertex_distances.mean()),
+        "vertex_max": float(vertex_distances.max()),
+        "floor_delta": float(abs(cand_height[0] - ref_height[0])),
+        "ceiling_delta": float(abs(cand_height[1] - ref_height[1])),
+        "windows": len(ref_windows),
+        "windows_candidate": len(cand_windows),
+    }
+
+    displacements, z_deltas = [], []
+    for i, j in match_windows(ref_windows, cand_windows):
+        a, b = np.asarray(ref_windows[i], dtype=np.float64), np.asarray(cand_windows[j], dtype=np.float64)
+        # Endpoints may come out in either order
+        displacement = min(np.linalg.norm(a - b, axis=1).max(), np.linalg.norm(a - b[::-1], axis=1).max())
+        displacements.append(displacement)
+        z_deltas.append(np.abs(np.asarray(ref_z[i]) - np.asarray(cand_z[j])).max())
+    result["windows_matched"] = len(displacements)
+    result["window_max"] = float(max(displacements)) if displacements else None
+    result["window_mean"] = float(np.mean(displacements)) if displacements else None
+    result["window_z_max"] = float(max(z_deltas)) if z_deltas else None
+    return result
+
+
+def surface_samples(vertices, triangles, n, seed=0):
+    # n points spread uniformly over the area of a triangle mesh
+    corners = np.asarray(vertices, dtype=np.float64)[np.asarray(triangles)]
+    areas = np.linalg.norm(np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0]), axis=1)
+    rng = np.random.default_rng(seed)
+    picked = rng.choice(len(areas), n, p=areas / areas.sum())
+    u, v = rng.random((2, n))
+    # Folded back into the triangle when u + v > 1
+    flip = u + v > 1
+    u[flip], v[flip] = 1 - u[flip], 1 - v[flip]
+    c = corners[picked]
+    return c[:, 0] + u[:, np.newaxis] * (c[:, 1] - c[:, 0]) + v[:, np.newaxis] * (c[:, 2] - c[:, 0])
+
+
+def surface_distances(points, vertices, triangles):
+    # Distance of each point to the nearest point on the surface of a triangle mesh
+    scene = o3d.t.geometry.RaycastingScene()
+    scene.add_triangles(o3d.core.Tensor(np.asarray(vertices, dtype=np.float32)),
+                        o3d.core.Tensor(np.asarray(triangles, dtype=np.uint32)))
+    return scene.compute_distance(o3d.core.Tensor(np.asarray(points, dtype=np.float32))).numpy()
+
+
+def compare_meshes(reference, candidate, samples=MESH_SAMPLES):
+    """
+    Mesh-to-mesh distances between two meshes, on points sampled over each surface.
+
+    Parameters:
+        reference (tuple): (vertices, triangles, ...) of the reference mesh.
+        candidate (tuple): The same of the candidate mesh.
+        samples (int): Points sampled on each mesh.
+
+    Returns:
+        dict: Symmetric Hausdorff distance (the largest distance from either
+            surface to the other), Chamfer distance (the mean of the two mean
+            distances) and the triangle counts, in metres; None distances when
+            a mesh is empty.
+    """
+    result = {"triangles": len(reference[1]), "triangles_candidate": len(candidate[1]),
+              "hausdorff": None, "chamfer": None}
+    if not len(reference[1]) or not len(candidate[1]):
+        return result
+    to_candidate = surface_distances(surface_samples(reference[0], reference[1], samples), candidate[0], candidate[1])
+    to_reference = surface_distances(surface_samples(candidate[0], candidate[1], samples), reference[0], reference[1])
+    result["hausdorff"] = float(max(to_candidate.max(), to_reference.max()))
+    result["chamfer"] = float((to_candidate.mean() + to_reference.mean()) / 2)
+    return result
+
+
+def compare_scan(df, reference="reference", candidate="hull", meshes=True, reference_run=None):
+    """
+    Runs a reference and a candidate configuration on a scan and measures how
+    far the candidate's geometry is from the reference, and how much faster it is.
+
+    Parameters:
+        df (pd.DataFrame or scan.ScanIndex): The scan.
+        reference: Configuration name, JSON object or dict, see configuration.
+        candidate: The same for the candidate.
+        meshes (bool): Also compare the category meshes.
+        reference_run (dict): run_configuration result of the reference, to reuse across candidates.
+
+    Returns:
+        dict: outline errors (see compare_outlines), mesh errors per category
+            (see compare_meshes), seconds of both runs and the speedup of each stage.
+    """
+    reference_run = reference_run or run_configuration(df, configuration(reference), meshes)
+    candidate_run = run_configuration(df, configuration(candidate), meshes)
+    record = {"outline": compare_outlines(reference_run["outline"], candidate_run["outline"])}
+    if meshes:
+        record["meshes"] = {name: compare_meshes(a, b) for name, a, b in
+                            zip(run.CATEGORY_NAMES, reference_run["arrays"], candidate_run["arrays"])}
+    record["seconds"] = reference_run["seconds"]
+    record["seconds_candidate"] = candidate_run["seconds"]
+    record["speedup"] = {stage: reference_run["seconds"][stage] / candidate_run["seconds"][stage]
+                         for stage in candidate_run["seconds"] if candidate_run["seconds"][stage] > 0}
+    return record
+
+
+def flatten(record):
+    # One level of "outline.iou", "meshes.walls.hausdorff" keys, for bounds and printing
+    flat = {}
+    for key, value in record.items():
+        if isinstance(value, dict):
+            flat.update({key + "." + k: v for k, v in flatten(value).items()})
+        else:
+            flat[key] = value
+    return flat
+
+
+def check_bounds(records, bounds):
+    """
+    Compares measured errors against the error bounds of a mode.
+
+    Bounds on "outline.iou" and "speedup.*" are minimums, all others maximums.
+    A measurement that is None (e.g. no window matched) fails its bound.
+
+    Parameters:
+        records (list): compare_scan records with a "scan" name.
+        bounds (dict): Flattened keys, e.g. {"outline.vertex_max": 0.1, "meshes.walls.hausdorff": 0.05}.
+
+    Returns:
+        list: (scan, key, value, bound) of every bound exceeded.
+    """
+    failures = []
+    for record in records:
+        flat = flatten(record)
+        for key, bound in bounds.items():
+            value = flat.get(key)
+            minimum = key == "outline.iou" or key.startswith("speedup.")
+            if value is None or (value < bound if minimum else value > bound):
+                failures.append((record["scan"], key, value, bound))
+    return failures
+
+
+def print_record(record):
+    flat = flatten(record)
+    print(record["scan"] + "  " + record["candidate"] + " against " + record["reference"])
+    for key, value in flat.items():
+        if key not in ("scan", "candidate", "reference"):
+            print("  %-34s %s" % (key, "%.4f" % value if isinstance(value, float) else value))
+
+
+if __name__ == "__main__":
+    # Measure the error of fast modes against the reference pipeline, on scans or synthetic rooms:
+    #   python accuracy.py ../data/setup_1.parquet --candidates hull planar --bounds bounds.json
+    #   python accuracy.py --sizes 100000 --candidates '{"engine": "hull", "planar": true}' --no-meshes
+    parser = argparse.ArgumentParser(description="Compare fast pipeline modes against a reference configuration.")
+    parser.add_argument("scans", nargs="*", help="Parquet scans")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[], help="Points of synthetic scans to add")
+    parser.add_argument("--reference", default="reference", help="Configuration name or JSON options")
+    parser.add_argument("--candidates", nargs="+", default=["hull"],
+                        help="Configuration names or JSON options: " + ", ".join(CONFIGURATIONS))
+    parser.add_argument("--no-meshes", action="store_true", help="Compare the outlines only, without Open3D")
+    parser.add_argument("--output", help="JSON lines file the records are appended to")
+    parser.add_argument("--bounds", help="JSON file of error bounds per candidate: {candidate: {key: bound}}")
+    args = parser.parse_args()
+
+    bounds = {}
+    if args.bounds:
+        with open(args.bounds) as f:
+            bounds = json.load(f)
+
+    records = []
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = list(args.scans)
+        for n_points in args.sizes:
+            paths.append(synthetic.write_room_scan(os.path.join(tmp, "setup_%d.parquet" % n_points), n_points))
+        for path in paths:
+            df = scan.load_indexed(path, save=False)
+            reference_run = run_configuration(df, configuration(args.reference), not args.no_meshes)
+            for candidate in args.candidates:
+                record = {"scan": os.path.basename(path), "reference": args.reference, "candidate": candidate}
+                record.update(compare_scan(df, args.reference, candidate, not args.no_meshes, reference_run))
+                print_record(record)
+                records.append(record)
+
+    if args.output:
+        with open(args.output, "a") as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+        print("Records appended to " + args.output)
+
+    failures = []
+    for candidate, candidate_bounds in bounds.items():
+        failures += check_bounds([r for r in records if r["candidate"] == candidate], candidate_bounds)
+    for scan_name, key, value, bound in failures:
+        print("OUT OF BOUNDS  %s %s: %s (bound %s)" % (scan_name, key, value, bound))
+    sys.exit(1 if failures else 0)
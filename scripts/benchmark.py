@@ -0,0 +1,206 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import rhino3dm
+
+import outline
+import run
+import synthetic
+
+
+def revision():
+    # Short git revision of the scripts, or None outside a checkout
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def timed(fn, repeat):
+    # Wall time of each of repeat calls of fn, and the result of the last one
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        seconds.append(time.perf_counter() - start)
+    return seconds, result
+
+
+def bench_scan(path, n_points, repeat=3, depth=9):
+    """
+    Times every pipeline stage on one scan.
+
+    The stages run on each other's results in pipeline order, like run.run:
+    load_data, the raster, contour and window sub-stages of outline.main and
+    outline.main as a whole, outline.main with the hull engine and the IoU of
+    its footprint with the raster one, then dfToMesh and o3d_to_rhino3dm on the voxel
+    downsampled walls, dfToMesh on the floor and ceiling, the planar walls,
+    floor and ceiling with the time each saves over dfToMesh, wallsMesh and
+    File3dm.Write of the assembled model.
+
+    Parameters:
+        path (str): Parquet scan.
+        n_points (int): Points in the scan, recorded with the results.
+        repeat (int): Runs of each stage; min and median are reported.
+        depth (int): Poisson reconstruction depth.
+
+    Returns:
+        list: One dict per stage with its timings and output size.
+    """
+    records = []
+
+    def record(stage, seconds, items=None):
+        records.append({
+            "stage": stage,
+            "points": n_points,
+            "repeat": len(seconds),
+            "min": min(seconds),
+            "median": statistics.median(seconds),
+            "items": items,
+        })
+
+    seconds, df = timed(lambda: outline.load_data(path), repeat)
+    record("load_data", seconds, len(df))
+
+    ceiling, floor, windows = outline.get_group(df, 0), outline.get_group(df, 1), outline.get_group(df, 10)
+    seconds, (image, transformation) = timed(lambda: outline.footprint_image(ceiling, floor), repeat)
+    record("outline.raster", seconds, len(ceiling) + len(floor))
+    seconds, contour = timed(lambda: outline.footprint_contour(image), repeat)
+    record("outline.contour", seconds, len(contour))
+    padding = 50
+    seconds, (endpoints, _) = timed(lambda: outline.window_endpoints(windows, contour, padding, *transformation), repeat)
+    record("outline.windows", seconds, len(endpoints))
+    seconds, outlineResult = timed(lambda: outline.main(df), repeat)
+    record("outline.main", seconds, len(outlineResult[0]))
+    # The raster-free engine, and how well its footprint agrees with the raster one
+    seconds, hullResult = timed(lambda: outline.main(df, engine="hull"), repeat)
+    record("outline.main[hull]", seconds, len(hullResult[0]))
+    records[-1]["iou"] = outline.polygon_iou(outlineResult[0], hullResult[0])
+
+    samples = run.categorySamples(df)
+    walls = samples[0]
+    seconds, o3dMesh = timed(lambda: run.dfToMesh(walls, depth), repeat)
+    record("dfToMesh", seconds, len(o3dMesh.triangles))
+    seconds, mesh = timed(lambda: run.o3d_to_rhino3dm(o3dMesh), repeat)
+    record("o3d_to_rhino3dm", seconds, mesh.Faces.Count)
+
+    # The planar surfaces against the Poisson reconstruction of each category they replace
+    final_fp, room_height, _, _ = outlineResult
+    poisson = {"walls": records[-2]["median"]}
+    for sample, name in zip(samples[1:3], run.CATEGORY_NAMES[1:3]):
+        seconds, o3dSurface = timed(lambda: run.dfToMesh(sample, depth), repeat)
+        record("dfToMesh[%s]" % name, seconds, len(o3dSurface.triangles))
+        poisson[name] = records[-1]["median"]
+    for sample, name in zip(samples[:3], run.CATEGORY_NAMES[:3]):
+        seconds, surface = timed(lambda: run.planarCategoryArrays(final_fp, room_height, sample, name), repeat)
+        record("planar[%s]" % name, seconds, len(surface[1]))
+        records[-1]["saved"] = poisson[name] - records[-1]["median"]
+
+    pLine = run.getPolyline(final_fp, room_height[0])
+    seconds, wallMesh = timed(lambda: run.wallsMesh(pLine, room_height), repeat)
+    record("wallsMesh", seconds, wallMesh.Faces.Count)
+
+    with tempfile.TemporaryDirectory() as directory:
+        modelPath = os.path.join(directory, "benchmark.3dm")
+
+        def write():
+            model = rhino3dm.File3dm()
+            model.Objects.AddMesh(wallMesh)
+            model.Objects.AddMesh(mesh)
+            model.Objects.AddPolyline(pLine)
+            model.Write(modelPath, 6)
+            return os.path.getsize(modelPath)
+
+        seconds, size = timed(write, repeat)
+        record("File3dm.Write", seconds, size)
+    return records
+
+
+def bench(sizes, repeat=3, depth=9, seed=0, directory=None):
+    # Benchmark records of synthetic scans of each size, with the run metadata on every record
+    meta = {
+        "revision": revision(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "cpus": os.cpu_count(),
+    }
+    records = []
+    with tempfile.TemporaryDirectory(dir=directory) as tmp:
+        for n_points in sizes:
+            path = synthetic.write_room_scan(os.path.join(tmp, "setup_%d.parquet" % n_points), n_points, seed)
+            for r in bench_scan(path, n_points, repeat, depth):
+                r.update(meta)
+                records.append(r)
+                extra = "  IoU %.3f" % r["iou"] if "iou" in r else ""
+                extra += "  saves %.3f s" % r["saved"] if "saved" in r else ""
+                print("%10d  %-18s %10.4f s  %s%s" % (n_points, r["stage"], r["median"], r["items"], extra))
+            os.remove(path)
+    return records
+
+
+def compare(records, baseline, threshold=1.2):
+    """
+    Compares median times against a baseline run.
+
+    Parameters:
+        records (list): Records of this run.
+        baseline (list): Records of the baseline run.
+        threshold (float): Slowdown ratio reported as a regression.
+
+    Returns:
+        list: (stage, points, ratio) of every stage slower than threshold times the baseline.
+    """
+    before = {(r["stage"], r["points"]): r["median"] for r in baseline}
+    regressions = []
+    for r in records:
+        key = (r["stage"], r["points"])
+        if key not in before or before[key] <= 0:
+            continue
+        ratio = r["median"] / before[key]
+        flag = "  REGRESSION" if ratio > threshold else ""
+        print("%10d  %-18s %6.2fx%s" % (r["points"], r["stage"], ratio, flag))
+        if ratio > threshold:
+            regressions.append((r["stage"], r["points"], ratio))
+    return regressions
+
+
+def read_records(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+if __name__ == "__main__":
+    # Benchmark the pipeline on synthetic scans and keep the results as JSON lines:
+    #   python benchmark.py --sizes 10000 1000000 --output results.jsonl --baseline previous.jsonl
+    parser = argparse.ArgumentParser(description="Time every pipeline stage on synthetic room scans.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000],
+                        help="Points per synthetic scan, from 10k up to 50M")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs of each stage")
+    parser.add_argument("--depth", type=int, default=9, help="Poisson reconstruction depth")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic scans")
+    parser.add_argument("--output", default="benchmark_results.jsonl", help="JSON lines file the results are appended to")
+    parser.add_argument("--baseline", help="JSON lines results of an earlier version to compare against")
+    parser.add_argument("--threshold", type=float, default=1.2, help="Slowdown ratio reported as a regression")
+    parser.add_argument("--tmp", help="Directory for the synthetic scans, e.g. a large disk for 50M points")
+    args = parser.parse_args()
+
+    records = bench(args.sizes, args.repeat, args.depth, args.seed, args.tmp)
+    with open(args.output, "a") as f:
+        for r in records:
+            f.write(json.dumps(r) + "\n")
+    print("Results appended to " + args.output)
+
+    if args.baseline:
+        regressions = compare(records, read_records(args.baseline), args.threshold)
+        sys.exit(1 if regressions else 0)
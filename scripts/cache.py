@@ -0,0 +1,244 @@
+import hashlib
+import json
+import os
+import pickle
+import sys
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+# Bump when a cached stage changes its output for the same parameters, so older entries are
+# no longer found. 2: windows in first-appearance order from indexed scans, uint32 point ids
+CACHE_VERSION = 2
+
+
+def file_hash(path, chunk_size=1 << 22):
+    # SHA-256 of the file contents
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def stage_key(stage, input_key, **params):
+    # Key of a stage result, from the stage name, the key of its input and its parameters
+    payload = json.dumps(
+        {"version": CACHE_VERSION, "stage": stage, "input": input_key, "params": params},
+        sort_keys=True, default=str)
+    return stage + "-" + hashlib.sha256(payload.encode()).hexdigest()
+
+
+def estimate_bytes(value):
+    # Approximate memory held by a cached value
+    if hasattr(value, 'memory_usage'):  # pandas DataFrame
+        return int(value.memory_usage(deep=True).sum())
+    if hasattr(value, 'nbytes'):  # NumPy array
+        return int(value.nbytes)
+    if hasattr(value, 'Vertices') and hasattr(value, 'Faces'):  # rhino3dm.Mesh
+        # Float and double vertex copies, normals and colours, plus four indices per face
+        return len(value.Vertices) * 52 + value.Faces.Count * 16
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(estimate_bytes(v) for v in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimate_bytes(v) for v in value.values())
+    return sys.getsizeof(value)
+
+
+class MemoryCache:
+    """
+    In-process cache of decoded scans and stage results with a memory cap.
+
+    Values are kept until their estimated size pushes the cache over
+    max_bytes, then the least recently used ones are dropped. The entries
+    and counters are guarded by a lock, so the threads of the Hops server can
+    share one cache; a value missed by two threads at once is computed by both.
+
+    Parameters:
+        max_bytes (int): Size limit of all values together.
+    """
+
+    def __init__(self, max_bytes=4 * 1024 ** 3):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        # Cached value, or None on a miss
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        size = estimate_bytes(value)
+        with self.lock:
+            if key in self.entries:
+                self.nbytes -= self.entries.pop(key)[1]
+            self.entries[key] = (value, size)
+            self.nbytes += size
+            # Keep at least the newest value even when it alone exceeds the cap
+            while self.nbytes > self.max_bytes and len(self.entries) > 1:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.nbytes -= evicted
+
+    def fetch(self, key, compute):
+        # Returns the cached value for key, computing and storing it on a miss
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def stats(self):
+        with self.lock:
+            hits, misses, entries, nbytes = self.hits, self.misses, len(self.entries), self.nbytes
+        lookups = hits + misses
+        return {
+            "entries": entries,
+            "bytes": nbytes,
+            "max_bytes": self.max_bytes,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+        }
+
+
+class StageCache:
+    """
+    On-disk cache of pipeline stage results, keyed by content.
+
+    A key combines the stage name, a key of its input (usually the hash of the
+    scan file) and the stage parameters, so a stage is only recomputed when one
+    of them changes. Entries are pickled files; when the cache grows past
+    max_bytes the least recently used entries are removed.
+
+    Parameters:
+        directory (str): Directory holding the cache entries.
+        max_bytes (int): Size limit of all entries together.
+    """
+
+    def __init__(self, directory, max_bytes=5 * 1024 ** 3):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(os.path.join(directory, "file_hashes"), exist_ok=True)
+
+    def key(self, stage, input_key, **params):
+        return stage_key(stage, input_key, **params)
+
+    def scan_key(self, path):
+        """
+        Content hash of a scan file.
+
+        Hashes are remembered by path, size and modification time, so an
+        unchanged file is only read once. Each scan has its own small record
+        file, written atomically, so parallel workers hashing different scans
+        never overwrite each other's records.
+        """
+        stat = os.stat(path)
+        path = os.path.abspath(path)
+        record_path = os.path.join(self.directory, "file_hashes",
+                                   hashlib.sha256(path.encode()).hexdigest()[:32] + ".json")
+        try:
+            with open(record_path) as f:
+                record = json.load(f)
+            if record["path"] == path and record["size"] == stat.st_size and record["mtime"] == stat.st_mtime_ns:
+                return record["hash"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+        digest = file_hash(path)
+        record = {"path": path, "size": stat.st_size, "mtime": stat.st_mtime_ns, "hash": digest}
+        self._write_atomic(record_path, json.dumps(record).encode())
+        return digest
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".pkl")
+
+    def _write_atomic(self, path, data):
+        # Write to a temporary file first so concurrent readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def get(self, key):
+        # Cached value, or None on a miss. An entry that cannot be loaded, e.g. pickled by older
+        # code whose classes or modules have changed, is removed and counts as a miss.
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except Exception:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            self.misses += 1
+            return None
+        # The modification time records the last use for LRU eviction
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self._write_atomic(self._path(key), pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+        self.evict()
+
+    def fetch(self, key, compute):
+        """
+        Returns the cached value for key, computing and storing it on a miss.
+
+        Parameters:
+            key (str): Cache key from StageCache.key, or None to bypass the cache.
+            compute (callable): Produces the value when it is not cached.
+        """
+        if key is None:
+            return compute()
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def evict(self):
+        # Remove least recently used entries until the cache fits in max_bytes
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".pkl"):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                # Already removed by another process, or still open on Windows
+                pass
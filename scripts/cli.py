@@ -0,0 +1,309 @@
+import time
+
+# Reference point of the cold-start times reported below, taken before anything heavy is imported
+START = time.perf_counter()
+
+import argparse
+import fnmatch
+import json
+import os
+import sys
+
+import lazy
+
+
+# Backends reported as loaded or not; each command imports only the ones it needs
+BACKENDS = ("open3d", "rhino3dm", "cv2", "pyarrow", "pandas", "flask")
+
+# Setup files picked up by the watch command
+SETUP_PATTERN = "setup_*.parquet"
+
+
+def loaded_backends():
+    return [name for name in BACKENDS if lazy.loaded(name)]
+
+
+def report_start(label):
+    # On stderr, so the output of a command stays machine readable
+    print("%s after %.2f s, backends loaded: %s" % (label, time.perf_counter() - START, ", ".join(loaded_backends()) or "none"),
+          file=sys.stderr)
+
+
+def setup_name(setup):
+    # "3" -> "setup_3.parquet"; file names are kept as they are
+    return setup if setup.endswith(".parquet") else "setup_" + setup + ".parquet"
+
+
+def configure(args):
+    # Imports run and points it at the directories of the command line
+    import run
+
+    run.configureDirectories(args.data_dir, args.model_dir, args.cache_dir)
+    if args.model_dir:
+        os.makedirs(run.MODEL_DIR, exist_ok=True)
+    if args.profile:
+        import instrument
+
+        instrument.enable(args.profile)
+    return run
+
+
+def warm_up(run):
+    # Loads the backends run loads lazily, so their import time is not charged to the first scan's stages
+    run.o3d.geometry
+    run.rhino3dm.Mesh
+
+
+def run_options(run, args):
+    # Keyword arguments of run.run given on the command line
+    options = {"planar": args.planar}
+    if getattr(args, "pixel_size", None):
+        options["pixelSize"] = args.pixel_size
+    if args.lod:
+        options["lodBudgets"] = run.LOD_BUDGETS
+    return options
+
+
+def command_run(args):
+    # Runs the given setups, or all of them, and exits with 1 if any failed
+    run = configure(args)
+    if args.setups == ["all"]:
+        warm_up(run)
+        report_start("Started")
+        results = run.runAll(args.workers, args.streaming, args.profile, args.start_method, **run_options(run, args))
+    else:
+        names = [setup_name(s) for s in args.setups]
+        # Missing files fail here, before Open3D and Rhino3dm are loaded
+        missing = [run.DATA_DIR + n for n in names if not os.path.isfile(run.DATA_DIR + n)]
+        if missing:
+            sys.exit("File does not exist: " + ", ".join(missing))
+        warm_up(run)
+        report_start("Started")
+        results = [run.runSetup(name, None, args.workers, args.streaming, **run_options(run, args)) for name in names]
+        run.printSummary(results)
+    report_start("Finished")
+    return 1 if any(r["status"] == "failed" for r in results) else 0
+
+
+def command_outline(args):
+    # Outlines one scan and prints it as JSON: needs OpenCV, pandas and Arrow, not Open3D or Rhino3dm
+    import outline
+    import scan
+
+    run = configure(args)
+    path = args.setup if os.path.isfile(args.setup) else run.DATA_DIR + setup_name(args.setup)
+    if not os.path.isfile(path):
+        sys.exit("File does not exist: " + path)
+    df = scan.load_indexed(path)
+    if args.pixel_size:
+        rooms, room_height, endpoints, z_bound = outline.main_tiled(df, args.pixel_size)
+    else:
+        final_fp, room_height, endpoints, z_bound = outline.main(df, engine=args.engine)
+        rooms = [final_fp]
+    json.dump({
+        "rooms": [room.tolist() for room in rooms],
+        "room_height": [float(z) for z in room_height],
+        "windows": [e.tolist() for e in endpoints],
+        "window_z": [z.tolist() for z in z_bound],
+    }, sys.stdout)
+    print()
+    report_start("Finished")
+    return 0
+
+
+def command_sunhours(args):
+    # Sun hours of each setup for each period, as ViewerData files: needs OpenCV, pandas and Arrow, not Open3D or Rhino3dm
+    import outline
+    import scan
+    import sunhours
+    import viewerdata
+
+    run = configure(args)
+    paths = [s if os.path.isfile(s) else run.DATA_DIR + setup_name(s) for s in args.setups]
+    missing = [p for p in paths if not os.path.isfile(p)]
+    if missing:
+        sys.exit("File does not exist: " + ", ".join(missing))
+    output_dir = args.output_dir or run.MODEL_DIR
+    os.makedirs(output_dir, exist_ok=True)
+    days = [tuple(int(x) for x in day.split("-")) for day in args.days] if args.days else sunhours.DEFAULT_DAYS
+    location = tuple(args.location) if args.location else sunhours.DEFAULT_LOCATION
+
+    grid_size = args.grid_size or sunhours.GRID_SIZE
+
+    failed = 0
+    for path in paths:
+        stem = os.path.splitext(os.path.basename(path))[0]
+        try:
+            outline_result = outline.main(scan.load_indexed(path), engine=args.engine)
+            # The occluders depend only on the room, so every period reuses them
+            bvh = sunhours.Bvh(*sunhours.room_occluders(*outline_result))
+            for period in args.periods:
+                start = time.perf_counter()
+                mesh = sunhours.analyse(outline_result, period, days, location, args.north, grid_size, bvh=bvh)
+                target = os.path.join(output_dir, "%s_SunHours_%s" % (stem, period))
+                viewerdata.write_viewer_text(target + ".txt", mesh)
+                if args.glb:
+                    # The hours themselves, coloured by the viewer with the legend
+                    viewerdata.write_glb(target + ".glb", mesh)
+                print("%s %s: %d points, %.2f average hours in %.2f s" % (
+                    stem, period, len(mesh["faces"]), mesh["metrics"]["Average_Daylight_Hours"], time.perf_counter() - start))
+        except Exception as e:
+            # One bad scan does not stop the batch
+            failed += 1
+            print("%s failed: %s" % (stem, e), file=sys.stderr)
+    report_start("Finished")
+    return 1 if failed else 0
+
+
+def command_tiles(args):
+    # Octree tiles of each setup for the viewer, in <output dir>/<setup>/: no Open3D or Rhino3dm
+    import octree
+
+    run = configure(args)
+    paths = [s if os.path.isfile(s) else run.DATA_DIR + setup_name(s) for s in args.setups]
+    missing = [p for p in paths if not os.path.isfile(p)]
+    if missing:
+        sys.exit("File does not exist: " + ", ".join(missing))
+    for path in paths:
+        start = time.perf_counter()
+        target = os.path.join(args.output_dir, os.path.splitext(os.path.basename(path))[0])
+        index = octree.export_scan(path, target, args.max_points, args.workers)
+        print("%s: %d points in %d tiles in %.2f s" % (target, index["points"], len(index["nodes"]), time.perf_counter() - start))
+    report_start("Finished")
+    return 0
+
+
+def pending_setups(data_dir, seen, sizes):
+    """
+    Setup files of data_dir that are new and done being written.
+
+    A file counts as written once its size and modification time are the
+    same at two polls in a row, so a copy in progress is not picked up.
+
+    Parameters:
+        data_dir (str): Directory watched.
+        seen (set): Names already processed, left untouched.
+        sizes (dict): (size, mtime) of each new file at the previous poll, updated.
+
+    Returns:
+        list: Names ready to process, in name order.
+    """
+    ready = []
+    for name in sorted(fnmatch.filter(os.listdir(data_dir), SETUP_PATTERN)):
+        if name in seen:
+            continue
+        try:
+            stat = os.stat(os.path.join(data_dir, name))
+        except OSError:
+            continue  # removed since the listing
+        state = (stat.st_size, stat.st_mtime_ns)
+        if sizes.get(name) == state:
+            ready.append(name)
+            del sizes[name]
+        else:
+            sizes[name] = state
+    return ready
+
+
+def command_watch(args):
+    # Keeps one process with the backends loaded and runs every setup file that lands in the data directory
+    run = configure(args)
+    data_dir = run.DATA_DIR
+    warm_up(run)
+    report_start("Warm")
+
+    seen = set() if args.existing else set(fnmatch.filter(os.listdir(data_dir), SETUP_PATTERN))
+    sizes = {}
+    results = []
+    print("Watching %s for %s (%d existing files skipped)" % (data_dir, SETUP_PATTERN, len(seen)))
+    try:
+        while args.max_files is None or len(results) < args.max_files:
+            for name in pending_setups(data_dir, seen, sizes):
+                landed = os.path.getmtime(os.path.join(data_dir, name))
+                result = run.runSetup(name, None, args.workers, args.streaming, **run_options(run, args))
+                seen.add(name)
+                results.append(result)
+                # From the last write of the file to its model: polling delay plus processing
+                print("%s %s in %.2f s, %.2f s after it landed" % (
+                    name, result["status"], result["seconds"], time.time() - landed))
+                if args.max_files is not None and len(results) >= args.max_files:
+                    break
+            else:
+                time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+    if results:
+        run.printSummary(results)
+    return 1 if any(r["status"] == "failed" for r in results) else 0
+
+
+def parser():
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--data-dir", help="Directory of the parquet scans (default: run.DATA_DIR)")
+    common.add_argument("--model-dir", help="Directory the 3dm models are written to (default: run.MODEL_DIR)")
+    common.add_argument("--cache-dir", help="Directory of the stage cache (default: run.CACHE_DIR)")
+    common.add_argument("--workers", type=int, help="Worker processes for the Poisson reconstructions, or the setups of 'all'")
+    common.add_argument("--streaming", action="store_true", help="Stream each scan instead of loading it whole")
+    common.add_argument("--planar", action="store_true", help="Planar walls, floor and ceiling instead of Poisson")
+    common.add_argument("--lod", action="store_true", help="Write the levels of detail of run.LOD_BUDGETS")
+    common.add_argument("--profile", help="Stage timings: 1 prints them as JSON lines, a path appends them to a file")
+
+    main = argparse.ArgumentParser(description="Turn room scans into Rhino models.")
+    commands = main.add_subparsers(dest="command", required=True)
+
+    run_command = commands.add_parser("run", parents=[common], help="Process setups and exit")
+    run_command.add_argument("setups", nargs="+", help="Setup numbers or file names, or 'all'")
+    run_command.add_argument("--start-method", choices=["spawn", "fork", "forkserver"],
+                             help="Start method of the worker processes of 'all', e.g. spawn as on Windows")
+    run_command.add_argument("--pixel-size", type=float, help="Outline every room at this resolution in metres; needs the whole scan")
+    run_command.set_defaults(handler=command_run)
+
+    outline_command = commands.add_parser("outline", parents=[common], help="Print the outline of a scan as JSON")
+    outline_command.add_argument("setup", help="Setup number, file name or path")
+    outline_command.add_argument("--engine", choices=["raster", "hull"], default="raster", help="Footprint engine of outline.main")
+    outline_command.add_argument("--pixel-size", type=float, help="Outline every room at this resolution in metres")
+    outline_command.set_defaults(handler=command_outline)
+
+    sun_command = commands.add_parser("sunhours", parents=[common], help="Write the sun hours on the floor of setups as ViewerData files")
+    sun_command.add_argument("setups", nargs="+", help="Setup numbers, file names or paths")
+    sun_command.add_argument("--periods", nargs="+", default=["8_12", "12_16", "16_20"], help="Hour windows, e.g. 8_12")
+    sun_command.add_argument("--days", nargs="+", help="Days traced as month-day, e.g. 6-21 (default: sunhours.DEFAULT_DAYS)")
+    sun_command.add_argument("--location", type=float, nargs=3, metavar=("LAT", "LON", "UTC"),
+                             help="Latitude, longitude and UTC offset (default: sunhours.DEFAULT_LOCATION)")
+    sun_command.add_argument("--north", type=float, default=0.0, help="Angle of north from +y, counter-clockwise, in degrees")
+    sun_command.add_argument("--grid-size", type=float, help="Spacing of the floor grid in metres (default: sunhours.GRID_SIZE)")
+    sun_command.add_argument("--engine", choices=["raster", "hull"], default="raster", help="Footprint engine of outline.main")
+    sun_command.add_argument("--output-dir", help="Directory of the ViewerData files (default: the model directory)")
+    sun_command.add_argument("--glb", action="store_true", help="Also write the hours and their legend as GLB files")
+    sun_command.set_defaults(handler=command_sunhours)
+
+    tiles_command = commands.add_parser("tiles", parents=[common], help="Write setups as octree point tiles for the viewer")
+    tiles_command.add_argument("setups", nargs="+", help="Setup numbers, file names or paths")
+    tiles_command.add_argument("--output-dir", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "..",
+                                                                    "3d-scan-viewer", "public", "data"),
+                               help="Directory of the tile sets, one per setup (default: the viewer's public/data)")
+    tiles_command.add_argument("--max-points", type=int, default=100_000, help="Most points in a tile")
+    tiles_command.set_defaults(handler=command_tiles)
+
+    watch_command = commands.add_parser("watch", parents=[common], help="Process each new setup as it lands")
+    watch_command.add_argument("--interval", type=float, default=2.0, help="Seconds between polls of the data directory")
+    watch_command.add_argument("--existing", action="store_true", help="Also process the setups already there")
+    watch_command.add_argument("--max-files", type=int, help="Exit after this many setups")
+    watch_command.add_argument("--pixel-size", type=float, help="Outline every room at this resolution in metres; needs the whole scan")
+    watch_command.set_defaults(handler=command_watch)
+    return main
+
+
+if __name__ == "__main__":
+    # python cli.py run 1 2 --data-dir ../data --model-dir ../models
+    # python cli.py run all --workers 4
+    # python cli.py outline 1 --engine hull
+    # python cli.py sunhours 1 2 --periods 8_12 12_16 --output-dir ../ViewerData
+    # python cli.py tiles 1 2 --data-dir ../data
+    # python cli.py watch --data-dir ../data --interval 1
+    main = parser()
+    args = main.parse_args()
+    if getattr(args, "pixel_size", None) and args.streaming and args.command != "outline":
+        # The tiled outline rasterises the whole scan at once, which streaming never holds
+        main.error("--pixel-size cannot be combined with --streaming")
+    sys.exit(args.handler(args))
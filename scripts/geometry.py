@@ -0,0 +1,372 @@
+import numpy as np
+
+import lazy
+
+rhino3dm = lazy.lazy_import("rhino3dm")
+
+
+# rhino3dm has no bulk-add API, so every builder below converts whole NumPy
+# arrays to Python lists once and feeds them to pre-bound Add methods. This
+# avoids the per-element NumPy indexing and attribute lookups that dominate
+# the cost of building large meshes.
+
+
+def to_rgb255(colors):
+    """
+    Converts vertex colours to 0-255 integers.
+
+    Parameters:
+        colors (np.ndarray): (N, 3) colours, floats in [0, 1] or integers in [0, 255].
+
+    Returns:
+        np.ndarray: (N, 3) int64 colours.
+    """
+    colors = np.asarray(colors)
+    if np.issubdtype(colors.dtype, np.floating):
+        # Truncate like int(colour * 255)
+        return (colors * 255).astype(np.int64)
+    return colors.astype(np.int64)
+
+
+def mesh_from_arrays(vertices, faces, colors=None, compute_normals=False):
+    """
+    Builds a Rhino3dm mesh from whole vertex, face and colour arrays.
+
+    Parameters:
+        vertices (np.ndarray): (N, 3) vertex positions.
+        faces (np.ndarray): (F, 3) triangles or (F, 4) quads as vertex indices.
+        colors (np.ndarray): Optional (N, 3) vertex colours, see to_rgb255.
+        compute_normals (bool): Compute vertex normals once the mesh is built.
+
+    Returns:
+        rhino3dm.Mesh: The mesh.
+    """
+    mesh = rhino3dm.Mesh()
+
+    add_vertex = mesh.Vertices.Add
+    for x, y, z in np.asarray(vertices, dtype=np.float64).reshape(-1, 3).tolist():
+        add_vertex(x, y, z)
+
+    if colors is not None and len(colors) > 0:
+        add_color = mesh.VertexColors.Add
+        for r, g, b in to_rgb255(colors).reshape(-1, 3).tolist():
+            add_color(r, g, b)
+
+    faces = np.asarray(faces, dtype=np.int64)
+    add_face = mesh.Faces.AddFace
+    if faces.size > 0:
+        for face in faces.reshape(len(faces), -1).tolist():
+            add_face(*face)
+
+    if compute_normals:
+        mesh.Normals.ComputeNormals()
+    return mesh
+
+
+def mesh_from_arrays_loop(vertices, faces, colors=None):
+    # Reference builder: one indexed Add call per element, as o3d_to_rhino3dm used to do
+    mesh = rhino3dm.Mesh()
+    for vertex in vertices:
+        mesh.Vertices.Add(vertex[0], vertex[1], vertex[2])
+    if colors is not None:
+        for colour in colors:
+            mesh.VertexColors.Add(int(colour[0]*255), int(colour[1]*255), int(colour[2]*255))
+    for face in faces:
+        mesh.Faces.AddFace(*face)
+    return mesh
+
+
+def open_polyline(points):
+    # Drop the repeated closing point of a closed polyline
+    points = np.asarray(points, dtype=np.float64)
+    if len(points) > 1 and np.array_equal(points[0, :2], points[-1, :2]):
+        return points[:-1]
+    return points
+
+
+def extrusion_arrays(xy, z_bottom, z_top, closed=True):
+    """
+    Builds the vertex and quad arrays of a vertical strip extruded from a 2D polyline.
+
+    Every polyline point appears once at the bottom and once at the top, so
+    neighbouring quads share their vertices.
+
+    Parameters:
+        xy (np.ndarray): (N, 2) polyline points.
+        z_bottom (float): Bottom height of the strip.
+        z_top (float): Top height of the strip.
+        closed (bool): Add the segment from the last point back to the first.
+
+    Returns:
+        tuple: (2N, 3) vertices and (S, 4) quad faces.
+    """
+    xy = np.asarray(xy, dtype=np.float64)[:, :2]
+    n = len(xy)
+    vertices = np.empty((2 * n, 3))
+    vertices[:n, :2] = xy
+    vertices[:n, 2] = z_bottom
+    vertices[n:, :2] = xy
+    vertices[n:, 2] = z_top
+
+    start = np.arange(n if closed else n - 1)
+    end = (start + 1) % n
+    # Same winding as the per-segment meshes: bottom A, top A, top B, bottom B
+    faces = np.column_stack((start, start + n, end + n, end))
+    return vertices, faces
+
+
+def densify_polyline(xy, max_length, closed=True):
+    # Splits every segment of a polyline evenly into pieces at most max_length long
+    xy = np.asarray(xy, dtype=np.float64)[:, :2]
+    ends = np.roll(xy, -1, axis=0) if closed else xy[1:]
+    starts = xy if closed else xy[:-1]
+    pieces = np.maximum(1, np.ceil(np.linalg.norm(ends - starts, axis=1) / max_length)).astype(np.int64)
+    segment = np.repeat(np.arange(len(starts)), pieces)
+    t = (np.arange(pieces.sum()) - np.repeat(np.cumsum(pieces) - pieces, pieces)) / pieces[segment]
+    points = starts[segment] + t[:, np.newaxis] * (ends[segment] - starts[segment])
+    return points if closed else np.vstack((points, xy[-1:]))
+
+
+def extrusion_grid_arrays(xy, z_levels, closed=True):
+    """
+    Builds the vertex and quad arrays of a vertical strip extruded from a 2D
+    polyline through several heights, like extrusion_arrays with rows of quads.
+
+    Parameters:
+        xy (np.ndarray): (N, 2) polyline points.
+        z_levels (np.ndarray): (L,) increasing heights, bottom to top.
+        closed (bool): Add the segment from the last point back to the first.
+
+    Returns:
+        tuple: (L * N, 3) vertices, level by level, and (S * (L - 1), 4) quad faces.
+    """
+    xy = np.asarray(xy, dtype=np.float64)[:, :2]
+    z_levels = np.asarray(z_levels, dtype=np.float64)
+    n = len(xy)
+    vertices = np.empty((len(z_levels), n, 3))
+    vertices[:, :, :2] = xy
+    vertices[:, :, 2] = z_levels[:, np.newaxis]
+
+    start = np.arange(n if closed else n - 1)
+    end = (start + 1) % n
+    row = n * np.arange(len(z_levels) - 1)[:, np.newaxis]
+    # Winding of extrusion_arrays: bottom A, top A, top B, bottom B
+    faces = np.stack((start + row, start + row + n, end + row + n, end + row), axis=-1)
+    return vertices.reshape(-1, 3), faces.reshape(-1, 4)
+
+
+def extrusion_mesh(xy, z_bottom, z_top, closed=True):
+    vertices, faces = extrusion_arrays(xy, z_bottom, z_top, closed)
+    return mesh_from_arrays(vertices, faces, compute_normals=True)
+
+
+def quads_to_triangles(faces):
+    # Splits (F, 4) quads into (2F, 3) triangles with the same winding
+    faces = np.asarray(faces, dtype=np.int64).reshape(-1, 4)
+    return np.concatenate((faces[:, [0, 1, 2]], faces[:, [0, 2, 3]]))
+
+
+def signed_area(xy):
+    # Area of a 2D polygon, positive when its points run counter-clockwise
+    xy = np.asarray(xy, dtype=np.float64)
+    x, y = xy[:, 0], xy[:, 1]
+    return 0.5 * (np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1)))
+
+
+def counter_clockwise(xy):
+    xy = np.asarray(xy, dtype=np.float64)
+    return xy[::-1] if signed_area(xy) < 0 else xy
+
+
+def points_in_polygon(points, polygon):
+    # Whether each 2D point is inside the polygon, by the even-odd rule over its edges
+    points = np.asarray(points, dtype=np.float64)
+    polygon = np.asarray(polygon, dtype=np.float64)[:, :2]
+    x, y = points[:, 0], points[:, 1]
+    inside = np.zeros(len(points), dtype=bool)
+    for (x0, y0), (x1, y1) in zip(polygon.tolist(), np.roll(polygon, -1, axis=0).tolist()):
+        if y0 == y1:
+            continue
+        crosses = (y0 > y) != (y1 > y)
+        inside ^= crosses & (x < x0 + (y - y0) * (x1 - x0) / (y1 - y0))
+    return inside
+
+
+def triangulate_polygon(xy):
+    """
+    Triangulates a simple polygon by ear clipping.
+
+    Concave polygons are handled; footprints have tens of vertices, so the
+    quadratic search for ears costs next to nothing.
+
+    Parameters:
+        xy (np.ndarray): (N, 2) polygon points, counter-clockwise, without a repeated closing point.
+
+    Returns:
+        np.ndarray: (N - 2, 3) counter-clockwise triangles as indices into xy.
+    """
+    xy = np.asarray(xy, dtype=np.float64)[:, :2]
+    remaining = list(range(len(xy)))
+    triangles = []
+
+    def cross(i, j, k):
+        return (xy[j, 0] - xy[i, 0]) * (xy[k, 1] - xy[i, 1]) - (xy[j, 1] - xy[i, 1]) * (xy[k, 0] - xy[i, 0])
+
+    while len(remaining) > 3:
+        m = len(remaining)
+        for k in range(m):
+            i, j, l = remaining[k - 1], remaining[k], remaining[(k + 1) % m]
+            if cross(i, j, l) <= 0:
+                continue  # reflex or collinear corner
+            # An ear holds none of the other points
+            others = np.array([p for p in remaining if p not in (i, j, l)])
+            p = xy[others]
+            a, b, c = xy[i], xy[j], xy[l]
+            inside = ((b[0] - a[0]) * (p[:, 1] - a[1]) - (b[1] - a[1]) * (p[:, 0] - a[0]) >= 0) & \
+                     ((c[0] - b[0]) * (p[:, 1] - b[1]) - (c[1] - b[1]) * (p[:, 0] - b[0]) >= 0) & \
+                     ((a[0] - c[0]) * (p[:, 1] - c[1]) - (a[1] - c[1]) * (p[:, 0] - c[0]) >= 0)
+            if not inside.any():
+                break
+        else:
+            # Only collinear or self-intersecting corners are left: clip the first one anyway
+            k = 0
+            i, j, l = remaining[-1], remaining[0], remaining[1]
+        triangles.append((i, j, l))
+        del remaining[k]
+    if len(remaining) == 3:
+        triangles.append(tuple(remaining))
+    return np.array(triangles, dtype=np.int64).reshape(-1, 3)
+
+
+# Triangles replacing a triangle (a, b, c) by the pattern of its split edges, as positions in
+# (a, b, c, mid ab, mid bc, mid ca); the pattern bits are the edges ab, bc and ca from low to high
+SPLIT_TEMPLATES = {
+    0b000: [(0, 1, 2)],
+    0b001: [(0, 3, 2), (3, 1, 2)],
+    0b010: [(0, 1, 4), (0, 4, 2)],
+    0b100: [(0, 1, 5), (1, 2, 5)],
+    0b011: [(3, 1, 4), (0, 3, 4), (0, 4, 2)],
+    0b110: [(4, 2, 5), (0, 1, 4), (0, 4, 5)],
+    0b101: [(0, 3, 5), (3, 1, 2), (3, 2, 5)],
+    0b111: [(0, 3, 5), (3, 1, 4), (5, 4, 2), (3, 4, 5)],
+}
+
+
+def subdivide_long_edges(vertices, triangles, max_length):
+    """
+    Splits the edges longer than max_length at their midpoints until none is left.
+
+    Each round splits only the long edges, so every triangle is refined
+    according to its own size and the triangle count follows the area over
+    max_length squared. An edge is split in both triangles sharing it, so the
+    result stays free of T-junctions, and the triangles keep their orientation.
+
+    Parameters:
+        vertices (np.ndarray): (N, 3) vertices.
+        triangles (np.ndarray): (T, 3) triangles as indices into vertices.
+        max_length (float): Longest edge of the result.
+
+    Returns:
+        tuple: (N', 3) vertices, the input ones first, and (T', 3) triangles.
+    """
+    vertices = np.asarray(vertices, dtype=np.float64)
+    triangles = np.asarray(triangles, dtype=np.int64).reshape(-1, 3)
+    while len(triangles):
+        ends = np.stack((triangles, np.roll(triangles, -1, axis=1)), axis=2)
+        lengths = np.linalg.norm(vertices[ends[..., 1]] - vertices[ends[..., 0]], axis=2)
+        split = lengths > max_length
+        if not split.any():
+            break
+        # One midpoint per long edge, shared by both of its triangles
+        pairs = np.sort(ends[split], axis=1)
+        unique_pairs, inverse = np.unique(pairs, axis=0, return_inverse=True)
+        middle = np.full(triangles.shape, -1, dtype=np.int64)
+        middle[split] = len(vertices) + inverse.reshape(-1)
+        vertices = np.concatenate((vertices, vertices[unique_pairs].mean(axis=1)))
+        local = np.concatenate((triangles, middle), axis=1)
+        pattern = split[:, 0] | (split[:, 1] << 1) | (split[:, 2] << 2)
+        triangles = np.concatenate([local[pattern == bits][:, template].reshape(-1, 3)
+                                    for bits, template in SPLIT_TEMPLATES.items()])
+    return vertices, triangles
+
+
+def polyline_from_array(points):
+    """
+    Builds a Rhino3dm polyline from an (N, 3) point array.
+
+    Parameters:
+        points (np.ndarray): (N, 3) polyline points.
+
+    Returns:
+        rhino3dm.Polyline: The polyline.
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    polyline = rhino3dm.Polyline(len(points))
+    add_point = polyline.Add
+    for x, y, z in points.tolist():
+        add_point(x, y, z)
+    return polyline
+
+
+def polyline_to_array(polyline):
+    # (N, 3) array of the points of a Rhino3dm polyline
+    return np.array([[pt.X, pt.Y, pt.Z] for pt in polyline], dtype=np.float64).reshape(-1, 3)
+
+
+if __name__ == "__main__":
+    # Compare the bulk builder against the per-element loop on an Open3D mesh:
+    #   python geometry.py [mesh.ply]
+    # Without a file, a dense sphere stands in for a depth-9 Poisson mesh.
+    import os
+    import sys
+    import tempfile
+    import time
+
+    import open3d as o3d
+
+    if len(sys.argv) > 1:
+        o3d_mesh = o3d.io.read_triangle_mesh(sys.argv[1])
+    else:
+        o3d_mesh = o3d.geometry.TriangleMesh.create_sphere(radius=1.0, resolution=300)
+        o3d_mesh.vertex_colors = o3d.utility.Vector3dVector(np.random.rand(len(o3d_mesh.vertices), 3))
+
+    vertices = np.asarray(o3d_mesh.vertices)
+    faces = np.asarray(o3d_mesh.triangles)
+    colors = np.asarray(o3d_mesh.vertex_colors)
+
+    def write_size(*meshes):
+        model = rhino3dm.File3dm()
+        for mesh in meshes:
+            model.Objects.AddMesh(mesh)
+        path = os.path.join(tempfile.mkdtemp(), "geometry.3dm")
+        model.Write(path, 6)
+        return os.path.getsize(path)
+
+    start = time.perf_counter()
+    loop_mesh = mesh_from_arrays_loop(o3d_mesh.vertices, o3d_mesh.triangles, o3d_mesh.vertex_colors)
+    loop_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    bulk_mesh = mesh_from_arrays(vertices, faces, colors)
+    bulk_time = time.perf_counter() - start
+
+    print("Vertices: " + str(len(vertices)) + ", triangles: " + str(len(faces)))
+    print("Per-element loop: %.3f s, %d bytes" % (loop_time, write_size(loop_mesh)))
+    print("Bulk builder:     %.3f s, %d bytes" % (bulk_time, write_size(bulk_mesh)))
+
+    # Walls of a 200-sided room: one mesh per segment appended together vs shared vertices
+    angles = np.linspace(0, 2 * np.pi, 200, endpoint=False)
+    xy = np.column_stack((np.cos(angles), np.sin(angles)))
+    start = time.perf_counter()
+    holder = rhino3dm.Mesh()
+    for i in range(len(xy)):
+        segment = extrusion_mesh(xy[[i, (i + 1) % len(xy)]], 0.0, 2.7, closed=False)
+        holder.Append(segment)
+    segment_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    shared = extrusion_mesh(xy, 0.0, 2.7)
+    shared_time = time.perf_counter() - start
+
+    print("Walls per segment: %.4f s, %d bytes" % (segment_time, write_size(holder)))
+    print("Walls shared:      %.4f s, %d bytes" % (shared_time, write_size(shared)))
@@ -0,0 +1,139 @@
+import os
+
+from flask import Flask, jsonify
+import ghhops_server as hs
+
+import cache
+import run
+
+
+# Decoded scans and derived results stay in this process between Grasshopper
+# recomputes, so only the stages whose inputs changed are computed again.
+# Misses fall through to the on-disk stage cache of run.py.
+MEMORY_CACHE_BYTES = 4 * 1024 ** 3
+memory = cache.MemoryCache(MEMORY_CACHE_BYTES)
+
+
+# register hops app as middleware
+app = Flask(__name__)
+hops: hs.HopsFlask = hs.Hops(app)
+
+
+def loadScan(name):
+    # Decoded scan and its stage cache key; reloaded when the file changes on disk
+    path = run.DATA_DIR + name
+    stat = os.stat(path)
+    key = cache.stage_key("scan", os.path.abspath(path), size=stat.st_size, mtime=stat.st_mtime_ns)
+    return memory.fetch(key, lambda: (run.loadSetup(name), run.getStageCache().scan_key(path)))
+
+
+def getOutline(name, imageSize=500, padding=50):
+    df, scanKey = loadScan(name)
+    key = cache.stage_key("outline", scanKey, imageSize=imageSize, padding=padding)
+    return memory.fetch(key, lambda: run.outlineStage(df, scanKey, (imageSize, imageSize), padding))
+
+
+def getCategoryMeshes(name, voxelSize=0.03, sampleSize=None, depth=9, densityPercentile=5):
+    df, scanKey = loadScan(name)
+    key = cache.stage_key("categoryMeshes", scanKey, voxelSize=voxelSize, sampleSize=sampleSize, depth=depth,
+                          densityPercentile=densityPercentile)
+    return memory.fetch(key, lambda: run.categoryMeshes(
+        run.categorySamples(df, voxelSize, sampleSize), sampleKey=run.sampleKeyFor(scanKey, voxelSize, sampleSize),
+        depth=depth, densityPercentile=densityPercentile))
+
+
+@app.route("/cachestats")
+def cachestats():
+    return jsonify(memory.stats())
+
+
+#-- Floorplan component --#
+@hops.component(
+    "/floorplan",
+    name="Floorplan",
+    description="Floorplan outline and room height of a setup",
+    inputs=[
+        hs.HopsString("Setup", "S", "Parquet file name of the setup, e.g. setup_0.parquet"),
+        hs.HopsInteger("Image size", "I", "Size of the outline raster in pixels", default=500),
+        hs.HopsInteger("Padding", "P", "Padding around the outline raster in pixels", default=50),
+    ],
+    outputs=[
+        hs.HopsCurve("Outline", "O", "Floorplan outline at floor height"),
+        hs.HopsNumber("Floor", "F", "Floor height"),
+        hs.HopsNumber("Ceiling", "C", "Ceiling height"),
+    ]
+)
+def floorplan(setup: str, imageSize: int = 500, padding: int = 50):
+    final_fp, room_height, _, _ = getOutline(setup, imageSize, padding)
+    pLine = run.getPolyline(final_fp, room_height[0])
+    return pLine.ToPolylineCurve(), float(room_height[0]), float(room_height[1])
+
+
+#-- Windows component --#
+@hops.component(
+    "/windows",
+    name="Windows",
+    description="Window openings of a setup projected onto the floorplan outline",
+    inputs=[
+        hs.HopsString("Setup", "S", "Parquet file name of the setup, e.g. setup_0.parquet"),
+        hs.HopsInteger("Image size", "I", "Size of the outline raster in pixels", default=500),
+        hs.HopsInteger("Padding", "P", "Padding around the outline raster in pixels", default=50),
+    ],
+    outputs=[
+        hs.HopsMesh("Windows", "W", "One mesh per window", access=hs.HopsParamAccess.LIST),
+        hs.HopsCurve("Sills", "L", "Bottom line of each window", access=hs.HopsParamAccess.LIST),
+    ]
+)
+def windows(setup: str, imageSize: int = 500, padding: int = 50):
+    _, _, final_endpoint_lst, z_bound = getOutline(setup, imageSize, padding)
+    meshes = [run.windowMesh(points, z_bound[i]) for i, points in enumerate(final_endpoint_lst)]
+    sills = [run.getPolyline(points, z_bound[i][0]).ToPolylineCurve() for i, points in enumerate(final_endpoint_lst)]
+    return meshes, sills
+
+
+#-- Category meshes component --#
+@hops.component(
+    "/categorymeshes",
+    name="CategoryMeshes",
+    description="Poisson reconstructed walls, floor, ceiling and window meshes of a setup",
+    inputs=[
+        hs.HopsString("Setup", "S", "Parquet file name of the setup, e.g. setup_0.parquet"),
+        hs.HopsNumber("Voxel size", "V", "Voxel size of the walls, floor and ceiling downsampling", default=0.03),
+        hs.HopsInteger("Sample size", "N", "If above 0, points kept per category instead of the voxel size", default=0),
+        hs.HopsInteger("Depth", "D", "Poisson reconstruction depth", default=9),
+        hs.HopsNumber("Density percentile", "P", "Percentile of low-density vertices to remove", default=5),
+    ],
+    outputs=[
+        hs.HopsMesh("Walls", "W", "Walls mesh"),
+        hs.HopsMesh("Floor", "F", "Floor mesh"),
+        hs.HopsMesh("Ceiling", "C", "Ceiling mesh"),
+        hs.HopsMesh("Windows", "Wi", "Window mesh"),
+    ]
+)
+def categorymeshes(setup: str, voxelSize: float = 0.03, sampleSize: int = 0, depth: int = 9,
+                   densityPercentile: float = 5):
+    walls, floor, ceiling, window = getCategoryMeshes(setup, voxelSize, sampleSize or None, depth, densityPercentile)
+    return walls, floor, ceiling, window
+
+
+#-- Cache statistics component --#
+@hops.component(
+    "/cachestatistics",
+    name="CacheStatistics",
+    description="Hit rate and memory use of the server-side cache",
+    inputs=[
+        hs.HopsBoolean("Refresh", "R", "Toggle to refresh", default=True),
+    ],
+    outputs=[
+        hs.HopsNumber("Hit rate", "H", "Fraction of lookups served from memory"),
+        hs.HopsInteger("Entries", "E", "Number of cached values"),
+        hs.HopsNumber("Megabytes", "MB", "Estimated memory held by the cache"),
+    ]
+)
+def cachestatistics(refresh: bool = True):
+    stats = memory.stats()
+    return stats["hit_rate"], stats["entries"], stats["bytes"] / 1024 ** 2
+
+
+if __name__ == '__main__':
+    app.run()
@@ -0,0 +1,144 @@
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+# "1" prints stage records as JSON lines, any other value is a file they are appended to.
+# Set by enable() and inherited by worker processes.
+ENV_VAR = "SCAN_PROFILE"
+
+# Records of the stages run in the innermost collect() block, None outside of one
+records = None
+
+
+def enabled():
+    return os.environ.get(ENV_VAR, "") not in ("", "0")
+
+
+def enable(target="1"):
+    # Switches instrumentation on for this process and the worker processes it starts
+    os.environ[ENV_VAR] = str(target)
+
+
+def peak_rss():
+    # Peak resident set size of this process in bytes, or None when the platform does not report it
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024  # kilobytes on Linux
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.Process().memory_info().peak_wset
+
+
+@contextmanager
+def stage(name, **sizes):
+    """
+    Records the wall time, CPU time and peak RSS growth of the enclosed block.
+
+    The record is a dict yielded to the block, so output sizes known only at
+    the end (triangles, contour vertices, ...) can be added to it. Without
+    instrumentation the block runs unmeasured and the dict is discarded.
+
+    Parameters:
+        name (str): Stage name.
+        sizes: Input sizes of the stage, e.g. points=len(df).
+    """
+    record = {"stage": name, **sizes}
+    if not enabled():
+        yield record
+        return
+    peak = peak_rss()
+    cpu = time.process_time()
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record["wall"] = time.perf_counter() - start
+        record["cpu"] = time.process_time() - cpu
+        # Growth of the process high-water mark: memory the stage needed beyond any earlier peak
+        end_peak = peak_rss()
+        record["peak_rss_delta"] = end_peak - peak if peak is not None and end_peak is not None else None
+        add([record])
+
+
+def add(stage_records):
+    # Adds records, e.g. those returned by a worker process, to the current collect() block.
+    # Outside of one they are written straight away, so long-running processes (the Hops
+    # server, watch) do not hold every record they ever made.
+    if records is None:
+        emit(stage_records)
+    else:
+        records.extend(stage_records)
+
+
+@contextmanager
+def collect():
+    # Gathers the records of the stages run in the block into the yielded list.
+    # They are passed on to an enclosing collect() block as well.
+    global records
+    outer = records
+    records = []
+    inner = records
+    try:
+        yield inner
+    finally:
+        records = outer
+        if outer is not None:
+            outer.extend(inner)
+
+
+def emit(stage_records, **fields):
+    # Writes the records as JSON lines to the target set by enable(), each with the extra fields
+    target = os.environ.get(ENV_VAR, "")
+    if target in ("", "0"):
+        return
+    lines = "".join(json.dumps({**fields, **r}, default=float) + "\n" for r in stage_records)
+    if target == "1":
+        sys.stdout.write(lines)
+    else:
+        with open(target, "a") as f:
+            f.write(lines)
+
+
+def aggregate(stage_records):
+    """
+    Totals of the stage records of a batch, per stage.
+
+    Returns:
+        list: One dict per stage with count, total and mean wall time, max wall
+            time, total CPU time and the largest peak RSS growth.
+    """
+    by_stage = {}
+    for r in stage_records:
+        by_stage.setdefault(r["stage"], []).append(r)
+    summary = []
+    for name, rs in by_stage.items():
+        walls = [r["wall"] for r in rs]
+        peaks = [r["peak_rss_delta"] for r in rs if r.get("peak_rss_delta") is not None]
+        summary.append({
+            "stage": name,
+            "count": len(rs),
+            "wall": sum(walls),
+            "wall_mean": sum(walls) / len(walls),
+            "wall_max": max(walls),
+            "cpu": sum(r["cpu"] for r in rs),
+            "peak_rss_delta_max": max(peaks) if peaks else None,
+        })
+    return summary
+
+
+def print_aggregate(summary):
+    print("Stage timings:")
+    for s in sorted(summary, key=lambda s: -s["wall"]):
+        peak = "%8.1f MB" % (s["peak_rss_delta_max"] / 1024 ** 2) if s["peak_rss_delta_max"] is not None else "       n/a"
+        print("  %-22s %4d x  %9.2f s total  %8.2f s max  %9.2f s cpu  %s" % (
+            s["stage"], s["count"], s["wall"], s["wall_max"], s["cpu"], peak))
@@ -0,0 +1,36 @@
+import importlib.util
+import sys
+import types
+
+
+def lazy_import(name):
+    """
+    Imports a module that is only loaded on first use.
+
+    The module object is returned at once, but its code runs when one of
+    its attributes is first accessed. Scripts can then import heavy backends
+    (Open3D, Rhino3dm) at the top as usual, and a command that never touches
+    them does not pay for loading them.
+
+    Parameters:
+        name (str): Module name, e.g. "open3d".
+
+    Returns:
+        module: The module, loaded already if it was imported before.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError("No module named " + repr(name), name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+def loaded(name):
+    # Whether a module has been loaded, as opposed to not imported or imported lazily and not used yet
+    return type(sys.modules.get(name)) is types.ModuleType
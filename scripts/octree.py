@@ -0,0 +1,282 @@
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import scan
+import voxel
+
+
+# Most points in a tile; a node with more is split into eight children
+MAX_NODE_POINTS = 100_000
+# Cells per side of the grid a node keeps one point of before passing the rest to its children
+GRID_CELLS = 128
+# Nodes this deep keep all their points, so duplicate points cannot split forever
+MAX_DEPTH = 20
+# Index format version, raised when the tile layout changes
+FORMAT_VERSION = 2
+
+# Attributes of a tile, one block after the other: (name, dtype, components). Positions are
+# uint16 in the node's cube, position = low + q / 65535 * size. Blocks are ordered by item size,
+# largest first, so each one starts aligned for its type
+TILE_ATTRIBUTES = (
+    ("inst", "<u4", 1),
+    ("position", "<u2", 3),
+    ("color", "u1", 3),
+    ("cat", "u1", 1),
+)
+POSITION_MAX = 65535
+# Instance ids are stored whole; scans with larger ones are refused rather than wrapped
+INST_MAX = 0xFFFFFFFF
+
+
+def check_instances(inst):
+    # Raises ValueError when an instance id does not fit the inst attribute of the tiles
+    inst = np.asarray(inst)
+    if len(inst) and (inst.min() < 0 or inst.max() > INST_MAX):
+        raise ValueError("Instance ids must be in 0..%d, got %d..%d" % (INST_MAX, inst.min(), inst.max()))
+
+
+def tile_bytes(count):
+    return count * sum(np.dtype(dtype).itemsize * components for _, dtype, components in TILE_ATTRIBUTES)
+
+
+def write_tile(path, points, low, size):
+    # Writes the points of a node as the blocks of TILE_ATTRIBUTES; returns the file size
+    check_instances(points['inst'])
+    xyz = np.column_stack((points['x'], points['y'], points['z']))
+    q = np.rint((xyz - low) / size * POSITION_MAX)
+    blocks = {
+        "position": np.clip(q, 0, POSITION_MAX),
+        "color": np.column_stack((points['r'], points['g'], points['b'])),
+        "cat": points['cat'],
+        "inst": points['inst'],
+    }
+    with open(path, "wb") as f:
+        for name, dtype, _ in TILE_ATTRIBUTES:
+            f.write(np.ascontiguousarray(blocks[name], dtype=dtype).tobytes())
+    return tile_bytes(len(points['x']))
+
+
+def read_tile(path, low, size):
+    # Points of a tile written by write_tile, with positions back in metres
+    data = np.fromfile(path, dtype=np.uint8)
+    count = len(data) // tile_bytes(1)
+    points, offset = {}, 0
+    for name, dtype, components in TILE_ATTRIBUTES:
+        length = count * components * np.dtype(dtype).itemsize
+        block = data[offset:offset + length].view(dtype)
+        points[name] = block.reshape(count, components) if components > 1 else block
+        offset += length
+    points["position"] = np.asarray(low) + points["position"] / POSITION_MAX * size
+    return points
+
+
+def grid_subsample(points, low, size, max_points=MAX_NODE_POINTS, cells=GRID_CELLS):
+    """
+    One point of each occupied cell of a grid over a node, at most max_points.
+
+    The grid starts at cells per side and is halved until it keeps at most
+    max_points, so every tile stays under its size bound. The first point of
+    a cell in scan order is kept, so tiles hold original points.
+
+    Returns:
+        np.ndarray: Boolean mask of the points kept.
+    """
+    while True:
+        cell = size / cells
+        keys = voxel.voxel_keys(points['x'] - low[0], points['y'] - low[1], points['z'] - low[2], cell)
+        codes, unique_keys = pd.factorize(keys)
+        if len(unique_keys) <= max_points or cells == 1:
+            break
+        cells //= 2
+    # Index of the first point of each cell: later writes win, so write in reverse
+    first = np.empty(len(unique_keys), dtype=np.int64)
+    first[codes[::-1]] = np.arange(len(codes))[::-1]
+    keep = np.zeros(len(codes), dtype=bool)
+    keep[first] = True
+    return keep
+
+
+def split_children(points, low, size):
+    # (child, points) of the eight octants of a node that have points; child bits are x, y, z from high to low
+    half = size / 2
+    child = (((points['x'] >= low[0] + half).astype(np.int64) << 2)
+             | ((points['y'] >= low[1] + half).astype(np.int64) << 1)
+             | (points['z'] >= low[2] + half).astype(np.int64))
+    order = np.argsort(child, kind="stable")
+    counts = np.bincount(child, minlength=8)
+    bounds = np.concatenate(([0], np.cumsum(counts)))
+    return [(k, {c: v[order[bounds[k]:bounds[k + 1]]] for c, v in points.items()})
+            for k in range(8) if counts[k]]
+
+
+def child_low(low, size, child):
+    half = size / 2
+    return np.asarray(low, dtype=np.float64) + half * np.array([(child >> 2) & 1, (child >> 1) & 1, child & 1])
+
+
+def build_node(points, low, size, name, directory, max_points=MAX_NODE_POINTS, depth=0):
+    """
+    Writes a node and its subtree as tiles and returns their index entries.
+
+    A node with at most max_points points, or at MAX_DEPTH, is a leaf and
+    keeps them all. Otherwise it keeps a grid subsample as its level of detail
+    and passes the other points on to its children, so every point is in
+    exactly one tile and loading a node with all its ancestors adds detail
+    without duplicates.
+
+    Parameters:
+        points (dict): Column arrays x, y, z, r, g, b, cat and inst.
+        low (np.ndarray): Lowest corner of the node's cube.
+        size (float): Side of the node's cube.
+        name (str): Node name: "r" for the root, then one child digit per level.
+        directory (str): Directory of the tiles.
+        max_points (int): Most points in a tile.
+        depth (int): Level of the node, 0 for the root.
+
+    Returns:
+        dict: Index entry of each node of the subtree, by name.
+    """
+    count = len(points['x'])
+    if count <= max_points or depth >= MAX_DEPTH:
+        keep = np.ones(count, dtype=bool)
+    else:
+        keep = grid_subsample(points, low, size, max_points)
+    own = {c: v[keep] for c, v in points.items()}
+    write_tile(os.path.join(directory, name + ".bin"), own, low, size)
+    nodes = {name: {
+        "level": depth,
+        "low": [float(v) for v in low],
+        "size": float(size),
+        "points": int(keep.sum()),
+        "children": [],
+    }}
+    if keep.all():
+        return nodes
+    for child, child_points in split_children({c: v[~keep] for c, v in points.items()}, low, size):
+        nodes.update(build_node(child_points, child_low(low, size, child), size / 2, name + str(child), directory,
+                                max_points, depth + 1))
+        nodes[name]["children"].append(name + str(child))
+    return nodes
+
+
+def build_subtree(args):
+    # build_node of one child of the root, for worker processes
+    return build_node(*args)
+
+
+def subtree_points(nodes, name):
+    # Points in a node and all its descendants
+    return nodes[name]["points"] + sum(subtree_points(nodes, child) for child in nodes[name]["children"])
+
+
+def export_octree(points, directory, max_points=MAX_NODE_POINTS, workers=None):
+    """
+    Writes a point cloud as an octree of binary tiles with a JSON index, for
+    viewers that load only the levels of detail in view.
+
+    The octree is a cube over the points. Each tile holds at most max_points
+    points (see build_node) in the layout of TILE_ATTRIBUTES, keeping the
+    category and instance of every point. index.json lists the attributes and,
+    per node, its cube, level, point count, points in its subtree and children.
+    The root is built here and the subtrees of its children are built in
+    parallel on worker processes.
+
+    Layout:
+        index.json
+        tiles/r.bin, tiles/r0.bin, ..., tiles/r07.bin, ...
+
+    Parameters:
+        points (pd.DataFrame or dict): x, y, z, r, g, b, cat and inst columns.
+        directory (str): Output directory, created when missing.
+        max_points (int): Most points in a tile.
+        workers (int): Worker processes for the subtrees, defaults to the CPU count; 1 builds them in this process.
+
+    Returns:
+        dict: The index.
+    """
+    points = {c: np.asarray(points[c]) for c in scan.SCAN_COLUMNS}
+    if not len(points['x']):
+        raise ValueError("No points to export")
+    # Checked up front as well, so a bad scan fails before any tile is written
+    check_instances(points['inst'])
+    xyz = np.column_stack((points['x'], points['y'], points['z'])).astype(np.float64)
+    scan_low, scan_high = xyz.min(axis=0), xyz.max(axis=0)
+    # A cube, slightly larger than the points so the highest ones fall inside it
+    size = float((scan_high - scan_low).max()) * (1 + 1e-6) or 1.0
+    low = scan_low
+
+    tile_directory = os.path.join(directory, "tiles")
+    os.makedirs(tile_directory, exist_ok=True)
+    count = len(points['x'])
+    if count <= max_points:
+        nodes = build_node(points, low, size, "r", tile_directory, max_points)
+    else:
+        keep = grid_subsample(points, low, size, max_points)
+        write_tile(os.path.join(tile_directory, "r.bin"), {c: v[keep] for c, v in points.items()}, low, size)
+        children = split_children({c: v[~keep] for c, v in points.items()}, low, size)
+        tasks = [(child_points, child_low(low, size, child), size / 2, "r" + str(child), tile_directory, max_points, 1)
+                 for child, child_points in children]
+        workers = max(1, min(workers or os.cpu_count() or 1, len(tasks)))
+        if workers == 1:
+            subtrees = [build_subtree(task) for task in tasks]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                subtrees = list(pool.map(build_subtree, tasks))
+        nodes = {"r": {"level": 0, "low": [float(v) for v in low], "size": size, "points": int(keep.sum()),
+                       "children": ["r" + str(child) for child, _ in children]}}
+        for subtree in subtrees:
+            nodes.update(subtree)
+
+    for name, node in nodes.items():
+        node["subtree_points"] = subtree_points(nodes, name)
+    index = {
+        "version": FORMAT_VERSION,
+        "points": count,
+        "bounds": [[float(v) for v in scan_low], [float(v) for v in scan_high]],
+        "cube": {"low": [float(v) for v in low], "size": size},
+        "max_points": max_points,
+        "attributes": [{"name": name, "type": np.dtype(dtype).name, "components": components}
+                       for name, dtype, components in TILE_ATTRIBUTES],
+        "position_max": POSITION_MAX,
+        "tiles": "tiles/{name}.bin",
+        "nodes": dict(sorted(nodes.items(), key=lambda item: (len(item[0]), item[0]))),
+    }
+    tmp_path = os.path.join(directory, "index.json.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(index, f, separators=(",", ":"))
+    os.replace(tmp_path, os.path.join(directory, "index.json"))
+    return index
+
+
+def export_scan(filename, directory, max_points=MAX_NODE_POINTS, workers=None, categories=scan.SCAN_CATEGORIES):
+    # export_octree of the classified points of a parquet scan
+    return export_octree(scan.load_scan(filename, categories=categories), directory, max_points, workers)
+
+
+if __name__ == "__main__":
+    # Export a scan as octree tiles and check that the tiles hold every point once:
+    #   python octree.py ../data/setup_1.parquet ../3d-scan-viewer/public/data/setup_1 [max points per tile]
+    import sys
+    import time
+
+    max_points = int(sys.argv[3]) if len(sys.argv) > 3 else MAX_NODE_POINTS
+    start = time.perf_counter()
+    index = export_scan(sys.argv[1], sys.argv[2], max_points)
+    seconds = time.perf_counter() - start
+    nodes = index["nodes"]
+    levels = max(node["level"] for node in nodes.values()) + 1
+    tile_sizes = [os.path.getsize(os.path.join(sys.argv[2], index["tiles"].format(name=name))) for name in nodes]
+    print("%d points in %d tiles over %d levels in %.2f s" % (index["points"], len(nodes), levels, seconds))
+    print("Largest tile %d bytes, %d points" % (max(tile_sizes), max(node["points"] for node in nodes.values())))
+    tiles = [read_tile(os.path.join(sys.argv[2], index["tiles"].format(name=name)), node["low"], node["size"])
+             for name, node in nodes.items()]
+    total = sum(len(tile["cat"]) for tile in tiles)
+    print("Points in the tiles: %d, every point once: %s" % (total, total == index["points"]))
+    # Instance ids of every point, compared as (id, count) pairs with the scan
+    tile_inst = np.unique(np.concatenate([tile["inst"] for tile in tiles]).astype(np.int64), return_counts=True)
+    scan_inst = np.unique(scan.load_scan(sys.argv[1], columns=["inst", "cat"])["inst"].to_numpy(np.int64), return_counts=True)
+    print("Instance ids kept: %s" % all(np.array_equal(a, b) for a, b in zip(tile_inst, scan_inst)))
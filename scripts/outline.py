@@ -1,18 +1,30 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
 
 import pandas as pd
 import cv2
 
+import instrument
+import scan
+
+
+# Side of the square drawn around each floor and ceiling point, adjust to make points thicker
+SQUARE_SIZE = 20
+
+# Memory for the (points x segments) temporaries of project_points_to_polyline, about
+# eight float64 values per point and segment
+PROJECTION_MEMORY_BUDGET = 64 * 1024 * 1024
+
 
 def load_data(filename):
-    # Load data from the specified filename (assuming it's a parquet file for this example)
-    df = pd.read_parquet(filename)
-    num = int(len(df) * 0.5)
-    df.sample(n=num, random_state=1)
-    return df
+    # Load the scan once with only the columns and categories the pipeline uses
+    return scan.load_scan(filename)
 
 def get_group(df,cat):
-    return df[(df['cat'] == cat)]
+    # df is a scan DataFrame or a scan.ScanIndex, whose categories are slices
+    return scan.select_category(df, cat)
 
 def get_point(df):
     points = df[['x', 'y']]
@@ -36,6 +48,44 @@ def reverse_transformation(transformed_points, padding, scale_x, scale_y, all_mi
     original_points[:, 1] = (original_points[:, 1] - padding) / scale_y + all_min_1
     return original_points
 
+def rasterize_footprint_loop(points, padded_size, square_size):
+    # Reference rasterizer: draw one filled square per point
+    image = np.zeros(padded_size, dtype=np.uint8)
+    for point in points:
+        top_left = (int(point[0] - square_size / 2), int(point[1] - square_size / 2))
+        bottom_right = (int(point[0] + square_size / 2), int(point[1] + square_size / 2))
+        cv2.rectangle(image, top_left, bottom_right, color=255, thickness=-1)
+    return image
+
+def rasterize_footprint(points, padded_size, square_size):
+    # Bin every point into the grid by the top-left corner of its square, then grow
+    # each occupied pixel into the full square with a single dilation.
+    # Produces the same image as rasterize_footprint_loop.
+    grid = bin_footprint(points, padded_size, square_size)
+    return dilate_footprint(grid, square_size)
+
+def bin_footprint(points, padded_size, square_size, grid=None):
+    # Mark the top-left corner of each point's square in the occupancy grid.
+    # Pass the grid of a previous call to accumulate points chunk by chunk.
+    top_left = (np.asarray(points) - square_size / 2).astype(np.int64)
+    # Offset the grid so squares hanging over the top/left border are kept
+    offset = square_size
+    if grid is None:
+        grid = np.zeros((padded_size[0] + offset, padded_size[1] + offset), dtype=np.uint8)
+    cols = top_left[:, 0] + offset
+    rows = top_left[:, 1] + offset
+    inside = (cols >= 0) & (cols < grid.shape[1]) & (rows >= 0) & (rows < grid.shape[0])
+    grid[rows[inside], cols[inside]] = 255
+    return grid
+
+def dilate_footprint(grid, square_size):
+    # Grow the occupied corners of bin_footprint into the footprint image.
+    # cv2.rectangle fills both corners, so the square spans square_size + 1 pixels
+    kernel = np.ones((square_size + 1, square_size + 1), np.uint8)
+    grid = cv2.dilate(grid, kernel, anchor=(square_size, square_size))
+    offset = square_size
+    return np.ascontiguousarray(grid[offset:, offset:])
+
 def closest_point_on_segment(p, a, b):
     ap = p - a
     ab = b - a
@@ -43,24 +93,78 @@ def closest_point_on_segment(p, a, b):
     t = np.clip(t, 0, 1)  # Restrict t to the segment
     return a + t * ab
 
-def main(filename):
-    # Load data from file
-    df = load_data(filename)
-    
+def project_points_to_polyline(points, polyline, chunk_size=None):
+    # Project every point onto its closest segment of the polyline in one batch.
+    # Segments are the consecutive vertex pairs of `polyline`, as in the original per-point loop.
+    # Without a chunk_size, chunks are sized to keep within PROJECTION_MEMORY_BUDGET.
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    polyline = np.asarray(polyline, dtype=np.float64).reshape(-1, 2)
+    a = polyline[:-1]
+    ab = polyline[1:] - a
+    ab_len2 = np.einsum('ij,ij->i', ab, ab)
+    # Degenerate segments collapse onto their start point instead of producing NaNs
+    inv_len2 = np.divide(1.0, ab_len2, out=np.zeros_like(ab_len2), where=ab_len2 > 0)
+    if chunk_size is None:
+        chunk_size = max(1, PROJECTION_MEMORY_BUDGET // (max(len(a), 1) * 8 * 8))
+
+    closest_points = np.empty_like(points)
+    distances = np.empty(len(points))
+    # Work in chunks so the (points x segments) temporaries stay bounded
+    for start in range(0, len(points), chunk_size):
+        p = points[start:start + chunk_size]
+        ap = p[:, np.newaxis, :] - a[np.newaxis, :, :]
+        t = np.clip(np.einsum('psk,sk->ps', ap, ab) * inv_len2, 0, 1)
+        proj = a[np.newaxis, :, :] + t[:, :, np.newaxis] * ab[np.newaxis, :, :]
+        d2 = np.sum((p[:, np.newaxis, :] - proj) ** 2, axis=-1)
+        best = np.argmin(d2, axis=1)  # first segment wins ties, like the strict `<` in the loop
+        rows = np.arange(len(p))
+        closest_points[start:start + chunk_size] = proj[rows, best]
+        distances[start:start + chunk_size] = np.sqrt(d2[rows, best])
+    return closest_points, distances
+
+def farthest_pair(points):
+    # The farthest pair of a point set lies on its convex hull, so after the O(N log N) hull only
+    # its h vertices are compared, in O(h^2) instead of the full N x N distance matrix. Window
+    # hulls have a few dozen vertices; rotating calipers would be O(h) but can miss the pair on
+    # the near-degenerate hulls of points projected onto a wall. Ties go to the lowest point
+    # indices, as with the full matrix.
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    if len(points) < 3:
+        return points[0], points[-1]
+    hull_idx = cv2.convexHull(points.astype(np.float32), returnPoints=False).reshape(-1)
+    # The hull keeps one of several equal points, the full matrix would find the first
+    _, first_equal, inverse = np.unique(points, axis=0, return_index=True, return_inverse=True)
+    hull_idx = np.unique(first_equal[inverse.reshape(-1)[hull_idx]])
+    hull = points[hull_idx]
+    diff = hull[:, np.newaxis, :] - hull[np.newaxis, :, :]
+    dist2 = np.sum(diff ** 2, axis=-1)
+    i, j = np.unravel_index(np.argmax(dist2), dist2.shape)
+    return points[hull_idx[i]], points[hull_idx[j]]
+
+def main(df, image_size=(500, 500), padding=50, engine="raster", **hull_params):
+    # df is a scan loaded with load_data, padding the amount of padding around the image.
+    # engine "hull" computes the footprint without a raster, see main_hull and its hull_params.
+    if engine == "hull":
+        return main_hull(df, **hull_params)
+    if engine != "raster":
+        raise ValueError("Unknown footprint engine: " + str(engine))
     ceiling = get_group(df,0)
     floor = get_group(df,1)
-    windows = get_group(df,10)
 
     global_z_min = floor['z'].min()
     global_z_max = ceiling['z'].max()
 
     room_height = [global_z_min,global_z_max]
 
-    flooor_ceiling =  np.vstack((get_point(ceiling), get_point(floor)))
-    windows_pt = get_point(windows)
+    with instrument.stage("outline.raster", points=len(ceiling) + len(floor)):
+        image, transformation = footprint_image(ceiling, floor, image_size, padding)
 
-    image_size = (500, 500)
-    padding = 50  # Amount of padding around the image
+    return outline_from_raster(image, df, room_height, padding, *transformation)
+
+def footprint_image(ceiling, floor, image_size=(500, 500), padding=50):
+    # Footprint raster of the ceiling and floor points, and the (scale_x, scale_y, all_min_0, all_min_1)
+    # transformation from scan to image coordinates
+    flooor_ceiling =  np.vstack((get_point(ceiling), get_point(floor)))
     padded_size = (image_size[0] + 2 * padding, image_size[1] + 2 * padding)
 
     all_min_0 = flooor_ceiling[:, 0].min()
@@ -72,14 +176,31 @@ def main(filename):
 
     transformed_fp = apply_transformation(flooor_ceiling,padding,scale_x,scale_y,all_min_0,all_min_1)
 
-    transformed_window = apply_transformation(windows_pt,padding,scale_x,scale_y,all_min_0,all_min_1)
+    image = rasterize_footprint(transformed_fp, padded_size, SQUARE_SIZE)
+    return image, (scale_x, scale_y, all_min_0, all_min_1)
+
+def outline_from_raster(image, windows, room_height, padding, scale_x, scale_y, all_min_0, all_min_1):
+    # Contour and window alignment from the footprint raster.
+    # windows is the scan, a scan.ScanIndex, or the window points in scan order (see window_instances).
+    with instrument.stage("outline.contour") as record:
+        approx_longest_contour = footprint_contour(image)
+        record["vertices"] = len(approx_longest_contour)
+    with instrument.stage("outline.windows") as record:
+        instances = window_instances(windows)
+        record["points"] = sum(len(points) for points, _ in instances)
+        endpoint_lst, z_bound = window_endpoints(instances, approx_longest_contour, padding, scale_x, scale_y, all_min_0, all_min_1)
+        record["windows"] = len(endpoint_lst)
 
-    image = np.zeros(padded_size, dtype=np.uint8)
-    square_size = 20  # Adjust radius to make points thicker
-    for point in transformed_fp:
-        top_left = (int(point[0] - square_size / 2), int(point[1] - square_size / 2))
-        bottom_right = (int(point[0] + square_size / 2), int(point[1] + square_size / 2))
-        cv2.rectangle(image, top_left, bottom_right, color=255, thickness=-1)
+    final_fp = reverse_transformation(approx_longest_contour,padding,scale_x,scale_y,all_min_0,all_min_1)
+
+    final_endpoint_lst = []
+    for arr in endpoint_lst:
+        final_endpoint_lst.append(reverse_transformation(arr,padding,scale_x,scale_y,all_min_0,all_min_1))
+
+    return final_fp,room_height,final_endpoint_lst,z_bound
+
+def footprint_contour(image):
+    # Simplified longest contour of the footprint raster, in image coordinates
 
     # Use Canny Edge Detection to find edges
     edges = cv2.Canny(image, threshold1=100, threshold2=200)
@@ -104,72 +225,380 @@ def main(filename):
         epsilon = 0.005 * max_length
         approx_longest_contour = cv2.approxPolyDP(longest_contour, epsilon, True)
 
+    return approx_longest_contour.reshape(-1, 2)  # Reshape in case it needs flattening
 
-    window_instance_id = windows['inst'].unique()
-    window_filtered_df = windows.reset_index(drop=True)
+def instance_rows(windows):
+    # Rows of each window instance, in order of first appearance, from one stable sort
+    # instead of a scan of all window points per instance
+    codes, _ = pd.factorize(windows['inst'])
+    order = np.argsort(codes, kind='stable')
+    bounds = np.r_[0, np.cumsum(np.bincount(codes))]
+    return [order[start:stop] for start, stop in zip(bounds[:-1], bounds[1:])]
 
-    transformed_window = np.array(transformed_window)  # Ensure transformed_window is a NumPy array
-    approx_longest_contour = approx_longest_contour.reshape(-1, 2)  # Reshape in case it needs flattening
 
+def window_instances(windows):
+    # (x/y points, [z min, z max]) of each window instance, in order of first appearance.
+    # A scan.ScanIndex gives its instance slices and their z ranges from the index as they are;
+    # a DataFrame (the scan or its window points) is grouped with one stable sort.
+    if isinstance(windows, scan.ScanIndex):
+        return [(get_point(windows.instance(10, inst)), windows.z_bounds(10, inst)) for inst in windows.instances(10)]
+    windows = get_group(windows, 10)
+    points, z = get_point(windows), windows['z'].to_numpy()
+    return [(points[rows], np.array([z[rows].min(), z[rows].max()])) for rows in instance_rows(windows)]
+
+
+def window_endpoints(windows, approx_longest_contour, padding, scale_x, scale_y, all_min_0, all_min_1):
+    # Endpoints of each window instance on the contour and its z range, in image coordinates.
+    # windows is a window_instances list, or what window_instances takes.
+    instances = windows if isinstance(windows, list) else window_instances(windows)
 
     endpoint_lst =[]
     z_bound = []
 
-    for wii in window_instance_id:
-        indices = window_filtered_df.index[window_filtered_df['inst'] == wii].tolist()
-
-        closest_points = []
-        distances = []
-
-        window4 = transformed_window[indices]
-        windowdf_grp = window_filtered_df.iloc[indices]
-        z_bound.append(np.array([windowdf_grp['z'].min(),windowdf_grp['z'].max()]))
-        # Loop over each point in transformed_window
-        for window_point in window4:
-            min_dist = float('inf')
-            closest_pt = None
-            
-            # Loop over each segment in approx_longest_contour
-            for i in range(len(approx_longest_contour) - 1):
-                a = approx_longest_contour[i]
-                b = approx_longest_contour[i + 1]
-                
-                # Find the closest point on segment ab to window_point
-                point_on_segment = closest_point_on_segment(window_point, a, b)
-                dist = np.linalg.norm(window_point - point_on_segment)
-                
-                # Update minimum distance and closest point if this segment is closer
-                if dist < min_dist:
-                    min_dist = dist
-                    closest_pt = point_on_segment
-            
-            # Store the closest point and corresponding distance for this window_point
-            closest_points.append(closest_pt)
-            distances.append(min_dist)
-
-        # Convert lists to arrays if needed
-        closest_points = np.array(closest_points)
-        distances = np.array(distances)
-
-        # Find the two points with the maximum distance directly
-        endpoints = None
-
-        # Compute pairwise distance matrix using broadcasting
-        diff = closest_points[:, np.newaxis, :] - closest_points[np.newaxis, :, :]
-        dist_matrix = np.sqrt(np.sum(diff ** 2, axis=-1))
-
-        # Find the indices of the maximum distance in the matrix
-        i, j = np.unravel_index(np.argmax(dist_matrix), dist_matrix.shape)
-        endpoints = [closest_points[i], closest_points[j]]
+    for points, z_range in instances:
+        window4 = apply_transformation(points,padding,scale_x,scale_y,all_min_0,all_min_1)
+        z_bound.append(z_range)
+
+        # Project all window points onto the floorplan outline at once
+        closest_points, distances = project_points_to_polyline(window4, approx_longest_contour)
+
+        # Find the two projected points farthest apart
+        endpoints = farthest_pair(closest_points)
         endpoint_lst.append(np.array(endpoints))
 
-    
-    final_fp = reverse_transformation(approx_longest_contour,padding,scale_x,scale_y,all_min_0,all_min_1)
+    return endpoint_lst, z_bound
 
-    final_endpoint_lst = []
-    for arr in endpoint_lst:
-        final_endpoint_lst.append(reverse_transformation(arr,padding,scale_x,scale_y,all_min_0,all_min_1))
 
+# Pixels around a tile that its edges depend on: the 5 x 5 closing and the Canny
+# gradients reach a few pixels, the rest is slack
+TILE_MARGIN = 16
 
+# Rasters below this many pixels are processed in this process: a tile takes about 6 ms
+# per megapixel, so below this size starting a worker pool costs more than it saves
+TILED_MIN_PIXELS = 16_000_000
 
-    return final_fp,room_height,final_endpoint_lst,z_bound
\ No newline at end of file
+
+def tile_edges(grid, square_size):
+    # Footprint and closed Canny edges of a slice of a bin_footprint grid.
+    # The result covers the slice minus square_size rows/columns, like dilate_footprint.
+    image = dilate_footprint(grid, square_size)
+    edges = cv2.Canny(image, threshold1=100, threshold2=200)
+    kernel = np.ones((5, 5), np.uint8)
+    return cv2.morphologyEx(edges, cv2.MORPH_CLOSE, kernel)
+
+def tiled_edges(grid, square_size, tile_size=1024, workers=None):
+    """
+    Closed footprint edges of a whole bin_footprint grid, computed tile by tile.
+
+    Each tile is dilated, edge detected and closed from a slice of the grid
+    that overlaps its neighbours by TILE_MARGIN pixels, so the stitched
+    result is the same as processing the whole image at once. Only these
+    steps are tiled: the edge image is returned whole and contours are
+    traced on it in a single pass, so it must fit in memory. Grids smaller
+    than TILED_MIN_PIXELS run in this process without a worker pool.
+
+    Parameters:
+        grid (np.ndarray): Occupancy grid from bin_footprint.
+        square_size (int): Side of the square drawn around each point.
+        tile_size (int): Side of a tile in pixels.
+        workers (int): Worker processes, defaults to the CPU count; 1 runs the tiles in this process.
+
+    Returns:
+        np.ndarray: Edge image of the footprint, the size of dilate_footprint(grid).
+    """
+    height, width = grid.shape[0] - square_size, grid.shape[1] - square_size
+    tiles = [(r0, c0) for r0 in range(0, height, tile_size) for c0 in range(0, width, tile_size)]
+    slices = []
+    for r0, c0 in tiles:
+        a, c = max(r0 - TILE_MARGIN, 0), max(c0 - TILE_MARGIN, 0)
+        b = min(r0 + tile_size + square_size + TILE_MARGIN, grid.shape[0])
+        d = min(c0 + tile_size + square_size + TILE_MARGIN, grid.shape[1])
+        slices.append((a, b, c, d))
+
+    workers = max(1, min(workers or os.cpu_count() or 1, len(tiles)))
+    if workers == 1 or height * width < TILED_MIN_PIXELS:
+        results = [tile_edges(grid[a:b, c:d], square_size) for a, b, c, d in slices]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(tile_edges, [grid[a:b, c:d] for a, b, c, d in slices],
+                                    [square_size] * len(slices)))
+
+    edges = np.zeros((height, width), dtype=np.uint8)
+    for (r0, c0), (a, _, c, _), tile in zip(tiles, slices, results):
+        r1, c1 = min(r0 + tile_size, height), min(c0 + tile_size, width)
+        edges[r0:r1, c0:c1] = tile[r0 - a:r1 - a, c0 - c:c1 - c]
+    return edges
+
+def room_contours(edges, min_length=0):
+    # Simplified external contours of the edge image longer than min_length pixels, longest first,
+    # with the same approximation as the single contour of outline.main
+    contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    rooms = []
+    for contour in contours:
+        length = cv2.arcLength(contour, True)
+        if length >= min_length and len(contour) > 2:
+            rooms.append((length, cv2.approxPolyDP(contour, 0.005 * length, True).reshape(-1, 2)))
+    rooms.sort(key=lambda room: -room[0])
+    return [contour for _, contour in rooms]
+
+def main_tiled(df, pixel_size=0.01, padding=50, tile_size=1024, workers=None, min_room_perimeter=2.0,
+               square_size=SQUARE_SIZE):
+    """
+    Outlines of every room of a scan at a fixed resolution per metre.
+
+    Unlike main, the raster is not fitted into a fixed image: every pixel is
+    pixel_size metres, so large and multi-room scans keep their detail. The
+    points are binned once, large rasters are processed in tiles on worker
+    processes (see tiled_edges) and the contours are traced on the stitched
+    edges, so rooms spanning several tiles come out whole. Contour tracing
+    is not tiled, so the whole edge image is held in memory. Each window is
+    aligned to the room outline its points are closest to.
+
+    Parameters:
+        df (pd.DataFrame): Scan loaded with load_data.
+        pixel_size (float): Raster resolution in metres per pixel.
+        padding (int): Padding around the raster in pixels.
+        tile_size (int): Side of a tile in pixels.
+        workers (int): Worker processes for the tiles.
+        min_room_perimeter (float): Outlines shorter than this many metres are dropped.
+        square_size (int): Side in pixels of the square drawn around each point.
+
+    Returns:
+        tuple: outlines (list of np.ndarray, longest first), room_height,
+            window endpoints and window z bounds, like main with a list of outlines.
+    """
+    ceiling = get_group(df,0)
+    floor = get_group(df,1)
+    room_height = [floor['z'].min(), ceiling['z'].max()]
+
+    points = np.vstack((get_point(ceiling), get_point(floor)))
+    all_min_0, all_min_1 = points[:, 0].min(), points[:, 1].min()
+    scale = 1.0 / pixel_size
+    padded_size = (int(np.ceil((points[:, 1].max() - all_min_1) * scale)) + 2 * padding + 1,
+                   int(np.ceil((points[:, 0].max() - all_min_0) * scale)) + 2 * padding + 1)
+
+    with instrument.stage("outline.raster", points=len(points)):
+        transformed = apply_transformation(points, padding, scale, scale, all_min_0, all_min_1)
+        grid = bin_footprint(transformed, padded_size, square_size)
+    with instrument.stage("outline.tiles", pixels=padded_size[0] * padded_size[1]):
+        edges = tiled_edges(grid, square_size, tile_size, workers)
+    with instrument.stage("outline.contour") as record:
+        contours = room_contours(edges, min_room_perimeter * scale)
+        record["rooms"] = len(contours)
+    if not contours:
+        raise ValueError("No room outline found")
+
+    with instrument.stage("outline.windows") as record:
+        instances = window_instances(df)
+        record["points"] = sum(len(window) for window, _ in instances)
+        closed_contours = [np.vstack((contour, contour[:1])) for contour in contours]
+        endpoint_lst = []
+        z_bound = []
+        for window, z_range in instances:
+            z_bound.append(z_range)
+            transformed_window = apply_transformation(window, padding, scale, scale, all_min_0, all_min_1)
+            # The window belongs to the room whose outline is closest to its points; the outlines
+            # are closed so windows on the wall between the last and first vertex are aligned too
+            projections = [project_points_to_polyline(transformed_window, contour)
+                           for contour in closed_contours]
+            closest_points, _ = min(projections, key=lambda p: p[1].mean())
+            endpoint_lst.append(np.array(farthest_pair(closest_points)))
+        record["windows"] = len(endpoint_lst)
+
+    final_fps = [reverse_transformation(contour, padding, scale, scale, all_min_0, all_min_1) for contour in contours]
+    final_endpoint_lst = [reverse_transformation(arr, padding, scale, scale, all_min_0, all_min_1) for arr in endpoint_lst]
+    return final_fps, room_height, final_endpoint_lst, z_bound
+
+
+# Smallest cell of the grid the footprint points are thinned on before the concave hull, in metres
+HULL_CELL_SIZE = 0.05
+# Delaunay triangles with a larger circumradius are outside the footprint, in metres and in cells
+HULL_ALPHA = 0.3
+HULL_ALPHA_CELLS = 4
+# Average points per cell aimed for on sparse scans, so that the floor and ceiling have no holes
+HULL_POINTS_PER_CELL = 4
+
+
+def boundary_cells(points, cell_size, depth=2):
+    # Centres of the occupied grid cells within depth cells of an empty one.
+    # Cells further inside cannot be on the footprint boundary, so only this band goes into the triangulation;
+    # it is kept depth cells wide so that the triangles across it stay smaller than alpha.
+    ij = np.floor(np.asarray(points, dtype=np.float64) / cell_size).astype(np.int64)
+    # Column by column: reductions along axis 0 of an (N, 2) array are many times slower
+    low = np.array([ij[:, 0].min(), ij[:, 1].min()]) - depth
+    ij -= low
+    # One sorted key per occupied cell, flagged in a flat array instead of sorting the points
+    rows = int(ij[:, 1].max()) + depth + 1
+    occupied = np.zeros((int(ij[:, 0].max()) + depth + 1) * rows, dtype=bool)
+    occupied[ij[:, 0] * rows + ij[:, 1]] = True
+    keys = np.flatnonzero(occupied)
+    interior = np.ones(len(keys), dtype=bool)
+    for di in range(-depth, depth + 1):
+        for dj in range(-depth, depth + 1):
+            if di or dj:
+                interior &= occupied[keys + di * rows + dj]
+    band = keys[~interior]
+    return (np.column_stack((band // rows, band % rows)) + low + 0.5) * cell_size
+
+def delaunay_triangles(points):
+    # Delaunay triangles of 2D points as (t, 3) indices, with cv2.Subdiv2D
+    points = np.asarray(points, dtype=np.float32)
+    low, high = np.floor(points.min(axis=0)) - 1, np.ceil(points.max(axis=0)) + 1
+    subdiv = cv2.Subdiv2D((int(low[0]), int(low[1]), int(high[0] - low[0]), int(high[1] - low[1])))
+    coordinates = [tuple(p) for p in points.tolist()]
+    subdiv.insert(coordinates)
+    # Map the corners back to point indices; triangles on the virtual outer vertices of Subdiv2D find no match
+    index = {p: i for i, p in enumerate(coordinates)}
+    corners = subdiv.getTriangleList().reshape(-1, 2).tolist()
+    triangles = np.array([index.get(tuple(c), -1) for c in corners], dtype=np.int64).reshape(-1, 3)
+    return triangles[(triangles >= 0).all(axis=1)]
+
+def circumradius(points, triangles):
+    a, b, c = (points[triangles[:, i]] for i in range(3))
+    ab = np.linalg.norm(b - a, axis=1)
+    bc = np.linalg.norm(c - b, axis=1)
+    ca = np.linalg.norm(a - c, axis=1)
+    area2 = np.abs((b[:, 0] - a[:, 0]) * (c[:, 1] - a[:, 1]) - (b[:, 1] - a[:, 1]) * (c[:, 0] - a[:, 0]))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(area2 > 0, ab * bc * ca / (2 * area2), np.inf)
+
+def boundary_rings(triangles):
+    # Closed rings of vertex indices along the edges used by exactly one triangle
+    edges = np.concatenate((triangles[:, [0, 1]], triangles[:, [1, 2]], triangles[:, [2, 0]]))
+    unique, counts = np.unique(np.sort(edges, axis=1), axis=0, return_counts=True)
+    neighbours = {}
+    for i, j in unique[counts == 1]:
+        neighbours.setdefault(int(i), []).append(int(j))
+        neighbours.setdefault(int(j), []).append(int(i))
+    rings = []
+    while neighbours:
+        start = next(iter(neighbours))
+        ring = [start]
+        previous, current = None, start
+        while True:
+            options = neighbours.get(current, [])
+            following = next((n for n in options if n != previous), None) if options else None
+            if following is None:
+                break
+            neighbours[current].remove(following)
+            neighbours[following].remove(current)
+            for v in (current, following):
+                if not neighbours[v]:
+                    del neighbours[v]
+            if following == start:
+                break
+            ring.append(following)
+            previous, current = current, following
+        if len(ring) > 2:
+            rings.append(ring)
+    return rings
+
+def polygon_area(polygon):
+    x, y = polygon[:, 0], polygon[:, 1]
+    return 0.5 * (np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1)))
+
+def hull_cell_size(points):
+    # HULL_CELL_SIZE, or larger on a scan too sparse to fill every cell of it
+    extent = [points[:, k].max() - points[:, k].min() for k in (0, 1)]
+    return max(HULL_CELL_SIZE, float(np.sqrt(HULL_POINTS_PER_CELL * extent[0] * extent[1] / max(len(points), 1))))
+
+def footprint_hull(points, cell_size=None, alpha=None):
+    """
+    Concave hull (alpha shape) of 2D points in their own metric coordinates.
+
+    The points are thinned to the centres of the occupied cells of a
+    cell_size grid near its empty cells, triangulated, and the Delaunay
+    triangles with a circumradius above alpha are dropped. The outer ring of
+    what remains is simplified with the same rule as the raster contour of main.
+
+    Parameters:
+        points (np.ndarray): (N, 2) floor and ceiling XY.
+        cell_size (float): Grid cell in metres, by default from the point density.
+        alpha (float): Largest circumradius of a footprint triangle in metres;
+            gaps narrower than about twice alpha are closed. By default
+            HULL_ALPHA, or HULL_ALPHA_CELLS cells on a coarser grid.
+
+    Returns:
+        np.ndarray: (k, 2) float32 polygon.
+    """
+    points = np.asarray(points, dtype=np.float64)
+    cell_size = hull_cell_size(points) if cell_size is None else cell_size
+    alpha = max(HULL_ALPHA, HULL_ALPHA_CELLS * cell_size) if alpha is None else alpha
+    cells = boundary_cells(points, cell_size)
+    triangles = delaunay_triangles(cells)
+    triangles = triangles[circumradius(cells, triangles) <= alpha]
+    rings = boundary_rings(triangles)
+    if not rings:
+        raise ValueError("No footprint found, try a larger alpha")
+    # The outline is the ring enclosing the largest area, the others are holes or islands
+    outer = max((cells[ring] for ring in rings), key=lambda ring: abs(polygon_area(ring)))
+    outer = outer.astype(np.float32).reshape(-1, 1, 2)
+    epsilon = 0.005 * cv2.arcLength(outer, True)
+    return cv2.approxPolyDP(outer, epsilon, True).reshape(-1, 2)
+
+def main_hull(df, cell_size=None, alpha=None):
+    # main with the footprint from footprint_hull instead of the raster; same result tuple
+    ceiling = get_group(df,0)
+    floor = get_group(df,1)
+    room_height = [floor['z'].min(), ceiling['z'].max()]
+
+    with instrument.stage("outline.hull", points=len(ceiling) + len(floor)) as record:
+        final_fp = footprint_hull(np.vstack((get_point(ceiling), get_point(floor))), cell_size, alpha)
+        record["vertices"] = len(final_fp)
+    with instrument.stage("outline.windows") as record:
+        instances = window_instances(df)
+        record["points"] = sum(len(window) for window, _ in instances)
+        # Metric coordinates: the identity transformation. The polygon is closed so windows on the
+        # wall between its last and first vertex are aligned too
+        closed = np.vstack((final_fp, final_fp[:1]))
+        final_endpoint_lst, z_bound = window_endpoints(instances, closed, 0, 1.0, 1.0, 0.0, 0.0)
+        record["windows"] = len(final_endpoint_lst)
+    final_endpoint_lst = [np.asarray(arr, dtype=np.float32) for arr in final_endpoint_lst]
+    return final_fp, room_height, final_endpoint_lst, z_bound
+
+def polygon_iou(a, b, resolution=0.01):
+    # Intersection over union of two polygons, or lists of room polygons from main_tiled,
+    # measured on a raster of the given resolution in metres
+    a, b = [[np.asarray(p)[:, :2] for p in (rooms if isinstance(rooms, list) else [rooms])] for rooms in (a, b)]
+    both = np.vstack(a + b)
+    low = both.min(axis=0)
+    size = np.ceil((both.max(axis=0) - low) / resolution).astype(int) + 3
+    masks = []
+    for polygons in (a, b):
+        mask = np.zeros((size[1], size[0]), dtype=np.uint8)
+        pixels = [np.rint((polygon - low) / resolution).astype(np.int32) + 1 for polygon in polygons]
+        cv2.fillPoly(mask, pixels, 1)
+        masks.append(mask.astype(bool))
+    union = np.logical_or(*masks).sum()
+    return float(np.logical_and(*masks).sum() / union) if union else 1.0
+
+
+if __name__ == "__main__":
+    # Compare the array rasterizer against the per-point rectangle loop on a scan:
+    #   python outline.py path/to/setup_0.parquet
+    import sys
+    import time
+
+    df = load_data(sys.argv[1])
+    points = np.vstack((get_point(get_group(df, 0)), get_point(get_group(df, 1))))
+    image_size = (500, 500)
+    padding = 50
+    padded_size = (image_size[0] + 2 * padding, image_size[1] + 2 * padding)
+    all_min_0 = points[:, 0].min()
+    all_min_1 = points[:, 1].min()
+    scale_x = image_size[0] / (points[:, 0].max() - all_min_0)
+    scale_y = image_size[1] / (points[:, 1].max() - all_min_1)
+    transformed = apply_transformation(points, padding, scale_x, scale_y, all_min_0, all_min_1)
+
+    start = time.perf_counter()
+    image_loop = rasterize_footprint_loop(transformed, padded_size, SQUARE_SIZE)
+    loop_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    image_array = rasterize_footprint(transformed, padded_size, SQUARE_SIZE)
+    array_time = time.perf_counter() - start
+
+    print("Points rasterized: " + str(len(transformed)))
+    print("cv2.rectangle loop: %.4f s" % loop_time)
+    print("Array rasterizer:   %.4f s" % array_time)
+    print("Identical images: " + str(np.array_equal(image_loop, image_array)))
@@ -1,16 +1,23 @@
-import pyarrow.parquet as pq
 import os
+import multiprocessing
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import pandas as pd
 import numpy as np
-import open3d as o3d
-import ghhops_server as hs
-import rhino3dm
-from flask import Flask
-import open3d as o3d
-import cv2
+import lazy
 import outline
+import scan
+import geometry
+import cache
+import stream
+import voxel
+import instrument
 
-
+# Loaded on first use, so commands that only outline a scan or fail early do not wait for them
+o3d = lazy.lazy_import("open3d")
+rhino3dm = lazy.lazy_import("rhino3dm")
 
 
 def o3d_to_rhino3dm(o3d_mesh):
@@ -24,22 +31,13 @@ def o3d_to_rhino3dm(o3d_mesh):
         rhino3dm.Mesh: The converted Rhino3dm mesh.
     """
 
-    
-    # Create a new Rhino3dm mesh
-    rhino_mesh = rhino3dm.Mesh()
-
-    # Add vertices to the Rhino mesh
-    for vertex in o3d_mesh.vertices:
-        rhino_mesh.Vertices.Add(vertex[0], vertex[1], vertex[2])
-        
-
-    for colour in o3d_mesh.vertex_colors:
-        rhino_mesh.VertexColors.Add(int(colour[0]*255),int(colour[1]*255), int(colour[2]*255))
-    # Add faces to the Rhino mesh
-    for triangle in o3d_mesh.triangles:
-        rhino_mesh.Faces.AddFace(triangle[0], triangle[1], triangle[2])
-
-    return rhino_mesh
+    triangles = np.asarray(o3d_mesh.triangles)
+    with instrument.stage("o3d_to_rhino3dm", triangles=len(triangles)):
+        return geometry.mesh_from_arrays(
+            np.asarray(o3d_mesh.vertices),
+            triangles,
+            np.asarray(o3d_mesh.vertex_colors),
+        )
 
 def aabb_to_mesh(aabb):
     """
@@ -119,57 +117,17 @@ def dfToBB(df):
     return create_bounding_box(dfToPC(df))
 
 def wallsMesh(pline, height):
-    pts = pline
-    meshList = []
-    holder = []
-    for i, pt in enumerate(pline):
-        mesh = rhino3dm.Mesh()
-        ptA = pt
-        if i == len(pline) - 1:
-            ptB1 = pline[0]
-        else:
-            ptB1 = pline[i+1]
-        ptB = rhino3dm.Point3d(pt.X, pt.Y, height[1])
-        ptA1 = rhino3dm.Point3d(ptB1.X, ptB1.Y, height[1])
-        
-        mesh.Vertices.Add(ptA.X, ptA.Y, ptA.Z)
-        mesh.Vertices.Add(ptB.X, ptB.Y, ptB.Z)
-        mesh.Vertices.Add(ptA1.X, ptA1.Y, ptA1.Z)
-        mesh.Vertices.Add(ptB1.X, ptB1.Y, ptB1.Z)
-        
-        mesh.Faces.AddFace(0,1,2,3)
-        # Optionally: Compute the normals
-        mesh.Normals.ComputeNormals()
-        meshList.append(mesh)
-    meshHolder = rhino3dm.Mesh()
-    for mesh in meshList:
-        meshHolder.Append(mesh)
-    return meshHolder
-
-
+    # One mesh for all walls, with the vertices shared between neighbouring segments
+    pts = geometry.open_polyline(geometry.polyline_to_array(pline))
+    return geometry.extrusion_mesh(pts, pts[0][2], height[1])
 
 
 def windowMesh(line, zBounds):
-    mesh = rhino3dm.Mesh()
-    ptA = rhino3dm.Point3d(line[0][0], line[0][1], zBounds[0])
-    ptB1 = rhino3dm.Point3d(line[1][0], line[1][1], zBounds[0])
-    ptB = rhino3dm.Point3d(line[0][0], line[0][1], zBounds[1])
-    ptA1 = rhino3dm.Point3d(line[1][0], line[1][1], zBounds[1])
-    
-    mesh.Vertices.Add(ptA.X, ptA.Y, ptA.Z)
-    mesh.Vertices.Add(ptB.X, ptB.Y, ptB.Z)
-    mesh.Vertices.Add(ptA1.X, ptA1.Y, ptA1.Z)
-    mesh.Vertices.Add(ptB1.X, ptB1.Y, ptB1.Z)
-    
-    mesh.Faces.AddFace(0,1,2,3)
-    # Optionally: Compute the normals
-    mesh.Normals.ComputeNormals()
-    
+    return geometry.extrusion_mesh(line, zBounds[0], zBounds[1], closed=False)
 
-    return mesh
 
-
-def dfToMesh(df):
+def dfToMesh(df, depth=9, densityPercentile=5, plyPath=None):
+    # plyPath optionally saves the coloured input points for inspection
     
     # Create an open3d PointCloud object
     pcd = o3d.geometry.PointCloud()
@@ -182,25 +140,31 @@ def dfToMesh(df):
     colors = df[['r', 'g', 'b']].values / 255.0
     pcd.colors = o3d.utility.Vector3dVector(colors)
 
-    o3d.io.write_point_cloud("colored_pts.ply", pcd)
+    if plyPath is not None:
+        o3d.io.write_point_cloud(plyPath, pcd)
 
 
  
     # Estimate normals for Poisson reconstruction
-    pcd.estimate_normals(search_param=o3d.geometry.KDTreeSearchParamHybrid(radius=0.1, max_nn=30))
+    with instrument.stage("normals", points=len(points)):
+        pcd.estimate_normals(search_param=o3d.geometry.KDTreeSearchParamHybrid(radius=0.1, max_nn=30))
 
     # with o3d.utility.VerbosityContextManager(
     #         o3d.utility.VerbosityLevel.Debug) as cm:
-    mesh, densities = o3d.geometry.TriangleMesh.create_from_point_cloud_poisson(
-        pcd, depth=9)
+    with instrument.stage("poisson", points=len(points), depth=depth) as record:
+        mesh, densities = o3d.geometry.TriangleMesh.create_from_point_cloud_poisson(
+            pcd, depth=depth)
+        record["triangles"] = len(mesh.triangles)
 
     # Define a threshold to remove low-density vertices
-    vertices = np.asarray(mesh.vertices)
-    density_threshold = np.percentile(densities, 5)  # Remove the bottom 5% of densities
-    vertices_to_remove = densities < density_threshold
-
-    # Filter vertices based on the density threshold
-    mesh.remove_vertices_by_mask(vertices_to_remove)
+    with instrument.stage("densityFilter", triangles=len(mesh.triangles)) as record:
+        vertices = np.asarray(mesh.vertices)
+        density_threshold = np.percentile(densities, densityPercentile)  # Remove the lowest densities
+        vertices_to_remove = densities < density_threshold
+
+        # Filter vertices based on the density threshold
+        mesh.remove_vertices_by_mask(vertices_to_remove)
+        record["triangles_kept"] = len(mesh.triangles)
     # # Create a mesh using Poisson reconstruction
     # mesh, densities = o3d.geometry.TriangleMesh.create_from_point_cloud_poisson(pcd, depth=9)
 
@@ -211,110 +175,724 @@ def dfToMesh(df):
     return mesh
 
 
-def getPlanarMesh(pLine):
-    rhino3dm.NurbsSurface.Create()
+# Longest edge of the planar surfaces in metres: they are subdivided this fine so that
+# their vertex colours, taken from the nearest sampled points, show the surfaces
+PLANAR_RESOLUTION = 0.2
+
+
+def planarSurfaceArrays(footprint, roomHeight, name, resolution=PLANAR_RESOLUTION):
+    """
+    Walls, floor or ceiling of the rooms as a planar mesh, without reconstruction.
+
+    The footprint is triangulated at the floor or ceiling height, or extruded
+    between them for the walls. Floor triangles face up, ceiling triangles
+    down and walls inwards. Walls are a grid of quads about resolution wide
+    and high, split into triangles; the floor and ceiling triangles have their
+    edges split at the midpoints until they are at most resolution long.
+
+    Parameters:
+        footprint (np.ndarray): Outline polygon from outline.main, or a list of
+            room polygons from outline.main_tiled.
+        roomHeight (list): Floor and ceiling heights.
+        name (str): "walls", "floor" or "ceiling".
+        resolution (float): Longest edge in metres, None to keep the polygon triangles.
+
+    Returns:
+        tuple: (N, 3) vertices and (T, 3) triangles.
+    """
+    rooms = footprint if isinstance(footprint, list) else [footprint]
+    vertexParts, triangleParts, offset = [], [], 0
+    for room in rooms:
+        xy = geometry.counter_clockwise(geometry.open_polyline(np.asarray(room, dtype=np.float64)[:, :2]))
+        if name == "walls":
+            if resolution:
+                rows = max(1, int(np.ceil((roomHeight[1] - roomHeight[0]) / resolution)))
+                vertices, quads = geometry.extrusion_grid_arrays(
+                    geometry.densify_polyline(xy, resolution), np.linspace(roomHeight[0], roomHeight[1], rows + 1))
+            else:
+                vertices, quads = geometry.extrusion_arrays(xy, roomHeight[0], roomHeight[1])
+            triangles = geometry.quads_to_triangles(quads)
+        else:
+            z = roomHeight[0] if name == "floor" else roomHeight[1]
+            vertices = np.column_stack((xy, np.full(len(xy), z)))
+            triangles = geometry.triangulate_polygon(xy)
+            if name == "ceiling":
+                triangles = triangles[:, ::-1]
+        vertexParts.append(vertices)
+        triangleParts.append(triangles + offset)
+        offset += len(vertices)
+    vertices, triangles = np.concatenate(vertexParts), np.concatenate(triangleParts)
+    return (vertices, triangles) if name == "walls" else subdivideArrays(vertices, triangles, resolution)
+
+
+def subdivideArrays(vertices, triangles, resolution):
+    # Splits the triangles until their edges are at most resolution long, each by its own size
+    if not resolution:
+        return vertices, triangles
+    return geometry.subdivide_long_edges(vertices, triangles, resolution)
+
+
+def nearestColors(vertices, df):
+    # Colours in [0, 1] of the points of df nearest to each vertex; grey when df is empty
+    if len(df) == 0:
+        return np.full((len(vertices), 3), 0.5)
+    search = o3d.core.nns.NearestNeighborSearch(o3d.core.Tensor(df[['x', 'y', 'z']].to_numpy(dtype=np.float64)))
+    search.knn_index()
+    indices, _ = search.knn_search(o3d.core.Tensor(np.asarray(vertices, dtype=np.float64)), 1)
+    return df[['r', 'g', 'b']].to_numpy()[indices.numpy()[:, 0]] / 255.0
+
+
+def planarCategoryArrays(footprint, roomHeight, df, name, resolution=PLANAR_RESOLUTION):
+    # (vertices, triangles, colors) of one planar surface, coloured from its sampled points df
+    vertices, triangles = planarSurfaceArrays(footprint, roomHeight, name, resolution)
+    return vertices, triangles, nearestColors(vertices, df)
+
+
+def planarArrays(footprint, roomHeight, samples, resolution=PLANAR_RESOLUTION, poissonSeconds=None):
+    # planarCategoryArrays of the walls, floor and ceiling from their samples. Each category is
+    # timed on its own and, given the recorded Poisson time of the same samples (see
+    # poissonSecondsFor), the time saved against it is printed and kept in the stage record.
+    arrays = []
+    for df, name, poisson in zip(samples, CATEGORY_NAMES[:3], poissonSeconds or [None] * 3):
+        start = time.perf_counter()
+        with instrument.stage("planar." + name, points=len(df)) as record:
+            arrays.append(planarCategoryArrays(footprint, roomHeight, df, name, resolution))
+            record["triangles"] = len(arrays[-1][1])
+        seconds = time.perf_counter() - start
+        if poisson is None:
+            saving = ", no Poisson time recorded for these samples"
+        else:
+            record["poisson"], record["saved"] = poisson, poisson - seconds
+            saving = ", saves %.2f s against Poisson (%.2f s)" % (poisson - seconds, poisson)
+        print("Planar %s: %d triangles in %.3f s%s" % (name, len(arrays[-1][1]), seconds, saving))
+    return arrays
+
+
+def getPlanarMesh(pLine, height, resolution=None):
+    # Planar mesh of the polygon of a closed polyline at the given height
+    xy = geometry.polyline_to_array(pLine)[:, :2]
+    vertices, triangles = planarSurfaceArrays(xy, [height, height], "floor", resolution)
+    return geometry.mesh_from_arrays(vertices, triangles, compute_normals=True)
 
 
 def getPolyline(ptList, bottomBound):
-    pts = []
+    ptList = np.asarray(ptList)
     if(len(ptList) > 3):
         ptList = np.append(ptList, [ptList[0]], axis=0)
-        
-    for pt in ptList:
-        pts.append(rhino3dm.Point3d(pt[0],pt[1],bottomBound))
-    return rhino3dm.Polyline(pts)
+    pts = np.column_stack((ptList[:, :2], np.full(len(ptList), bottomBound)))
+    return geometry.polyline_from_array(pts)
 
 def dfToRhinoMesh(df):
     return o3d_to_rhino3dm(dfToMesh(df))
 
 def dfToRhinoBBMesh(df):
     return o3d_to_rhino3dm(dfToBB(df))
+
+
+def dfToMeshArrays(df, depth=9, densityPercentile=5):
+    # Plain arrays can cross process boundaries and be cached, Open3D meshes cannot
+    mesh = dfToMesh(df, depth, densityPercentile)
+    return np.asarray(mesh.vertices), np.asarray(mesh.triangles), np.asarray(mesh.vertex_colors)
+
+
+def meshArraysTask(df, depth=9, densityPercentile=5):
+    # dfToMeshArrays in a worker process, returning its stage records and wall time along with the arrays
+    start = time.perf_counter()
+    with instrument.collect() as records:
+        arrays = dfToMeshArrays(df, depth, densityPercentile)
+    return arrays, records, time.perf_counter() - start
+
+
+def poissonSecondsKey(meshKey):
+    # Stage cache key of the wall time of the Poisson reconstruction cached under meshKey
+    return getStageCache().key("poissonSeconds", meshKey)
+
+
+def reconstructAll(dfs, workers=None, depth=9, densityPercentile=5, cacheKeys=None):
+    # reconstructAllArrays converted to rhino3dm meshes
+    return meshesFromArrays(reconstructAllArrays(dfs, workers, depth, densityPercentile, cacheKeys))
+
+
+def meshesFromArrays(arrays):
+    meshes = []
+    for a in arrays:
+        with instrument.stage("meshFromArrays", triangles=len(a[1])):
+            meshes.append(geometry.mesh_from_arrays(*a))
+    return meshes
+
+
+def reconstructAllArrays(dfs, workers=None, depth=9, densityPercentile=5, cacheKeys=None):
+    """
+    Reconstructs one mesh per DataFrame, running the Poisson reconstructions concurrently.
+
+    The reconstructions are independent, so each runs in its own worker process.
+    Meshes are returned in the order of dfs whatever order they finish in.
+    Reconstructions found in the stage cache are not recomputed; the wall time
+    of each new one is cached along with it (see poissonSecondsKey), as the
+    reference planar surfaces are compared with.
+
+    Parameters:
+        dfs (list): Sampled points of each category.
+        workers (int): Number of worker processes, defaults to one per category up to the CPU count.
+            With 1 the reconstructions run one after another in this process.
+        depth (int): Poisson reconstruction depth.
+        densityPercentile (float): Percentile of the lowest vertex densities to remove.
+        cacheKeys (list): Optional stage cache key for each DataFrame.
+
+    Returns:
+        list: (vertices, triangles, colors) arrays for each DataFrame, see dfToMeshArrays.
+    """
+    cacheKeys = cacheKeys or [None] * len(dfs)
+    stages = getStageCache() if any(key is not None for key in cacheKeys) else None
+    arrays = [stages.get(key) if key is not None else None for key in cacheKeys]
+    missing = [i for i, a in enumerate(arrays) if a is None]
+
+    seconds = {}
+    workers = max(1, min(workers or os.cpu_count() or 1, len(missing)))
+    if workers == 1:
+        for i in missing:
+            start = time.perf_counter()
+            arrays[i] = dfToMeshArrays(dfs[i], depth, densityPercentile)
+            seconds[i] = time.perf_counter() - start
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {i: pool.submit(meshArraysTask, dfs[i][['x', 'y', 'z', 'r', 'g', 'b']], depth, densityPercentile)
+                       for i in missing}
+            for i in missing:
+                arrays[i], records, seconds[i] = futures[i].result()
+                instrument.add(records)
+
+    for i in missing:
+        if cacheKeys[i] is not None:
+            stages.put(cacheKeys[i], arrays[i])
+            stages.put(poissonSecondsKey(cacheKeys[i]), seconds[i])
+    return arrays
+
+
+# Names of the category meshes, in the order of categorySamples
+CATEGORY_NAMES = ["walls", "floor", "ceiling", "windows"]
+
+# Triangle budgets of the decimated levels written by run(lodBudgets=LOD_BUDGETS)
+LOD_BUDGETS = (50000, 10000, 2000)
+# Quadric error weight of boundary edges; high values keep the open edges of the surfaces in place
+LOD_BOUNDARY_WEIGHT = 1000.0
+
+
+def decimateArrays(arrays, targetTriangles, boundaryWeight=LOD_BOUNDARY_WEIGHT):
+    # Quadric decimation of mesh arrays to about targetTriangles; vertex colours are carried along
+    vertices, triangles, colors = arrays
+    mesh = o3d.geometry.TriangleMesh(o3d.utility.Vector3dVector(vertices), o3d.utility.Vector3iVector(triangles))
+    if len(colors):
+        mesh.vertex_colors = o3d.utility.Vector3dVector(colors)
+    mesh = mesh.simplify_quadric_decimation(int(targetTriangles), boundary_weight=boundaryWeight)
+    mesh.remove_unreferenced_vertices()
+    return np.asarray(mesh.vertices), np.asarray(mesh.triangles), np.asarray(mesh.vertex_colors)
+
+
+def lodPyramid(arrays, budgets=LOD_BUDGETS, meshKey=None, name="mesh"):
+    """
+    Decimated versions of a mesh, one per triangle budget.
+
+    Each level is decimated from the previous one, so the coarser levels
+    cost little. A level whose budget is at or above the triangle count of
+    the previous level reuses it, so every mesh has one level per budget.
+    With a meshKey the levels go through the stage cache.
+
+    Parameters:
+        arrays (tuple): (vertices, triangles, colors) of the full mesh.
+        budgets (tuple): Triangle budgets, largest first.
+        meshKey (str): Stage cache key of the full mesh, or None to bypass the cache.
+        name (str): Mesh name used in the report.
+
+    Returns:
+        list: (budget, arrays) per level, starting with (None, arrays) for the full mesh.
+    """
+    levels = [(None, arrays)]
+    key = meshKey
+    for budget in sorted(budgets, reverse=True):
+        previous = levels[-1][1]
+        if budget >= len(previous[1]):
+            levels.append((budget, previous))
+            continue
+        key = getStageCache().key("lod", key, triangles=budget, boundaryWeight=LOD_BOUNDARY_WEIGHT) if key else None
+        start = time.perf_counter()
+        with instrument.stage("decimate", triangles=len(previous[1]), budget=budget) as record:
+            decimated = getStageCache().fetch(key, lambda: decimateArrays(previous, budget)) if key else decimateArrays(previous, budget)
+            record["triangles_kept"] = len(decimated[1])
+        print("LOD %s: %d -> %d triangles in %.2f s" % (name, len(previous[1]), len(decimated[1]), time.perf_counter() - start))
+        levels.append((budget, decimated))
+    return levels
+
+
 # def add_numbers(a: str, b: float) -> rhino3dm.Mesh:
 
 
-def runAll():
-    from os import listdir
-    from os.path import isfile, join
-    onlyfiles = [f for f in listdir("C:/Users/mskepasts/Documents/GitHub/3d-scan-with-spatial-analysis/data/") if isfile(join("C:/Users/mskepasts/Documents/GitHub/3d-scan-with-spatial-analysis/data/", f))]
+# Scans, models and the stage cache live in the repository by default, wherever it is checked out;
+# cli.py overrides them with --data-dir, --model-dir and --cache-dir
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(REPO_DIR, "data", "")
+MODEL_DIR = os.path.join(REPO_DIR, "models", "")
+CACHE_DIR = os.path.join(REPO_DIR, "cache", "")
+CACHE_MAX_BYTES = 5 * 1024 ** 3
 
-    for file in onlyfiles:
-        fileName = os.path.basename(file).split('/')[-1]
-        run(fileName)
+stageCache = None
 
 
-def getHeight(walldf):
-    return walldf['Z'].max() - walldf['Z'].min()
+def configureDirectories(dataDir=None, modelDir=None, cacheDir=None):
+    # Points this process at other scan, model and cache directories; None keeps the current one.
+    # runAll passes the directories on to its worker processes with this, since processes
+    # started with spawn (the only start method on Windows) import run.py afresh.
+    global DATA_DIR, MODEL_DIR, CACHE_DIR, stageCache
+    if dataDir:
+        DATA_DIR = os.path.join(os.path.abspath(dataDir), "")
+    if modelDir:
+        MODEL_DIR = os.path.join(os.path.abspath(modelDir), "")
+    if cacheDir:
+        CACHE_DIR = os.path.join(os.path.abspath(cacheDir), "")
+        stageCache = None
 
 
-def run(name):
-    try:
-        a = dir_path = "C:/Users/mskepasts/Documents/GitHub/3d-scan-with-spatial-analysis/" + "/data/" + name
-        table = pq.read_table(a)
+def getStageCache():
+    # The stage cache is created on first use so importing run.py touches no directories
+    global stageCache
+    if stageCache is None:
+        stageCache = cache.StageCache(CACHE_DIR, CACHE_MAX_BYTES)
+    return stageCache
 
-    except:
-        exit("File does not exist...")
 
+def loadSetup(name):
+    # Raises FileNotFoundError for a missing setup instead of exiting, so a batch keeps going
+    path = DATA_DIR + name
+    if not os.path.isfile(path):
+        raise FileNotFoundError("File does not exist: " + path)
+    return scan.load_indexed(path)
 
-    model = rhino3dm.File3dm()
-    final_fp,room_height,final_endpoint_lst,z_bound = outline.main(a)
-    pLine = getPolyline(final_fp, room_height[0])
-    for i, points in enumerate(final_endpoint_lst):
-        model.Objects.AddMesh(windowMesh(points, z_bound[i]))
-        model.Objects.AddPolyline(getPolyline(points, z_bound[i][0]))
-    
-    
-    model.Objects.AddMesh(wallsMesh(pLine, room_height))
-    # Convert to a pandas DataFrame if needed
-    df = table.to_pandas()
-    dfWalls = df[df['cat'] == 2]
-    dfFloor = df[df['cat'] == 1]
-    dfCeiling = df[df['cat'] == 0]
-    dfWindow =df[df['cat'] == 10]
-
-    if(len(dfWindow) == 0):
-        fileName = os.path.basename(a).split('/')[-1]
-        print(str(fileName) + " has no windows!!")
-        return
-        
-    print("Number of points in the walls: " + str(len(dfWalls)))
-    print("Number of points in the floor: " + str(len(dfFloor)))
-    print("Number of points in the ceiling: " + str(len(dfCeiling)))
 
+def runSetup(name, pending=None, reconstructWorkers=None, streaming=False, **options):
+    """
+    Runs one setup and reports how it went, without letting errors escape.
+
+    Parameters:
+        name (str): Parquet file name of the setup.
+        pending (concurrent.futures.Future): Optional prefetch of loadSetup(name).
+        reconstructWorkers (int): Passed on to run.
+        streaming (bool): Stream the scan with runStreaming instead of loading it whole.
+        options: Further keyword arguments of run or runStreaming, e.g. planar=True.
+
+    Returns:
+        dict: name, status ("succeeded", "skipped" or "failed"), message, wall time
+            and the stage records when instrumentation is on (see instrument.py).
+    """
+    start = time.perf_counter()
+    with instrument.collect() as records:
+        try:
+            with instrument.stage("setup"):
+                path = DATA_DIR + name
+                if streaming:
+                    modelPath = runStreaming(path, name, reconstructWorkers, getStageCache().scan_key(path), **options)
+                else:
+                    # With a prefetch this is the time spent waiting for it
+                    with instrument.stage("load") as record:
+                        df = pending.result() if pending is not None else loadSetup(name)
+                        record["points"] = len(df)
+                    modelPath = run(df, name, reconstructWorkers, getStageCache().scan_key(path), **options)
+            if modelPath is None:
+                status, message = "skipped", "has no windows"
+            else:
+                status, message = "succeeded", modelPath
+        except Exception as e:
+            traceback.print_exc()
+            status, message = "failed", type(e).__name__ + ": " + str(e)
+    instrument.emit(records, setup=name, status=status)
+    return {"name": name, "status": status, "message": message, "seconds": time.perf_counter() - start,
+            "stages": records}
+
+
+def runSequential(names, streaming=False, options=None):
+    # Runs the setups one after another in this process. The next scan is loaded on a
+    # background thread while the current one is processed, except when streaming, which
+    # never holds a whole scan in memory. options are passed on to runSetup.
+    results = []
+    with ThreadPoolExecutor(max_workers=1) as loader:
+        def prefetch(name):
+            if name is None or streaming:
+                return None
+            return loader.submit(loadSetup, name)
+
+        pending = prefetch(names[0] if names else None)
+        for name, nextName in zip(names, names[1:] + [None]):
+            nextPending = prefetch(nextName)
+            results.append(runSetup(name, pending, None, streaming, **(options or {})))
+            pending = nextPending
+    return results
+
+
+def batchTask(name, started, streaming=False, options=None):
+    # One setup on a pool worker. It is marked in started first, so the setup in flight
+    # when a worker process dies can be told apart from those that never began.
+    started[name] = os.getpid()
+    # The setups already run in parallel, so each reconstructs its categories sequentially
+    return runSetup(name, None, 1, streaming, **(options or {}))
+
+
+def runPool(names, workers, context, started, streaming=False, options=None):
+    # Runs the setups on a fresh pool, each submitted on its own so an idle worker takes the
+    # next one. Returns the results by name and whether a worker process died.
+    byName, broken = {}, False
+    # Workers may import run.py afresh, so they are given the directories of this process
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=configureDirectories,
+                             initargs=(DATA_DIR, MODEL_DIR, CACHE_DIR)) as pool:
+        futures = {name: pool.submit(batchTask, name, started, streaming, options) for name in names}
+        for name, future in futures.items():
+            try:
+                byName[name] = future.result()
+            except BrokenProcessPool:
+                broken = True
+    return byName, broken
+
+
+def crashedResult(name):
+    return {"name": name, "status": "failed", "message": "worker process crashed", "seconds": 0.0, "stages": []}
+
+
+def printSummary(results):
+    counts = {status: sum(r["status"] == status for r in results) for status in ("succeeded", "skipped", "failed")}
+    print("Batch summary: %d succeeded, %d skipped, %d failed" % (counts["succeeded"], counts["skipped"], counts["failed"]))
+    for r in results:
+        print("  %-9s  %-24s %8.1f s  %s" % (r["status"], r["name"], r["seconds"], r["message"]))
+
+
+def runAll(workers=None, streaming=False, profile=None, startMethod=None, **options):
+    """
+    Runs every parquet setup in DATA_DIR on a pool of worker processes.
 
+    A failing setup is recorded and the batch continues with the next one. When
+    a worker process dies, only the setup it was running is marked failed; the
+    unfinished setups are run again on a new pool. If several setups were in
+    flight, each is rerun alone to find the one that crashes.
 
-    df_sampleWalls = dfWalls.sample(n=40000, random_state=1)
-    df_sampleFloor = dfFloor
-    df_sampleCeiling = dfCeiling
-    # df_sampleWalls = dfWalls.sample(n=40000, random_state=1)
-    df_sampleFloor = dfFloor.sample(n=40000, random_state=1)
-    df_sampleCeiling = dfCeiling.sample(n=40000, random_state=1)
+    Parameters:
+        workers (int): Number of worker processes, defaults to the CPU count. With
+            one worker the setups run in this process and the next scan is loaded
+            while the current one is processed.
+        streaming (bool): Stream each scan with runStreaming instead of loading it whole.
+        profile (str): Switches on the stage instrumentation, see instrument.enable. The
+            stage records of every setup are written as JSON lines and their totals
+            per stage printed after the batch. Also switched on by the SCAN_PROFILE
+            environment variable.
+        startMethod (str): multiprocessing start method of the workers, e.g. "spawn"
+            to run the batch as on Windows; the platform default when None.
+        options: Further keyword arguments of run or runStreaming, e.g. planar=True.
 
+    Returns:
+        list: One runSetup result per setup, in file name order.
+    """
+    if profile:
+        instrument.enable(profile)
+    names = sorted(f for f in os.listdir(DATA_DIR) if f.endswith(".parquet") and os.path.isfile(os.path.join(DATA_DIR, f)))
+    workers = max(1, min(workers or os.cpu_count() or 1, len(names)))
 
-    df_sampleWindow = df[df['cat'] == 10]
+    if workers == 1:
+        byName = {r["name"]: r for r in runSequential(names, streaming, options)}
+    else:
+        byName = {}
+        context = multiprocessing.get_context(startMethod)
+        with context.Manager() as manager:
+            todo = names
+            while todo:
+                started = manager.dict()
+                done, broken = runPool(todo, workers, context, started, streaming, options)
+                byName.update(done)
+                if not broken:
+                    break
+                inFlight = [name for name in todo if name in started and name not in byName]
+                if len(inFlight) == 1:
+                    print("Worker process crashed while running " + inFlight[0])
+                    byName[inFlight[0]] = crashedResult(inFlight[0])
+                else:
+                    # Any of them may have crashed the worker, so each is run alone
+                    print("Worker process crashed, running each of " + ", ".join(inFlight) + " alone")
+                    for name in inFlight:
+                        done, broken = runPool([name], 1, context, manager.dict(), streaming, options)
+                        byName[name] = crashedResult(name) if broken else done[name]
+                todo = [name for name in todo if name not in byName]
+
+    summary = [byName[name] for name in names]
+    printSummary(summary)
+    if instrument.enabled():
+        totals = instrument.aggregate([s for r in summary for s in r["stages"]])
+        instrument.emit(totals, setup="*", aggregate=True)
+        instrument.print_aggregate(totals)
+    return summary
 
-    walls = dfToRhinoMesh(df_sampleWalls)
-    floor = dfToRhinoMesh(df_sampleFloor)
-    ceiling = dfToRhinoMesh(df_sampleCeiling)
-    window = dfToRhinoMesh(df_sampleWindow)
-    # Create a 3dm file
-    # o3d.io.write_triangle_mesh("colored_mesh.ply", dfToMesh(df_sampleWalls))
 
+def getHeight(walldf):
+    return walldf['Z'].max() - walldf['Z'].min()
 
-   
-    model.Objects.AddMesh(walls)
-    model.Objects.AddMesh(floor)
-    model.Objects.AddMesh(ceiling)
-    model.Objects.AddMesh(window)
-    model.Objects.AddPolyline(pLine)
 
-    fileName = os.path.basename(a).split('/')[-1]
+def outlineStage(df, scanKey=None, imageSize=(500, 500), padding=50, pixelSize=None, tileWorkers=None):
+    # outline.main through the stage cache when the scan has a key. With a pixelSize in metres
+    # every room is outlined by outline.main_tiled instead, and the outline is a list of polygons.
+    if pixelSize:
+        compute = lambda: outline.main_tiled(df, pixelSize, padding, workers=tileWorkers)
+        params = {"pixelSize": pixelSize, "padding": padding, "tiled": True}
+    else:
+        compute = lambda: outline.main(df, imageSize, padding)
+        params = {"imageSize": imageSize, "padding": padding}
+    with instrument.stage("outline", points=len(df)):
+        if not scanKey:
+            return compute()
+        stages = getStageCache()
+        return stages.fetch(stages.key("outline", scanKey, **params), compute)
+
+
+def categorySamples(df, voxelSize=0.03, sampleSize=None):
+    """
+    Points reconstructed for the walls, floor, ceiling and windows.
+
+    Walls, floor and ceiling are downsampled on a voxel grid (see voxel.py), so
+    the result is deterministic and evenly spread whatever the scan density.
+    Windows are kept whole.
+
+    Parameters:
+        df (pd.DataFrame or scan.ScanIndex): The scan.
+        voxelSize (float): Edge length of the voxels.
+        sampleSize (int): Instead of voxelSize, choose the voxel size that keeps about
+            sampleSize points per category. Smaller categories are kept whole.
+
+    Returns:
+        list: DataFrames of the walls, floor, ceiling and windows.
+    """
+    with instrument.stage("samples", points=len(df)) as record:
+        samples = []
+        for cat in (2, 1, 0):
+            catDf = scan.select_category(df, cat)
+            if sampleSize:
+                samples.append(voxel.budget_downsample(catDf, sampleSize))
+            else:
+                samples.append(voxel.voxel_downsample(catDf, voxelSize))
+        samples.append(scan.select_category(df, 10))
+        record["samples"] = [len(s) for s in samples]
+    return samples
+
+
+def sampleKeyFor(scanKey, voxelSize=0.03, sampleSize=None, streamed=False):
+    # Stage cache key of the category samples of a scan, None when the scan has no key.
+    # Streamed voxel samples equal those of categorySamples up to float rounding, streamed budget samples
+    # start from a reservoir and do not.
+    if not scanKey:
+        return None
+    if sampleSize:
+        sampler = "reservoirVoxelBudget" if streamed else "voxelBudget"
+        return getStageCache().key("samples", scanKey, sampler=sampler, sampleSize=sampleSize, sampleSeed=1)
+    return getStageCache().key("samples", scanKey, sampler="voxel", voxelSize=voxelSize)
+
+
+def categoryMeshes(samples, reconstructWorkers=None, sampleKey=None, depth=9, densityPercentile=5):
+    """
+    Reconstructs the walls, floor, ceiling and window meshes of a scan.
+
+    Parameters:
+        samples (list): Points of the walls, floor, ceiling and windows, see categorySamples.
+        reconstructWorkers (int): Passed to reconstructAll.
+        sampleKey (str): Stage cache key of the samples (see sampleKeyFor), or None to bypass the cache.
+        depth (int): Poisson reconstruction depth.
+        densityPercentile (float): Percentile of the lowest vertex densities to remove.
+
+    Returns:
+        list: rhino3dm.Mesh of the walls, floor, ceiling and windows.
+    """
+    return meshesFromArrays(categoryMeshArrays(samples, reconstructWorkers, sampleKey, depth, densityPercentile))
+
+
+def categoryMeshKeys(sampleKey, depth=9, densityPercentile=5, planar=False):
+    # Stage cache keys of the four category meshes, None without a sample key.
+    # Planar walls, floor and ceiling are not cached, they take milliseconds to rebuild.
+    if not sampleKey:
+        return None
+    stages = getStageCache()
+    keys = [stages.key("mesh", sampleKey, category=category, depth=depth, densityPercentile=densityPercentile)
+            for category in (2, 1, 0, 10)]
+    return [None] * 3 + keys[3:] if planar else keys
+
+
+def categoryMeshArrays(samples, reconstructWorkers=None, sampleKey=None, depth=9, densityPercentile=5,
+                       outlineResult=None):
+    # categoryMeshes as (vertices, triangles, colors) arrays. Given the outlineResult of the scan,
+    # the walls, floor and ceiling are planar (see planarArrays) and only the windows are reconstructed.
+    if outlineResult is None:
+        return reconstructAllArrays(samples, reconstructWorkers, depth, densityPercentile,
+                                    categoryMeshKeys(sampleKey, depth, densityPercentile))
+    final_fp, room_height = outlineResult[:2]
+    keys = categoryMeshKeys(sampleKey, depth, densityPercentile, planar=True)
+    windows = reconstructAllArrays(samples[3:], reconstructWorkers, depth, densityPercentile, keys and keys[3:])
+    return planarArrays(final_fp, room_height, samples[:3],
+                        poissonSeconds=poissonSecondsFor(sampleKey, depth, densityPercentile)) + windows
+
+
+def poissonSecondsFor(sampleKey, depth=9, densityPercentile=5):
+    # Recorded Poisson times of the walls, floor and ceiling of these samples, None where they never ran
+    keys = categoryMeshKeys(sampleKey, depth, densityPercentile)
+    if not keys:
+        return None
+    return [getStageCache().get(poissonSecondsKey(key)) for key in keys[:3]]
+
+
+def categoryLods(arrays, budgets=LOD_BUDGETS, sampleKey=None, depth=9, densityPercentile=5, planar=False):
+    # lodPyramid of each category mesh, as rhino3dm meshes: one list of (budget, mesh) per category
+    meshKeys = categoryMeshKeys(sampleKey, depth, densityPercentile, planar) or [None] * len(arrays)
+    lods = []
+    for a, meshKey, name in zip(arrays, meshKeys, CATEGORY_NAMES):
+        levels = lodPyramid(a, budgets, meshKey, name)
+        lods.append([(budget, mesh) for (budget, _), mesh in zip(levels, meshesFromArrays([l for _, l in levels]))])
+    return lods
+
+
+def writeModel(name, outlineResult, meshes, lods=None, planar=False):
+    # Assembles the outline, window and category meshes of a setup into a 3dm file in MODEL_DIR.
+    # lods (see categoryLods) replaces the category meshes with one layer per level of detail.
+    # The outline is one polygon, or a list of room polygons from outline.main_tiled.
+    # planar walls (see planarArrays) already follow the outline, so no extruded walls are added.
+    final_fp,room_height,final_endpoint_lst,z_bound = outlineResult
+    rooms = final_fp if isinstance(final_fp, list) else [final_fp]
+    walls, floor, ceiling, window = meshes
+
+    model = rhino3dm.File3dm()
+    if lods:
+        # Objects without attributes go to the first layer
+        addLayer(model, "Outline")
+    pLines = [getPolyline(room, room_height[0]) for room in rooms]
+    for i, points in enumerate(final_endpoint_lst):
+        model.Objects.AddMesh(windowMesh(points, z_bound[i]))
+        model.Objects.AddPolyline(getPolyline(points, z_bound[i][0]))
+    
+    
+    if not planar:
+        with instrument.stage("wallsMesh", vertices=sum(len(room) for room in rooms)):
+            for pLine in pLines:
+                model.Objects.AddMesh(wallsMesh(pLine, room_height))
+    if lods:
+        addLods(model, lods)
+    else:
+        model.Objects.AddMesh(walls)
+        model.Objects.AddMesh(floor)
+        model.Objects.AddMesh(ceiling)
+        model.Objects.AddMesh(window)
+    for pLine in pLines:
+        model.Objects.AddPolyline(pLine)
+
+    fileName = os.path.basename(name).split('/')[-1]
     num = fileName[fileName.index("_")+1 : fileName.index(".")]
 
     # Write the model to a file
-    model.Write("C:/Users/mskepasts/Documents/GitHub/3d-scan-with-spatial-analysis/models/" + "setup_" + str(num)+ ".3dm", 6) 
+    modelPath = MODEL_DIR + "setup_" + str(num)+ ".3dm"
+    with instrument.stage("File3dm.Write") as record:
+        model.Write(modelPath, 6) 
+        record["bytes"] = os.path.getsize(modelPath) if os.path.exists(modelPath) else None
 
     print("Rhino Model: " + "setup_" + str(num)+ " saved!")
     print("\n")
+    return modelPath
+
+
+def addLayer(model, name, visible=True):
+    layer = rhino3dm.Layer()
+    layer.Name = name
+    layer.Visible = visible
+    return model.Layers.Add(layer)
+
+
+def addLods(model, lods):
+    # One layer per level of detail holding the named category meshes of that level.
+    # Only the first decimated level is visible, the full meshes and coarser levels are hidden.
+    levelCount = len(lods[0])
+    for level in range(levelCount):
+        budget = lods[0][level][0]
+        layerName = "LOD %d" % level if budget is None else "LOD %d (%d triangles)" % (level, budget)
+        layerIndex = addLayer(model, layerName, visible=(level == min(1, levelCount - 1)))
+        for levels, categoryName in zip(lods, CATEGORY_NAMES):
+            attributes = rhino3dm.ObjectAttributes()
+            attributes.LayerIndex = layerIndex
+            attributes.Name = "%s LOD %d" % (categoryName, level)
+            model.Objects.AddMesh(levels[level][1], attributes)
+
+
+def hasWindows(name, counts):
+    if counts.get(10, 0) == 0:
+        fileName = os.path.basename(name).split('/')[-1]
+        print(str(fileName) + " has no windows!!")
+        return False
+
+    print("Number of points in the walls: " + str(counts.get(2, 0)))
+    print("Number of points in the floor: " + str(counts.get(1, 0)))
+    print("Number of points in the ceiling: " + str(counts.get(0, 0)))
+    return True
+
+
+def run(df, name, reconstructWorkers=None, scanKey=None,
+        voxelSize=0.03, sampleSize=None, depth=9, densityPercentile=5, imageSize=(500, 500), padding=50,
+        lodBudgets=None, pixelSize=None, planar=False):
+    # df is the scan loaded once with loadSetup, name its parquet file name.
+    # reconstructWorkers is passed to reconstructAll for the four category meshes.
+    # scanKey identifies the scan in the stage cache (see StageCache.scan_key); without it nothing is cached.
+    # lodBudgets, e.g. LOD_BUDGETS, writes decimated levels of the category meshes on their own layers.
+    # pixelSize, in metres, outlines every room of the scan with outline.main_tiled.
+    # planar builds the walls, floor and ceiling from the outline (see planarArrays) instead of
+    # reconstructing them with Poisson; only the windows are reconstructed.
+    outlineResult = outlineStage(df, scanKey, imageSize, padding, pixelSize)
+
+    counts = scan.category_counts(df)
+    if not hasWindows(name, counts):
+        return None
+
+    samples = categorySamples(df, voxelSize, sampleSize)
+    return writeCategoryMeshes(name, outlineResult, samples, reconstructWorkers,
+                               sampleKeyFor(scanKey, voxelSize, sampleSize), depth, densityPercentile, lodBudgets,
+                               planar)
+
+
+def writeCategoryMeshes(name, outlineResult, samples, reconstructWorkers, sampleKey, depth, densityPercentile,
+                        lodBudgets=None, planar=False):
+    # Reconstructs the category meshes, with their levels of detail when lodBudgets is given, and writes the model
+    arrays = categoryMeshArrays(samples, reconstructWorkers, sampleKey, depth, densityPercentile,
+                                outlineResult if planar else None)
+    if lodBudgets:
+        lods = categoryLods(arrays, lodBudgets, sampleKey, depth, densityPercentile, planar)
+        meshes = [levels[0][1] for levels in lods]
+    else:
+        lods = None
+        meshes = meshesFromArrays(arrays)
+    return writeModel(name, outlineResult, meshes, lods, planar)
+
+
+def runStreaming(path, name, reconstructWorkers=None, scanKey=None,
+                 voxelSize=0.03, sampleSize=None, depth=9, densityPercentile=5, imageSize=(500, 500), padding=50,
+                 lodBudgets=None, pixelSize=None, planar=False):
+    # Same as run, but streams the scan at path batch by batch (see stream.scan_summary)
+    # so peak memory does not grow with the size of the scan. The tiled outline of
+    # pixelSize needs the whole scan, so it is refused rather than silently replaced.
+    if pixelSize:
+        raise ValueError("pixelSize (outline.main_tiled) needs the whole scan and cannot be streamed")
+    with instrument.stage("scan_summary") as record:
+        summary = stream.scan_summary(path, sampleSize, imageSize, padding, voxel_size=None if sampleSize else voxelSize)
+        record["points"] = sum(summary["counts"].values())
+    # The streamed outline is identical to outline.main, so both share the outline cache entry
+    with instrument.stage("outline", points=record["points"]):
+        if scanKey:
+            stages = getStageCache()
+            outlineResult = stages.fetch(
+                stages.key("outline", scanKey, imageSize=imageSize, padding=padding),
+                lambda: stream.outline_from_summary(summary))
+        else:
+            outlineResult = stream.outline_from_summary(summary)
+
+    if not hasWindows(name, summary["counts"]):
+        return None
+
+    samples = [summary["samples"][cat] for cat in (2, 1, 0, 10)]
+    return writeCategoryMeshes(name, outlineResult, samples, reconstructWorkers,
+                               sampleKeyFor(scanKey, voxelSize, sampleSize, streamed=True), depth, densityPercentile,
+                               lodBudgets, planar)
 
 # Defining main function
 def main():
@@ -325,7 +903,15 @@ def main():
         print("yes")
         runAll()
     else:
-        run("setup_" + num + ".parquet")
+        name = "setup_" + num + ".parquet"
+        try:
+            df = loadSetup(name)
+        except FileNotFoundError:
+            exit("File does not exist...")
+        # Stage timings are written when the SCAN_PROFILE environment variable is set, see instrument.py
+        with instrument.collect() as records:
+            run(df, name, scanKey=getStageCache().scan_key(DATA_DIR + name))
+        instrument.emit(records, setup=name)
 
 
 # Using the special variable 
@@ -0,0 +1,218 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+
+# Columns used anywhere in the pipeline
+SCAN_COLUMNS = ['x', 'y', 'z', 'r', 'g', 'b', 'cat', 'inst']
+
+# 0: ceiling, 1: floor, 2: walls, 10: windows
+SCAN_CATEGORIES = [0, 1, 2, 10]
+
+
+def load_scan(filename, columns=SCAN_COLUMNS, categories=SCAN_CATEGORIES):
+    """
+    Reads a parquet scan once, keeping only the needed columns and categories.
+
+    The column projection and the category filter are both applied by Arrow
+    while reading, so unused columns and points are never decoded into pandas.
+
+    Parameters:
+        filename (str): Path to the parquet scan.
+        columns (list): Columns to read.
+        categories (list): Values of 'cat' to keep, or None to keep every point.
+
+    Returns:
+        pd.DataFrame: The scan points.
+    """
+    filters = None
+    if categories is not None:
+        filters = [('cat', 'in', list(categories))]
+    table = pq.read_table(filename, columns=list(columns), filters=filters)
+    return table.to_pandas()
+
+
+# Fields of the source scan recorded with a saved index, in order
+INDEX_META = ("version", "rows", "size", "mtime")
+# Raised when the row order of saved indexes changes, so older ones are rebuilt
+INDEX_VERSION = 2
+
+
+class ScanIndex:
+    """
+    A scan sorted once by category, with the offsets of every (cat, inst) group.
+
+    Every category and every (cat, inst) instance is a contiguous run of the
+    sorted points, so instance() and the group() of a single-instance category
+    are row slices of one DataFrame: views, not copies (pandas copy-on-write
+    copies only if they are written). Within a category the instances are in
+    order of their first point in the scan and the points of an instance in
+    scan order; group() of a category with several instances puts its points
+    back in scan order. Results therefore come out in the same order as from
+    the DataFrame (e.g. the windows of outline.main and the window samples of
+    run.categorySamples). The z range of each instance is computed with the index.
+
+    Parameters:
+        df (pd.DataFrame): The scan, as returned by load_scan.
+        order (np.ndarray): Row order that sorts df, e.g. from a saved index;
+            computed with a stable sort when None.
+    """
+
+    def __init__(self, df, order=None):
+        if order is None:
+            cat = df['cat'].to_numpy()
+            # Group codes in order of first appearance, so sorting by them keeps that order
+            codes, _ = pd.factorize((cat.astype(np.int64) << 32) | (df['inst'].to_numpy().astype(np.int64) & 0xFFFFFFFF))
+            order = np.lexsort((codes, cat))
+        self.order = order
+        self.df = df.take(order).reset_index(drop=True)
+        cat = self.df['cat'].to_numpy()
+        inst = self.df['inst'].to_numpy()
+        z = self.df['z'].to_numpy()
+        # One row per (cat, inst) group: its key, first and past-the-end row and z range
+        starts = np.flatnonzero(np.r_[True, (cat[1:] != cat[:-1]) | (inst[1:] != inst[:-1])])[:len(cat)]
+        self.keys = np.column_stack((cat[starts], inst[starts]))
+        self.offsets = np.r_[starts, len(cat)]
+        self.z_min = np.minimum.reduceat(z, starts) if len(z) else z
+        self.z_max = np.maximum.reduceat(z, starts) if len(z) else z
+
+    def __len__(self):
+        return len(self.df)
+
+    @property
+    def nbytes(self):
+        # Memory held by the sorted points and the tables, for the memory cache
+        tables = (self.order, self.keys, self.offsets, self.z_min, self.z_max)
+        return int(self.df.memory_usage(deep=True).sum()) + sum(a.nbytes for a in tables)
+
+    def groups(self, cat):
+        # Positions of the (cat, inst) groups of a category in the offset table
+        return np.flatnonzero(self.keys[:, 0] == cat)
+
+    def span(self, cat, inst=None):
+        # (start, stop) rows of a category or of one of its instances; an empty span when absent
+        groups = self.groups(cat)
+        if inst is not None:
+            groups = groups[self.keys[groups, 1] == inst]
+        if not len(groups):
+            return 0, 0
+        return int(self.offsets[groups[0]]), int(self.offsets[groups[-1] + 1])
+
+    def group(self, cat):
+        # The points of a category in scan order, a slice when it has a single instance
+        start, stop = self.span(cat)
+        if len(self.groups(cat)) > 1:
+            return self.df.iloc[start + np.argsort(self.order[start:stop], kind="stable")]
+        return self.df.iloc[start:stop]
+
+    def instance(self, cat, inst):
+        start, stop = self.span(cat, inst)
+        return self.df.iloc[start:stop]
+
+    def instances(self, cat):
+        # Instance ids of a category, in order of first appearance
+        return self.keys[self.groups(cat), 1]
+
+    def z_bounds(self, cat, inst=None):
+        # [z min, z max] of a category or of one of its instances
+        groups = self.groups(cat)
+        if inst is not None:
+            groups = groups[self.keys[groups, 1] == inst]
+        return np.array([self.z_min[groups].min(), self.z_max[groups].max()])
+
+    def counts(self):
+        # Points per category
+        sizes = np.diff(self.offsets)
+        return {int(cat): int(sizes[self.keys[:, 0] == cat].sum()) for cat in np.unique(self.keys[:, 0])}
+
+    def save(self, path, source=None):
+        # Writes the row order to an .npz file, with the size and mtime of the source scan it belongs to
+        meta = {"version": INDEX_VERSION, "rows": len(self.order)}
+        if source is not None:
+            stat = os.stat(source)
+            meta.update(size=stat.st_size, mtime=stat.st_mtime_ns)
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, order=self.order, meta=np.array([meta.get(k, -1) for k in INDEX_META]))
+        os.replace(tmp_path, path)
+
+
+def index_path(filename):
+    # The index of a parquet scan is saved next to it: setup_1.parquet -> setup_1.index.npz
+    return os.path.splitext(filename)[0] + ".index.npz"
+
+
+def load_indexed(filename, columns=SCAN_COLUMNS, categories=SCAN_CATEGORIES, save=True):
+    """
+    Reads a parquet scan with load_scan and indexes it by (cat, inst).
+
+    The row order is kept next to the scan (see index_path), so later runs
+    reorder the points without sorting them again. A saved order is used only
+    if the scan has the size, modification time and row count it was made for,
+    and the index the current INDEX_VERSION.
+
+    Parameters:
+        filename (str): Path to the parquet scan.
+        columns (list): Columns to read, must include cat, inst and z.
+        categories (list): Values of 'cat' to keep, or None to keep every point.
+        save (bool): Save the order when it had to be computed.
+
+    Returns:
+        ScanIndex: The indexed scan.
+    """
+    df = load_scan(filename, columns, categories)
+    path = index_path(filename)
+    stat = os.stat(filename)
+    try:
+        with np.load(path) as saved:
+            if tuple(saved["meta"]) == (INDEX_VERSION, len(df), stat.st_size, stat.st_mtime_ns):
+                return ScanIndex(df, saved["order"])
+    except (OSError, ValueError, KeyError):
+        pass
+    index = ScanIndex(df)
+    if save:
+        try:
+            index.save(path, filename)
+        except OSError:
+            pass  # a read-only data directory only costs the sort next time
+    return index
+
+
+def select_category(df, cat):
+    # The points of a category of a scan DataFrame or ScanIndex
+    if isinstance(df, ScanIndex):
+        return df.group(cat)
+    return df[df['cat'] == cat]
+
+
+def category_counts(df):
+    # Points per category of a scan DataFrame or ScanIndex
+    if isinstance(df, ScanIndex):
+        return df.counts()
+    return {int(cat): int(n) for cat, n in df['cat'].value_counts().items()}
+
+
+if __name__ == "__main__":
+    # Check that an indexed scan gives the same outline, windows in the same order, and
+    # category samples as the DataFrame:
+    #   python scan.py path/to/setup_1.parquet
+    import sys
+
+    import outline
+    import scan
+    import voxel
+
+    # Through the imported module, whose ScanIndex is the class outline checks for
+    df = scan.load_scan(sys.argv[1])
+    index = scan.ScanIndex(df)
+    for engine in ("raster", "hull"):
+        a, b = outline.main(df, engine=engine), outline.main(index, engine=engine)
+        same = (np.array_equal(a[0], b[0]) and np.array_equal(a[1], b[1])
+                and len(a[2]) == len(b[2]) and all(np.array_equal(x, y) for x, y in zip(a[2], b[2]))
+                and all(np.array_equal(x, y) for x, y in zip(a[3], b[3])))
+        print("outline.main[%s]: same footprint, windows and window order: %s" % (engine, same))
+    for cat in np.unique(df['cat']):
+        a = voxel.voxel_downsample(scan.select_category(df, cat).reset_index(drop=True), 0.03)
+        b = voxel.voxel_downsample(scan.select_category(index, cat).reset_index(drop=True), 0.03)
+        print("category %d: same samples in the same order: %s" % (cat, a.equals(b)))
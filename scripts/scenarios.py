@@ -0,0 +1,289 @@
+import hashlib
+import json
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+import viewerdata
+
+
+# S2_V0_H1: scene 2, variant 0 (0 sun hours, 1 view analysis), hour window 1
+SCENARIO_NAME = re.compile(r"^S(\d+)_V(\d+)_H(\d+)$")
+# SunHours_8_12, A_sunHours_10_14: a prefix and the hours of the analysis period
+PERIOD_NAME = re.compile(r"^(.*)_(\d+_\d+)$")
+
+
+def parse_scenario_name(name):
+    # (scene, variant, hour) of a ViewerData file name without extension; parts that do not apply are None
+    match = SCENARIO_NAME.match(name)
+    if match:
+        return tuple(int(g) for g in match.groups())
+    match = PERIOD_NAME.match(name)
+    if match:
+        return match.group(1), None, match.group(2)
+    return name, None, None
+
+
+def geometry_key(vertices, faces):
+    # Content hash of a mesh geometry
+    digest = hashlib.sha256()
+    for array in (vertices, faces):
+        array = np.ascontiguousarray(array)
+        digest.update(str((array.dtype.str, array.shape)).encode())
+        digest.update(array.tobytes())
+    return digest.hexdigest()[:16]
+
+
+def encode_colors(colors):
+    # Per-vertex colours as a uint8 index into a palette when at most 256 colours are used
+    palette, index = np.unique(colors.reshape(-1, 3), axis=0, return_inverse=True)
+    if len(palette) > 256:
+        return None, colors.astype(np.uint8)
+    return palette.astype(np.uint8), index.reshape(-1).astype(np.uint8)
+
+
+def decode_colors(palette, column):
+    return column if palette is None else palette[column]
+
+
+class ScenarioStore:
+    """
+    ViewerData scenarios with each distinct geometry stored once.
+
+    The scenarios of a scene (hour windows, sun-hour periods) share their
+    vertices and faces and differ only in vertex colours and metrics. The
+    store keeps every distinct geometry once as memory-mapped .npy files,
+    and each scenario as a uint8 colour index per vertex into a small
+    palette, plus its metrics. Scenarios with analysis values (see
+    viewerdata.legacy_field) keep them instead as uint16 steps of their legend
+    range, like the GLB files (see viewerdata.quantize_values), in a
+    compressed .npz; they are coloured by their legend when loaded.
+    index.json maps scenario names to their geometry, scene, variant, hour,
+    metrics and legend.
+
+    Layout:
+        geometry/<key>/vertices.npy, faces.npy
+        scenarios/<name>.npz (palette and column, or value steps and overrides)
+        index.json
+
+    Parameters:
+        directory (str): Directory of the store, created when missing.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(os.path.join(directory, "geometry"), exist_ok=True)
+        os.makedirs(os.path.join(directory, "scenarios"), exist_ok=True)
+        self.index_path = os.path.join(directory, "index.json")
+        try:
+            with open(self.index_path) as f:
+                self.index = json.load(f)
+        except (OSError, ValueError):
+            self.index = {}
+        # Geometries loaded so far, shared by all their scenarios
+        self.geometries = {}
+
+    def save_index(self):
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.index, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.index_path)
+
+    def add(self, name, mesh, save=True):
+        """
+        Adds a scenario, storing its geometry only if the store does not have it yet.
+
+        Parameters:
+            name (str): Scenario name, e.g. S2_V0_H1.
+            mesh (dict): Mesh as returned by viewerdata.read_viewer_text, or with values, legend and overrides.
+            save (bool): Write index.json, pass False when adding many scenarios and call save_index after.
+
+        Returns:
+            str: Key of the scenario's geometry.
+        """
+        key = geometry_key(mesh["vertices"], mesh["faces"])
+        geometry_directory = os.path.join(self.directory, "geometry", key)
+        if not os.path.isfile(os.path.join(geometry_directory, "faces.npy")):
+            os.makedirs(geometry_directory, exist_ok=True)
+            np.save(os.path.join(geometry_directory, "vertices.npy"), mesh["vertices"])
+            # faces.npy is written last and marks a complete geometry
+            np.save(os.path.join(geometry_directory, "faces.npy"), mesh["faces"])
+
+        if "values" in mesh:
+            overrides = mesh.get("overrides") or {"index": np.zeros(0, dtype=np.uint32), "colors": np.zeros((0, 3), dtype=np.uint8)}
+            steps = viewerdata.quantize_values(mesh["values"], mesh["legend"]["low"], mesh["legend"]["high"])
+            # The steps of smooth analyses compress to well under the one byte per vertex of a colour column
+            np.savez_compressed(os.path.join(self.directory, "scenarios", name + ".npz"), values=steps,
+                                override_index=overrides["index"], override_colors=overrides["colors"])
+        else:
+            palette, column = encode_colors(mesh["colors"])
+            arrays = {"column": column}
+            if palette is not None:
+                arrays["palette"] = palette
+            np.savez(os.path.join(self.directory, "scenarios", name + ".npz"), **arrays)
+
+        scene, variant, hour = parse_scenario_name(name)
+        self.index[name] = {
+            "geometry": key,
+            "scene": scene,
+            "variant": variant,
+            "hour": hour,
+            "vertices": len(mesh["vertices"]),
+            "metrics": {k: viewerdata.metric_value(v) for k, v in mesh["metrics"].items()},
+        }
+        if "values" in mesh:
+            self.index[name]["legend"] = {k: mesh["legend"][k] for k in ("name", "low", "high")}
+        if save:
+            self.save_index()
+        return key
+
+    def add_directory(self, directory, fields=False):
+        # Adds every ViewerData .txt file of directory, named after the file; returns the names added.
+        # With fields the colours are stored as analysis values on their legend (see viewerdata.legacy_field).
+        names = []
+        for fileName in sorted(os.listdir(directory)):
+            if fileName.endswith(".txt"):
+                name = fileName[:-4]
+                mesh = viewerdata.load_viewer_data(os.path.join(directory, fileName), cache=False)
+                self.add(name, viewerdata.legacy_field(mesh) if fields else mesh, save=False)
+                names.append(name)
+        self.save_index()
+        return names
+
+    def names(self, scene=None, variant=None, hour=None):
+        # Scenario names, optionally only those of a scene, variant and/or hour
+        return sorted(
+            name for name, entry in self.index.items()
+            if (scene is None or entry["scene"] == scene)
+            and (variant is None or entry["variant"] == variant)
+            and (hour is None or entry["hour"] == hour))
+
+    def geometry(self, key):
+        # Memory-mapped vertices and faces of a geometry, loaded once per store
+        if key not in self.geometries:
+            geometry_directory = os.path.join(self.directory, "geometry", key)
+            self.geometries[key] = {
+                "vertices": np.load(os.path.join(geometry_directory, "vertices.npy"), mmap_mode="r"),
+                "faces": np.load(os.path.join(geometry_directory, "faces.npy"), mmap_mode="r"),
+            }
+        return self.geometries[key]
+
+    def columns(self, name):
+        with np.load(os.path.join(self.directory, "scenarios", name + ".npz")) as columns:
+            return {k: columns[k] for k in columns.files}
+
+    def colors(self, name, low=None, high=None):
+        # Per-vertex colours (n x 3 uint8) of a scenario; scenarios with values are coloured
+        # on their legend, over its stored range or low..high
+        columns = self.columns(name)
+        if "values" not in columns:
+            return decode_colors(columns.get("palette"), columns["column"])
+        return viewerdata.field_colors(self.field(name, columns), low, high)
+
+    def values(self, name):
+        # Per-vertex analysis values (float32, NaN for no data) of a scenario, None when it only has colours
+        columns = self.columns(name)
+        return self.field(name, columns)["values"] if "values" in columns else None
+
+    def field(self, name, columns=None):
+        # values, legend and overrides of a scenario with values, as viewerdata.field_colors takes them
+        columns = columns or self.columns(name)
+        legend = self.index[name]["legend"]
+        return {
+            "values": viewerdata.dequantize_values(columns["values"], legend["low"], legend["high"]),
+            "legend": legend,
+            "overrides": {"index": columns["override_index"], "colors": columns["override_colors"]},
+        }
+
+    def scenario(self, name):
+        """
+        Loads a scenario.
+
+        Returns:
+            dict: vertices, faces (shared with the other scenarios of the same
+                geometry), colors and metrics, like viewerdata.read_viewer_text.
+        """
+        entry = self.index[name]
+        geometry = self.geometry(entry["geometry"])
+        return {
+            "vertices": geometry["vertices"],
+            "faces": geometry["faces"],
+            "colors": self.colors(name),
+            "metrics": entry["metrics"],
+        }
+
+    def matrix(self, names, low=None, high=None):
+        """
+        Loads scenarios of one geometry side by side for comparison.
+
+        Scenarios with values on one legend are coloured together on a common
+        scale: low..high, or by default the widest of their stored ranges.
+        Recolouring a matrix on a new range is one lookup table indexing.
+
+        Parameters:
+            names (list): Scenario names, all on the same geometry.
+            low (float): Value of the first legend colour.
+            high (float): Value of the last legend colour.
+
+        Returns:
+            dict: vertices and faces once, colors stacked as (scenarios x n x 3),
+                values stacked as (scenarios x n) when every scenario has them,
+                and a metrics DataFrame indexed by scenario name.
+        """
+        keys = {self.index[name]["geometry"] for name in names}
+        if len(keys) != 1:
+            raise ValueError("Scenarios " + ", ".join(names) + " do not share one geometry")
+        geometry = self.geometry(keys.pop())
+        result = {"vertices": geometry["vertices"], "faces": geometry["faces"]}
+        legends = [self.index[name].get("legend") for name in names]
+        if all(legends) and len({legend["name"] for legend in legends}) == 1:
+            fields = [self.field(name) for name in names]
+            values = np.stack([f["values"] for f in fields])
+            low = min(legend["low"] for legend in legends) if low is None else low
+            high = max(legend["high"] for legend in legends) if high is None else high
+            colors = viewerdata.apply_legend(values, legends[0]["name"], low, high)
+            for k, f in enumerate(fields):
+                colors[k, f["overrides"]["index"]] = f["overrides"]["colors"]
+            result["values"] = values
+        else:
+            colors = np.stack([self.colors(name) for name in names])
+        result["colors"] = colors
+        result["metrics"] = self.metrics(names)
+        return result
+
+    def metrics(self, names=None):
+        # Metrics of the scenarios as a DataFrame indexed by name, with their scene, variant and hour
+        names = self.names() if names is None else names
+        rows = [{"scene": self.index[n]["scene"], "variant": self.index[n]["variant"], "hour": self.index[n]["hour"],
+                 **self.index[n]["metrics"]} for n in names]
+        return pd.DataFrame(rows, index=pd.Index(names, name="name"))
+
+    def groups(self):
+        # Scenario names by geometry key
+        by_geometry = {}
+        for name in self.names():
+            by_geometry.setdefault(self.index[name]["geometry"], []).append(name)
+        return by_geometry
+
+
+def directory_bytes(directory):
+    return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(directory) for f in files)
+
+
+if __name__ == "__main__":
+    # Import the ViewerData text files into a scenario store and report its size, with
+    # --fields storing analysis values and legends instead of colours:
+    #   python scenarios.py ../ViewerData path/to/store [--fields]
+    import sys
+
+    source, target = [a for a in sys.argv[1:] if a != "--fields"][:2]
+    store = ScenarioStore(target)
+    names = store.add_directory(source, fields="--fields" in sys.argv)
+    text_bytes = sum(os.path.getsize(os.path.join(source, n + ".txt")) for n in names)
+    print("%d scenarios on %d geometries" % (len(names), len(store.groups())))
+    print("Text files: %9d bytes" % text_bytes)
+    print("Store:      %9d bytes" % directory_bytes(target))
+    for key, group in store.groups().items():
+        print("  %s  %s" % (key, ", ".join(group)))
@@ -0,0 +1,169 @@
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+import outline
+import scan
+import voxel
+
+
+def reservoir_update(reservoir, keys, chunk, chunk_keys, size):
+    # Bottom-k sampling: every point draws a random key and the size smallest keys
+    # seen so far are kept, which is a uniform sample without replacement.
+    if reservoir is None:
+        reservoir, keys = chunk, chunk_keys
+    else:
+        reservoir = {c: np.concatenate((reservoir[c], chunk[c])) for c in reservoir}
+        keys = np.concatenate((keys, chunk_keys))
+    if len(keys) > size:
+        keep = np.argpartition(keys, size)[:size]
+        keep.sort()  # keep points in scan order
+        reservoir = {c: v[keep] for c, v in reservoir.items()}
+        keys = keys[keep]
+    return reservoir, keys
+
+
+def iter_chunks(filename, columns, categories, batch_size):
+    # Column arrays of each record batch, restricted to the given categories
+    parquet = pq.ParquetFile(filename)
+    for batch in parquet.iter_batches(batch_size=batch_size, columns=list(columns)):
+        chunk = {c: batch.column(c).to_numpy(zero_copy_only=False) for c in columns}
+        mask = np.isin(chunk['cat'], categories)
+        if not mask.all():
+            chunk = {c: v[mask] for c, v in chunk.items()}
+        if len(chunk['cat']):
+            yield chunk
+
+
+def scan_summary(filename, sample_size=40000, image_size=(500, 500), padding=50, seed=1,
+                 batch_size=1 << 20, categories=scan.SCAN_CATEGORIES, voxel_size=None):
+    """
+    Summarises a parquet scan by streaming it batch by batch.
+
+    One pass collects the per-category counts, the room height, the
+    floor/ceiling XY bounds, a downsample of every category and the window
+    points. The footprint raster depends on the final bounds, so it takes a
+    second pass over the x/y/cat columns only.
+
+    Peak memory is one batch, plus per category either the reservoir (four
+    times sample_size) or the voxel sums (at most about twice the occupied
+    voxels, see voxel.VoxelAccumulator), plus every window point. Window
+    points are not bounded: they are kept whole because the window endpoints
+    are the extremes of their projection on the outline and the window
+    samples are not downsampled (see run.categorySamples), so any sample
+    would change both. Windows are a small part of a room scan.
+
+    Parameters:
+        filename (str): Path to the parquet scan.
+        sample_size (int): About this many points are kept per category (windows are
+            kept whole): a uniform sample of a few times the size is voxel downsampled
+            to it with voxel.budget_downsample.
+        image_size (tuple): Size of the footprint raster without padding.
+        padding (int): Padding around the footprint raster.
+        seed (int): Seed of the sampling.
+        batch_size (int): Rows decoded at a time.
+        categories (list): Categories to read.
+        voxel_size (float): Instead of sample_size, downsample on a voxel grid of this size.
+            Per-voxel sums are merged batch by batch, so the samples equal
+            voxel.voxel_downsample of the whole category up to the rounding of
+            the sums (about 1e-12 m).
+
+    Returns:
+        dict: counts, room_height, bounds, image, samples (DataFrame per category),
+            windows (DataFrame) and the transformation parameters of the raster.
+    """
+    rng = np.random.default_rng(seed)
+    counts = {cat: 0 for cat in categories}
+    z_min, z_max = np.inf, -np.inf
+    # Floor/ceiling XY bounds, kept as scalars of the column dtype so the scales match outline.main
+    bounds = None
+    reservoirs = {cat: (None, None) for cat in categories if cat != 10}
+    voxels = {cat: voxel.VoxelAccumulator() for cat in categories if cat != 10}
+    # The reservoir oversamples so the voxel downsample can even out its density
+    reservoir_size = 4 * sample_size if sample_size else 0
+    windows = []
+
+    for chunk in iter_chunks(filename, scan.SCAN_COLUMNS, categories, batch_size):
+        cat = chunk['cat']
+        for c in categories:
+            mask = cat == c
+            n = int(np.count_nonzero(mask))
+            if n == 0:
+                continue
+            counts[c] += n
+            part = {k: v[mask] for k, v in chunk.items()}
+
+            if c == 1:
+                z_min = min(z_min, np.nanmin(part['z']))
+            elif c == 0:
+                z_max = max(z_max, np.nanmax(part['z']))
+            if c in (0, 1):
+                part_bounds = (part['x'].min(), part['y'].min(), part['x'].max(), part['y'].max())
+                if bounds is None:
+                    bounds = part_bounds
+                else:
+                    bounds = (min(bounds[0], part_bounds[0]), min(bounds[1], part_bounds[1]),
+                              max(bounds[2], part_bounds[2]), max(bounds[3], part_bounds[3]))
+
+            if c == 10:
+                windows.append(part)
+            elif voxel_size:
+                voxels[c].add(voxel.voxel_sums(part, voxel_size))
+            else:
+                reservoir, keys = reservoirs[c]
+                reservoirs[c] = reservoir_update(reservoir, keys, part, rng.random(n), reservoir_size)
+
+    samples = {}
+    for c in voxels:
+        if voxel_size:
+            sums = voxels[c].result()
+            points = voxel.voxel_frame(sums) if sums is not None else None
+        else:
+            reservoir = reservoirs[c][0]
+            points = voxel.budget_downsample(pd.DataFrame(reservoir), sample_size) if reservoir is not None else None
+        samples[c] = points if points is not None else pd.DataFrame(columns=scan.SCAN_COLUMNS)
+    if windows:
+        windows = pd.DataFrame({k: np.concatenate([w[k] for w in windows]) for k in scan.SCAN_COLUMNS})
+    else:
+        windows = pd.DataFrame(columns=scan.SCAN_COLUMNS)
+    samples[10] = windows
+
+    if bounds is None:
+        raise ValueError(filename + " has no floor or ceiling points")
+
+    # Same transformation as outline.main
+    all_min_0, all_min_1, all_max_0, all_max_1 = bounds
+    scale_x = image_size[0] / (all_max_0 - all_min_0)
+    scale_y = image_size[1] / (all_max_1 - all_min_1)
+    padded_size = (image_size[0] + 2 * padding, image_size[1] + 2 * padding)
+
+    grid = None
+    for chunk in iter_chunks(filename, ['x', 'y', 'cat'], [0, 1], batch_size):
+        points = np.column_stack((chunk['x'], chunk['y']))
+        transformed = outline.apply_transformation(points, padding, scale_x, scale_y, all_min_0, all_min_1)
+        grid = outline.bin_footprint(transformed, padded_size, outline.SQUARE_SIZE, grid)
+    if grid is None:
+        grid = outline.bin_footprint(np.zeros((0, 2)), padded_size, outline.SQUARE_SIZE)
+    image = outline.dilate_footprint(grid, outline.SQUARE_SIZE)
+
+    room_height = [z_min if np.isfinite(z_min) else np.nan, z_max if np.isfinite(z_max) else np.nan]
+    return {
+        "counts": counts,
+        "room_height": room_height,
+        "bounds": bounds,
+        "image": image,
+        "samples": samples,
+        "windows": windows,
+        "padding": padding,
+        "scale": (scale_x, scale_y),
+        "min": (all_min_0, all_min_1),
+    }
+
+
+def outline_from_summary(summary):
+    # The outline.main result tuple from a scan_summary
+    scale_x, scale_y = summary["scale"]
+    all_min_0, all_min_1 = summary["min"]
+    return outline.outline_from_raster(
+        summary["image"], summary["windows"], summary["room_height"], summary["padding"],
+        scale_x, scale_y, all_min_0, all_min_1)
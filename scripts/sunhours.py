@@ -0,0 +1,422 @@
+import numpy as np
+
+import geometry
+import viewerdata
+
+
+# Where the InLUT scans were captured, Lappeenranta, Finland: latitude and longitude in
+# degrees and the offset of local standard time from UTC in hours
+DEFAULT_LOCATION = (61.06, 28.19, 2.0)
+# Days the sun is traced on, as (month, day)
+DEFAULT_DAYS = ((6, 21),)
+
+# Spacing and height above the floor of the analysis grid, in metres
+GRID_SIZE = 0.25
+GRID_OFFSET = 0.0
+# Points with at least this many hours of sun count towards %_Above_Minimum_Daylight_Hours
+MINIMUM_HOURS = 1.0
+
+# Legend of viewerdata.LEGENDS the hours are coloured with, from no sun to sun for the whole period
+LEGEND = "sun_hours"
+
+# Triangles per BVH leaf
+LEAF_SIZE = 8
+# Ray hits closer than this to the ray origin are ignored, in metres
+RAY_EPSILON = 1e-6
+
+
+def period_hours(period):
+    # Hours of an analysis period named like the ViewerData files: "8_12" is 8:00 to 12:00, both included
+    start, end = (int(h) for h in period.split("_"))
+    return np.arange(start, end + 1)
+
+
+def sun_vectors(hours, days=DEFAULT_DAYS, location=DEFAULT_LOCATION, north=0.0):
+    """
+    Unit vectors from the ground towards the sun.
+
+    The sun position follows the NOAA approximation (equation of time and
+    declination as Fourier series), which is accurate to a fraction of a
+    degree. Hours are local standard time, without daylight saving.
+
+    Parameters:
+        hours (np.ndarray): Hours of the day, e.g. period_hours("8_12").
+        days (list): (month, day) of each day traced, in a non-leap year.
+        location (tuple): Latitude and longitude in degrees, east positive, and UTC offset in hours.
+        north (float): Angle of north from the +y axis of the scan, counter-clockwise, in degrees.
+
+    Returns:
+        tuple: (k, 3) vectors of the hours with the sun above the horizon,
+            and the number of hours traced, with or without sun.
+    """
+    latitude, longitude, utc_offset = location
+    month_starts = np.cumsum([0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30])
+    day_of_year = np.array([month_starts[m - 1] + d for m, d in days], dtype=np.float64)
+    day, hour = (a.ravel() for a in np.meshgrid(day_of_year, np.asarray(hours, dtype=np.float64), indexing="ij"))
+
+    gamma = 2 * np.pi / 365 * (day - 1 + (hour - 12) / 24)
+    equation_of_time = 229.18 * (0.000075 + 0.001868 * np.cos(gamma) - 0.032077 * np.sin(gamma)
+                                 - 0.014615 * np.cos(2 * gamma) - 0.040849 * np.sin(2 * gamma))
+    declination = (0.006918 - 0.399912 * np.cos(gamma) + 0.070257 * np.sin(gamma)
+                   - 0.006758 * np.cos(2 * gamma) + 0.000907 * np.sin(2 * gamma)
+                   - 0.002697 * np.cos(3 * gamma) + 0.00148 * np.sin(3 * gamma))
+    solar_minutes = hour * 60 + equation_of_time + 4 * longitude - 60 * utc_offset
+    hour_angle = np.radians(solar_minutes / 4 - 180)
+
+    lat = np.radians(latitude)
+    altitude = np.arcsin(np.sin(lat) * np.sin(declination) + np.cos(lat) * np.cos(declination) * np.cos(hour_angle))
+    # Azimuth clockwise from north
+    azimuth = np.arctan2(np.sin(hour_angle),
+                         np.cos(hour_angle) * np.sin(lat) - np.tan(declination) * np.cos(lat)) + np.pi
+    east, northward, up = np.sin(azimuth) * np.cos(altitude), np.cos(azimuth) * np.cos(altitude), np.sin(altitude)
+
+    rotation = np.radians(north)
+    x = east * np.cos(rotation) - northward * np.sin(rotation)
+    y = east * np.sin(rotation) + northward * np.cos(rotation)
+    vectors = np.column_stack((x, y, up))
+    return vectors[altitude > 0], len(day)
+
+
+def floor_grid(footprint, z, grid_size=GRID_SIZE):
+    """
+    Analysis grid covering the footprint: square cells of grid_size whose
+    centres are inside a room, as a quad mesh like the ViewerData files.
+
+    Parameters:
+        footprint (np.ndarray): Outline polygon, or a list of room polygons.
+        z (float): Height of the grid.
+        grid_size (float): Cell side in metres.
+
+    Returns:
+        tuple: (n, 3) vertices and (m, 4) quad faces, counter-clockwise from above.
+    """
+    rooms = footprint if isinstance(footprint, list) else [footprint]
+    corners = np.vstack([np.asarray(room, dtype=np.float64)[:, :2] for room in rooms])
+    low = corners.min(axis=0)
+    cells = np.ceil((corners.max(axis=0) - low) / grid_size).astype(np.int64)
+    i, j = (a.ravel() for a in np.meshgrid(np.arange(cells[0]), np.arange(cells[1]), indexing="ij"))
+    centres = low + (np.column_stack((i, j)) + 0.5) * grid_size
+    inside = np.zeros(len(centres), dtype=bool)
+    for room in rooms:
+        inside |= geometry.points_in_polygon(centres, room)
+    i, j = i[inside], j[inside]
+
+    # Corner nodes of the cells, each kept once
+    rows = cells[1] + 1
+    nodes = np.column_stack((i * rows + j, (i + 1) * rows + j, (i + 1) * rows + j + 1, i * rows + j + 1))
+    used, faces = np.unique(nodes, return_inverse=True)
+    vertices = np.column_stack((low + np.column_stack((used // rows, used % rows)) * grid_size, np.full(len(used), z)))
+    return vertices, faces.reshape(-1, 4)
+
+
+def perimeter_positions(polygon, points):
+    # Arc length along the closed polygon of the point of it closest to each point, and the distance to it
+    starts = np.asarray(polygon, dtype=np.float64)[:, :2]
+    ends = np.roll(starts, -1, axis=0)
+    segments = ends - starts
+    lengths = np.linalg.norm(segments, axis=1)
+    offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    points = np.asarray(points, dtype=np.float64)[:, :2]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = np.einsum("pkd,kd->pk", points[:, np.newaxis] - starts, segments) / lengths ** 2
+    t = np.clip(np.nan_to_num(t), 0, 1)
+    closest = starts + t[:, :, np.newaxis] * segments
+    distances = np.linalg.norm(points[:, np.newaxis] - closest, axis=2)
+    k = distances.argmin(axis=1)
+    rows = np.arange(len(points))
+    return offsets[k] + t[rows, k] * lengths[k], distances[rows, k]
+
+
+def wall_openings(polygon, endpoints, z_bound):
+    # (start, end, z min, z max) along the perimeter of the windows on a room's walls;
+    # a window across the start of the perimeter is split in two
+    lengths = np.linalg.norm(np.roll(polygon, -1, axis=0) - polygon, axis=1)
+    perimeter = lengths.sum()
+    openings = []
+    for line, (z0, z1) in zip(endpoints, z_bound):
+        (s0, s1), _ = perimeter_positions(polygon, line)
+        low, high = min(s0, s1), max(s0, s1)
+        if high - low > perimeter / 2:
+            openings += [(high, perimeter, z0, z1), (0.0, low, z0, z1)]
+        else:
+            openings.append((low, high, z0, z1))
+    return openings
+
+
+def room_occluders(footprint, room_height, endpoints=(), z_bound=()):
+    """
+    Triangles the sun is blocked by: the walls with the windows cut out, and the ceiling.
+
+    Each wall is split into rectangles at the window edges along it and at
+    their sill and head heights, and the rectangles inside a window are left
+    out. With a list of rooms, each window is cut from the room it is closest to.
+
+    Parameters:
+        footprint (np.ndarray): Outline polygon, or a list of room polygons.
+        room_height (list): Floor and ceiling heights.
+        endpoints (list): (2, 2) ends of each window on the outline, see outline.main.
+        z_bound (list): Bottom and top of each window.
+
+    Returns:
+        tuple: (n, 3) vertices and (t, 3) triangles.
+    """
+    rooms = [geometry.counter_clockwise(geometry.open_polyline(np.asarray(r, dtype=np.float64)[:, :2]))
+             for r in (footprint if isinstance(footprint, list) else [footprint])]
+    floor_z, ceiling_z = float(room_height[0]), float(room_height[1])
+    # Room of each window
+    windows = [[] for _ in rooms]
+    for line, z in zip(endpoints, z_bound):
+        distances = [perimeter_positions(room, line)[1].max() for room in rooms]
+        windows[int(np.argmin(distances))].append((line, z))
+
+    vertex_parts, triangle_parts, count = [], [], 0
+    for room, room_windows in zip(rooms, windows):
+        openings = wall_openings(room, [w[0] for w in room_windows], [w[1] for w in room_windows])
+        lengths = np.linalg.norm(np.roll(room, -1, axis=0) - room, axis=1)
+        offsets = np.concatenate(([0], np.cumsum(lengths)))
+        for k in range(len(room)):
+            a, b = offsets[k], offsets[k + 1]
+            if b <= a:
+                continue
+            on_wall = [o for o in openings if o[0] < b and o[1] > a]
+            s_breaks = np.unique(np.clip([a, b] + [s for o in on_wall for s in o[:2]], a, b))
+            z_breaks = np.unique(np.clip([floor_z, ceiling_z] + [z for o in on_wall for z in o[2:]], floor_z, ceiling_z))
+            s_mid = (s_breaks[:-1] + s_breaks[1:]) / 2
+            z_mid = (z_breaks[:-1] + z_breaks[1:]) / 2
+            si, zi = (g.ravel() for g in np.meshgrid(np.arange(len(s_mid)), np.arange(len(z_mid)), indexing="ij"))
+            solid = np.ones(len(si), dtype=bool)
+            for s0, s1, z0, z1 in on_wall:
+                solid &= ~((s_mid[si] > s0) & (s_mid[si] < s1) & (z_mid[zi] > z0) & (z_mid[zi] < z1))
+            si, zi = si[solid], zi[solid]
+            # Corners of each wall rectangle: (s0, z0), (s0, z1), (s1, z1), (s1, z0)
+            s = np.column_stack((s_breaks[si], s_breaks[si], s_breaks[si + 1], s_breaks[si + 1])).ravel()
+            z = np.column_stack((z_breaks[zi], z_breaks[zi + 1], z_breaks[zi + 1], z_breaks[zi])).ravel()
+            direction = (room[(k + 1) % len(room)] - room[k]) / lengths[k]
+            xy = room[k] + (s - a)[:, np.newaxis] * direction
+            vertex_parts.append(np.column_stack((xy, z)))
+            quads = count + np.arange(len(s)).reshape(-1, 4)
+            triangle_parts.append(geometry.quads_to_triangles(quads))
+            count += len(s)
+        vertex_parts.append(np.column_stack((room, np.full(len(room), ceiling_z))))
+        triangle_parts.append(geometry.triangulate_polygon(room) + count)
+        count += len(room)
+    return np.vstack(vertex_parts), np.vstack(triangle_parts).astype(np.int64)
+
+
+class Bvh:
+    """
+    Bounding volume hierarchy over a triangle mesh, for vectorized shadow rays.
+
+    Nodes split their triangles at the median centroid along the longest
+    axis of the centroid bounds, down to leaves of at most leaf_size. The
+    tree is kept as flat arrays. occluded() walks it for all rays at once,
+    one level per step, testing boxes and triangles as NumPy arrays of
+    (ray, node) and (ray, triangle) pairs.
+
+    Parameters:
+        vertices (np.ndarray): (n, 3) vertices.
+        triangles (np.ndarray): (t, 3) triangles as vertex indices.
+        leaf_size (int): Most triangles in a leaf.
+    """
+
+    def __init__(self, vertices, triangles, leaf_size=LEAF_SIZE):
+        vertices = np.asarray(vertices, dtype=np.float64)
+        triangles = np.asarray(triangles, dtype=np.int64).reshape(-1, 3)
+        corners = vertices[triangles]
+        tri_low, tri_high = corners.min(axis=1), corners.max(axis=1)
+        centroids = corners.mean(axis=1)
+
+        order = np.arange(len(triangles))
+        low, high, children, starts, counts = [], [], [], [], []
+        # (node, start, stop) ranges of order still to split
+        stack = [(0, 0, len(triangles))]
+        low.append(None), high.append(None), children.append(-1), starts.append(0), counts.append(0)
+        while stack:
+            node, start, stop = stack.pop()
+            members = order[start:stop]
+            low[node] = tri_low[members].min(axis=0) if len(members) else np.zeros(3)
+            high[node] = tri_high[members].max(axis=0) if len(members) else np.zeros(3)
+            if stop - start <= leaf_size:
+                starts[node], counts[node] = start, stop - start
+                continue
+            spread = centroids[members].max(axis=0) - centroids[members].min(axis=0)
+            axis = int(np.argmax(spread))
+            middle = (stop - start) // 2
+            order[start:stop] = members[np.argpartition(centroids[members, axis], middle)]
+            # Children are stored next to each other: left at children[node], right one after it
+            children[node] = len(low)
+            for child_start, child_stop in ((start, start + middle), (start + middle, stop)):
+                stack.append((len(low), child_start, child_stop))
+                low.append(None), high.append(None), children.append(-1), starts.append(0), counts.append(0)
+
+        self.low = np.array(low)
+        self.high = np.array(high)
+        self.children = np.array(children, dtype=np.int64)
+        self.starts = np.array(starts, dtype=np.int64)
+        self.counts = np.array(counts, dtype=np.int64)
+        # Triangle corners in leaf order
+        ordered = corners[order]
+        self.v0 = ordered[:, 0]
+        self.edge1 = ordered[:, 1] - ordered[:, 0]
+        self.edge2 = ordered[:, 2] - ordered[:, 0]
+
+    def occluded(self, origins, directions):
+        """
+        Whether each ray hits a triangle.
+
+        Parameters:
+            origins (np.ndarray): (r, 3) ray origins.
+            directions (np.ndarray): (r, 3) ray directions.
+
+        Returns:
+            np.ndarray: (r,) booleans.
+        """
+        origins = np.asarray(origins, dtype=np.float64)
+        directions = np.asarray(directions, dtype=np.float64)
+        hit = np.zeros(len(origins), dtype=bool)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            inverse = 1.0 / directions
+        rays = np.arange(len(origins))
+        nodes = np.zeros(len(origins), dtype=np.int64)
+        while len(rays):
+            # Slab test of each ray against its node's box
+            with np.errstate(invalid="ignore"):
+                t0 = (self.low[nodes] - origins[rays]) * inverse[rays]
+                t1 = (self.high[nodes] - origins[rays]) * inverse[rays]
+            t_near = np.nanmax(np.minimum(t0, t1), axis=1)
+            t_far = np.nanmin(np.maximum(t0, t1), axis=1)
+            keep = (t_near <= t_far) & (t_far >= 0)
+            rays, nodes = rays[keep], nodes[keep]
+
+            leaf = self.children[nodes] < 0
+            leaf_rays, leaf_nodes = rays[leaf], nodes[leaf]
+            if len(leaf_rays):
+                # Expand each (ray, leaf) pair to its (ray, triangle) pairs
+                counts = self.counts[leaf_nodes]
+                pair_rays = np.repeat(leaf_rays, counts)
+                first = np.repeat(self.starts[leaf_nodes] - np.cumsum(counts) + counts, counts)
+                pair_triangles = first + np.arange(len(pair_rays))
+                hits = self.intersects(origins[pair_rays], directions[pair_rays], pair_triangles)
+                hit[pair_rays[hits]] = True
+
+            # Inner nodes continue with both children, for rays without a hit yet
+            inner_rays, inner_nodes = rays[~leaf], nodes[~leaf]
+            open_rays = ~hit[inner_rays]
+            inner_rays, inner_nodes = inner_rays[open_rays], inner_nodes[open_rays]
+            rays = np.concatenate((inner_rays, inner_rays))
+            nodes = np.concatenate((self.children[inner_nodes], self.children[inner_nodes] + 1))
+        return hit
+
+    def intersects(self, origins, directions, triangles):
+        # Möller-Trumbore test of ray i against triangle triangles[i], in front of the origin
+        edge1, edge2 = self.edge1[triangles], self.edge2[triangles]
+        p = np.cross(directions, edge2)
+        determinant = np.einsum("ij,ij->i", edge1, p)
+        parallel = np.abs(determinant) < 1e-12
+        inverse = 1.0 / np.where(parallel, 1.0, determinant)
+        s = origins - self.v0[triangles]
+        u = np.einsum("ij,ij->i", s, p) * inverse
+        q = np.cross(s, edge1)
+        v = np.einsum("ij,ij->i", directions, q) * inverse
+        t = np.einsum("ij,ij->i", edge2, q) * inverse
+        return ~parallel & (u >= 0) & (v >= 0) & (u + v <= 1) & (t > RAY_EPSILON)
+
+
+def sun_hours(points, vectors, bvh, hours_per_vector=1.0):
+    # Hours of sun at each point: the sun vectors not blocked by the BVH, each worth hours_per_vector
+    origins = np.repeat(points, len(vectors), axis=0)
+    directions = np.tile(vectors, (len(points), 1))
+    visible = ~bvh.occluded(origins, directions)
+    return visible.reshape(len(points), len(vectors)).sum(axis=1) * hours_per_vector
+
+
+def sun_hour_metrics(hours, total_hours, minimum_hours=MINIMUM_HOURS):
+    # Summary metrics of the ViewerData sun-hour files
+    return {
+        "%_Above_Minimum_Daylight_Hours": float(np.mean(hours >= minimum_hours)),
+        "Average_Daylight_Hours": float(np.mean(hours)),
+        "Average_%_of_Day_with_Daylight": float(np.mean(hours) / total_hours) if total_hours else 0.0,
+    }
+
+
+def analyse(outline_result, period, days=DEFAULT_DAYS, location=DEFAULT_LOCATION, north=0.0,
+            grid_size=GRID_SIZE, offset=GRID_OFFSET, minimum_hours=MINIMUM_HOURS, bvh=None):
+    """
+    Direct sun hours on the floor of a scanned room, like the ViewerData sun-hour files.
+
+    A grid is laid on the floor inside the outline and the centre of each
+    cell traces one ray per hour of the period towards the sun. Rays blocked by
+    the walls or ceiling count nothing; rays through a window opening count
+    one hour.
+
+    Parameters:
+        outline_result (tuple): (final_fp, room_height, final_endpoint_lst, z_bound) from outline.main or main_tiled.
+        period (str): Analysis period, e.g. "8_12".
+        days (list): (month, day) of each day traced.
+        location (tuple): Latitude, longitude and UTC offset, see sun_vectors.
+        north (float): Angle of north from the +y axis, counter-clockwise, in degrees.
+        grid_size (float): Spacing of the grid in metres.
+        offset (float): Height of the grid above the floor.
+        minimum_hours (float): Threshold of %_Above_Minimum_Daylight_Hours.
+        bvh (Bvh): Occluders to reuse across periods, by default the room_occluders of the outline.
+
+    Returns:
+        dict: vertices, faces, colors and metrics as viewerdata.read_viewer_text,
+            plus the values, the hours of sun at each vertex (the mean of its
+            cells), and their legend from no sun to sun all period.
+    """
+    final_fp, room_height, endpoints, z_bound = outline_result
+    if bvh is None:
+        bvh = Bvh(*room_occluders(final_fp, room_height, endpoints, z_bound))
+    vertices, faces = floor_grid(final_fp, room_height[0] + offset, grid_size)
+    vectors, total = sun_vectors(period_hours(period), days, location, north)
+    # Traced from the cell centres, which are inside the room where corners on the walls may not be
+    cell_hours = sun_hours(vertices[faces].mean(axis=1), vectors, bvh) / len(days)
+    hours = np.bincount(faces.ravel(), np.repeat(cell_hours, 4), len(vertices)) / np.bincount(faces.ravel(), minlength=len(vertices))
+    hours_per_day = total / len(days)
+    legend = {"name": LEGEND, "low": 0.0, "high": float(hours_per_day)}
+    return {
+        "vertices": vertices,
+        "faces": faces,
+        "colors": viewerdata.apply_legend(hours, LEGEND, legend["low"], legend["high"]),
+        "metrics": sun_hour_metrics(cell_hours, hours_per_day, minimum_hours),
+        "values": hours,
+        "legend": legend,
+    }
+
+
+if __name__ == "__main__":
+    # Compare the BVH against testing every ray against every triangle, on a room with
+    # its walls subdivided into many triangles:
+    #   python sunhours.py [triangles per wall edge]
+    import sys
+    import time
+
+    import synthetic
+
+    cuts = int(sys.argv[1]) if len(sys.argv) > 1 else 60
+    width, depth, height = 6.0, 4.0, 2.7
+    corners, _ = synthetic.room_walls(width, depth)
+    vertices, quads = geometry.extrusion_grid_arrays(geometry.densify_polyline(corners, 2 * (width + depth) / (4 * cuts)),
+                                                     np.linspace(0, height, cuts + 1))
+    triangles = geometry.quads_to_triangles(quads)
+    grid, _ = floor_grid(corners, 0.0, GRID_SIZE)
+    vectors, _ = sun_vectors(period_hours("8_18"))
+    print("%d triangles, %d grid points, %d sun vectors" % (len(triangles), len(grid), len(vectors)))
+
+    start = time.perf_counter()
+    bvh = Bvh(vertices, triangles)
+    build = time.perf_counter() - start
+    start = time.perf_counter()
+    hours = sun_hours(grid, vectors, bvh)
+    traced = time.perf_counter() - start
+    print("BVH:         build %.3f s, trace %.3f s" % (build, traced))
+
+    start = time.perf_counter()
+    origins = np.repeat(grid, len(vectors), axis=0)
+    directions = np.tile(vectors, (len(grid), 1))
+    blocked = np.zeros(len(origins), dtype=bool)
+    for k in range(len(triangles)):
+        blocked |= bvh.intersects(origins, directions, np.full(len(origins), k))
+    brute = (~blocked).reshape(len(grid), len(vectors)).sum(axis=1)
+    print("Brute force: trace %.3f s, same hours: %s" % (time.perf_counter() - start, np.array_equal(hours, brute)))
@@ -0,0 +1,148 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import scan
+
+
+# Inst of the first window; floor, ceiling and walls use their category as inst
+WINDOW_INST = 100
+
+
+def room_walls(width, depth):
+    # Start and end XY of the four walls of a width x depth room with a corner at the origin
+    corners = np.array([[0, 0], [width, 0], [width, depth], [0, depth]], dtype=np.float64)
+    return corners, np.roll(corners, -1, axis=0)
+
+
+def window_layout(width, depth, height, windows):
+    # Wall index, position along the wall and z range of each window, spread
+    # over the walls in turn and evenly along each wall
+    layout = []
+    for k in range(windows):
+        wall = k % 4
+        on_wall = [i for i in range(windows) if i % 4 == wall]
+        slot = on_wall.index(k)
+        t = (slot + 1) / (len(on_wall) + 1)
+        layout.append((wall, t, 0.35 * height, 0.8 * height))
+    return layout
+
+
+def room_scan(n_points, seed=0, width=6.0, depth=4.0, height=2.7, windows=3, noise=0.01,
+              window_width=1.0, window_share=0.05):
+    """
+    Synthetic scan of a box-shaped room in the schema of the real scans.
+
+    Ceiling (cat 0), floor (cat 1) and walls (cat 2) get points in proportion
+    to their area, with Gaussian noise across the surface. Each window
+    (cat 10) is a rectangle of points on a wall with its own inst, starting at
+    WINDOW_INST. Rows are shuffled like a real capture.
+
+    Parameters:
+        n_points (int): Total number of points.
+        seed (int): Seed of the generator.
+        width, depth, height (float): Room size in metres; the floor spans
+            [0, width] x [0, depth] at z = 0.
+        windows (int): Number of window instances.
+        noise (float): Standard deviation of the surface noise.
+        window_width (float): Width of each window.
+        window_share (float): Fraction of the points on windows.
+
+    Returns:
+        pd.DataFrame: x, y, z, r, g, b, cat and inst columns, with the dtypes of scan.SCAN_COLUMNS in the real files.
+    """
+    rng = np.random.default_rng(seed)
+    n_windows = int(n_points * window_share) if windows else 0
+    perimeter = 2 * (width + depth)
+    areas = np.array([width * depth, width * depth, perimeter * height])
+    n_ceiling, n_floor, _ = (areas / areas.sum() * (n_points - n_windows)).astype(np.int64)
+    n_walls = n_points - n_windows - n_ceiling - n_floor
+
+    xs, ys, zs, cats, insts = [], [], [], [], []
+
+    def add(x, y, z, cat, inst):
+        xs.append(x)
+        ys.append(y)
+        zs.append(z)
+        cats.append(np.full(len(x), cat, dtype=np.int64))
+        insts.append(np.full(len(x), inst, dtype=np.int64))
+
+    # Ceiling and floor
+    for cat, n, z in ((0, n_ceiling, height), (1, n_floor, 0.0)):
+        add(rng.uniform(0, width, n), rng.uniform(0, depth, n), rng.normal(z, noise, n), cat, cat)
+
+    # Walls, walking the perimeter from the origin
+    starts, ends = room_walls(width, depth)
+    lengths = np.linalg.norm(ends - starts, axis=1)
+    s = rng.uniform(0, perimeter, n_walls)
+    wall = np.minimum(np.searchsorted(np.cumsum(lengths), s, side='right'), 3)
+    t = (s - np.concatenate(([0], np.cumsum(lengths)[:-1]))[wall]) / lengths[wall]
+    xy = starts[wall] + t[:, np.newaxis] * (ends[wall] - starts[wall])
+    # Noise along the inward normal of each wall
+    direction = (ends - starts) / lengths[:, np.newaxis]
+    normal = np.column_stack((-direction[:, 1], direction[:, 0]))
+    xy += normal[wall] * rng.normal(0, noise, n_walls)[:, np.newaxis]
+    add(xy[:, 0], xy[:, 1], rng.uniform(0, height, n_walls), 2, 2)
+
+    # Windows
+    layout = window_layout(width, depth, height, windows)
+    per_window = np.diff(np.linspace(0, n_windows, len(layout) + 1).astype(np.int64)) if layout else []
+    for k, ((w, t_center, z0, z1), n) in enumerate(zip(layout, per_window)):
+        half = 0.5 * window_width / lengths[w]
+        t = rng.uniform(max(t_center - half, 0), min(t_center + half, 1), n)
+        xy = starts[w] + t[:, np.newaxis] * (ends[w] - starts[w]) + normal[w] * rng.normal(0, noise, n)[:, np.newaxis]
+        add(xy[:, 0], xy[:, 1], rng.uniform(z0, z1, n), 10, WINDOW_INST + k)
+
+    order = rng.permutation(n_points)
+    colors = rng.integers(0, 256, (n_points, 3), dtype=np.int64)
+    return pd.DataFrame({
+        'x': np.concatenate(xs)[order],
+        'y': np.concatenate(ys)[order],
+        'z': np.concatenate(zs)[order],
+        'r': colors[:, 0],
+        'g': colors[:, 1],
+        'b': colors[:, 2],
+        'cat': np.concatenate(cats)[order],
+        'inst': np.concatenate(insts)[order],
+    }, columns=scan.SCAN_COLUMNS)
+
+
+def write_room_scan(path, n_points, seed=0, chunk_size=5_000_000, **room):
+    """
+    Writes a synthetic room scan to a parquet file one row group at a time.
+
+    Each chunk is a room_scan of the same room with its own seed, so the file
+    can hold far more points than fit in memory at once.
+
+    Parameters:
+        path (str): Output parquet file.
+        n_points (int): Total number of points.
+        seed (int): Seed of the first chunk.
+        chunk_size (int): Points generated and written at a time.
+        room: Room parameters passed on to room_scan.
+
+    Returns:
+        str: path
+    """
+    writer = None
+    try:
+        for i, start in enumerate(range(0, n_points, chunk_size)):
+            chunk = room_scan(min(chunk_size, n_points - start), seed=seed + i, **room)
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema)
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+    return path
+
+
+if __name__ == "__main__":
+    # Write a synthetic scan:
+    #   python synthetic.py path/to/setup_100.parquet 1000000
+    import sys
+
+    write_room_scan(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 1_000_000)
+    print("Wrote " + sys.argv[1])
@@ -0,0 +1,660 @@
+import json
+import os
+import struct
+
+import numpy as np
+
+
+# Keys of the mesh in the ViewerData text files, every other key is a summary metric
+MESH_KEYS = ("vertices", "faces", "color")
+
+# glTF constants
+GLB_MAGIC = 0x46546C67  # "glTF"
+CHUNK_JSON = 0x4E4F534A
+CHUNK_BIN = 0x004E4942
+ARRAY_BUFFER = 34962
+ELEMENT_ARRAY_BUFFER = 34963
+BYTE, UNSIGNED_BYTE, SHORT, UNSIGNED_SHORT, UNSIGNED_INT, FLOAT = 5120, 5121, 5122, 5123, 5125, 5126
+COMPONENT_DTYPES = {
+    BYTE: np.int8, UNSIGNED_BYTE: np.uint8, SHORT: np.int16,
+    UNSIGNED_SHORT: np.uint16, UNSIGNED_INT: np.uint32, FLOAT: np.float32,
+}
+TYPE_SIZES = {"SCALAR": 1, "VEC2": 2, "VEC3": 3, "VEC4": 4}
+SHORT_MAX = 32767
+
+
+def read_viewer_text(path):
+    """
+    Reads a ViewerData text file.
+
+    Vertices are strings like "{x, y, z}", faces "Q{a;b;c;d}" or "T{a;b;c}"
+    and colours "r,g,b". All other keys are summary metrics. Each list is
+    joined into one string and parsed by NumPy in a single call, instead of
+    element by element.
+
+    Parameters:
+        path (str): The .txt file.
+
+    Returns:
+        dict: vertices (float64, n x 3), faces (int64, m x 4, triangles repeat
+            their last index), colors (uint8, n x 3) and metrics (dict of str).
+    """
+    with open(path) as f:
+        data = json.load(f)
+    return {
+        "vertices": parse_vertices(data["vertices"]),
+        "faces": parse_faces(data["faces"]),
+        "colors": parse_colors(data["color"]),
+        "metrics": {k: v for k, v in data.items() if k not in MESH_KEYS},
+    }
+
+
+def format_metric(value):
+    # Numbers are written like the Grasshopper exports: at most six decimals, no trailing zeros
+    if isinstance(value, str):
+        return value
+    return ("%.6f" % value).rstrip("0").rstrip(".")
+
+
+def write_viewer_text(path, mesh):
+    """
+    Writes a mesh as a ViewerData text file, the inverse of read_viewer_text.
+
+    Parameters:
+        path (str): The .txt file.
+        mesh (dict): vertices (n x 3), faces (m x 4, triangles repeating their
+            last index), colors (n x 3) and metrics (dict of numbers or strings).
+    """
+    vertices = np.asarray(mesh["vertices"], dtype=np.float64).reshape(-1, 3)
+    faces = np.asarray(mesh["faces"], dtype=np.int64).reshape(-1, 4)
+    colors = np.asarray(mesh["colors"], dtype=np.int64).reshape(-1, 3)
+    data = {
+        "vertices": ["{" + ", ".join(format_metric(c) for c in v) + "}" for v in vertices.tolist()],
+        "faces": ["T{%d;%d;%d}" % tuple(f[:3]) if f[2] == f[3] else "Q{%d;%d;%d;%d}" % tuple(f) for f in faces.tolist()],
+        "color": ["%d,%d,%d" % tuple(c) for c in colors.tolist()],
+    }
+    data.update({k: format_metric(v) for k, v in mesh["metrics"].items()})
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+# Characters around the numbers of the vertex and face strings
+VERTEX_SEPARATORS = str.maketrans("{}", "  ")
+FACE_SEPARATORS = str.maketrans("QT{};", "     ")
+
+
+def parse_vertices(strings):
+    text = ",".join(strings).translate(VERTEX_SEPARATORS)
+    return np.fromstring(text, dtype=np.float64, sep=",").reshape(-1, 3)
+
+
+def parse_colors(strings):
+    return np.fromstring(",".join(strings), dtype=np.int64, sep=",").astype(np.uint8).reshape(-1, 3)
+
+
+def parse_faces(strings):
+    # Mixed quads and triangles: the letter starting each line gives the face size
+    if not strings:
+        return np.zeros((0, 4), dtype=np.int64)
+    text = "\n".join(strings)
+    raw = np.frombuffer(text.encode(), dtype=np.uint8)
+    line_starts = np.concatenate(([0], np.flatnonzero(raw == ord("\n")) + 1))
+    sizes = np.where(raw[line_starts] == ord("Q"), 4, 3)
+    indices = np.fromstring(text.translate(FACE_SEPARATORS), dtype=np.int64, sep=" ")
+    if len(indices) != sizes.sum():
+        raise ValueError("Faces must be Q{a;b;c;d} or T{a;b;c}")
+    starts = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+    # Triangles repeat their last index
+    columns = np.minimum(np.arange(4), sizes[:, np.newaxis] - 1)
+    return indices[starts[:, np.newaxis] + columns]
+
+
+def read_viewer_text_loop(path):
+    # Reference reader decoding the strings one element at a time
+    with open(path) as f:
+        data = json.load(f)
+    vertices = np.array([[float(c) for c in v.strip("{}").split(",")] for v in data["vertices"]], dtype=np.float64)
+    faces = []
+    for face in data["faces"]:
+        indices = [int(i) for i in face[2:-1].split(";")]
+        faces.append(indices if len(indices) == 4 else indices + [indices[-1]])
+    colors = np.array([[int(c) for c in color.split(",")] for color in data["color"]], dtype=np.uint8)
+    return {
+        "vertices": vertices.reshape(-1, 3),
+        "faces": np.array(faces, dtype=np.int64).reshape(-1, 4),
+        "colors": colors.reshape(-1, 3),
+        "metrics": {k: v for k, v in data.items() if k not in MESH_KEYS},
+    }
+
+
+# Arrays kept in the .npy cache of load_viewer_data
+CACHED_ARRAYS = ("vertices", "faces", "colors")
+
+
+def cache_directory(path):
+    # Decoded arrays of S2_V0_H0.txt are cached in S2_V0_H0.cache/ next to it
+    return os.path.splitext(path)[0] + ".cache"
+
+
+def load_viewer_data(path, cache=True, mmap_mode="r"):
+    """
+    Reads a ViewerData text file through a cache of its decoded arrays.
+
+    The arrays are saved as .npy files in a directory next to the source
+    (see cache_directory) and later loads memory-map them instead of parsing
+    the text again. The cache is rebuilt when the size or modification time
+    of the source changes.
+
+    Parameters:
+        path (str): The .txt file.
+        cache (bool): Use and write the cache.
+        mmap_mode (str): numpy.load mmap_mode of the cached arrays, None to read them into memory.
+
+    Returns:
+        dict: vertices, faces, colors and metrics as read_viewer_text.
+    """
+    if not cache:
+        return read_viewer_text(path)
+    directory = cache_directory(path)
+    meta_path = os.path.join(directory, "meta.json")
+    stat = os.stat(path)
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta["size"] == stat.st_size and meta["mtime"] == stat.st_mtime_ns:
+            mesh = {k: np.load(os.path.join(directory, k + ".npy"), mmap_mode=mmap_mode) for k in CACHED_ARRAYS}
+            mesh["metrics"] = meta["metrics"]
+            return mesh
+    except (OSError, ValueError, KeyError):
+        pass
+
+    mesh = read_viewer_text(path)
+    os.makedirs(directory, exist_ok=True)
+    # The arrays are replaced one by one and meta.json last, so a partial cache is never valid
+    for k in CACHED_ARRAYS:
+        tmp_path = os.path.join(directory, k + ".tmp.npy")
+        np.save(tmp_path, mesh[k])
+        os.replace(tmp_path, os.path.join(directory, k + ".npy"))
+    tmp_path = meta_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"size": stat.st_size, "mtime": stat.st_mtime_ns, "metrics": mesh["metrics"]}, f)
+    os.replace(tmp_path, meta_path)
+    return mesh
+
+
+def face_sizes(faces):
+    # 3 for triangles (last index repeated), 4 for quads
+    return np.where(faces[:, 2] == faces[:, 3], 3, 4).astype(np.uint8)
+
+
+def triangulate(faces):
+    # Triangle indices of the faces: each quad (a, b, c, d) becomes (a, b, c) and (a, c, d),
+    # in face order, so the faces can be rebuilt from the triangles and face_sizes
+    quads = face_sizes(faces) == 4
+    first = faces[:, :3]
+    second = faces[:, [0, 2, 3]]
+    triangles = np.empty((len(faces) + int(quads.sum()), 3), dtype=faces.dtype)
+    # Position of each face's first triangle
+    starts = np.arange(len(faces)) + np.concatenate(([0], np.cumsum(quads)[:-1]))
+    triangles[starts] = first
+    triangles[starts[quads] + 1] = second[quads]
+    return triangles
+
+
+def untriangulate(triangles, sizes):
+    # Inverse of triangulate
+    quads = sizes == 4
+    starts = np.arange(len(sizes)) + np.concatenate(([0], np.cumsum(quads)[:-1])).astype(np.int64)
+    faces = np.empty((len(sizes), 4), dtype=np.int64)
+    faces[:, :3] = triangles[starts]
+    faces[:, 3] = faces[:, 2]
+    faces[quads, 3] = triangles[starts[quads] + 1, 2]
+    return faces
+
+
+def metric_value(value):
+    # Metrics are numbers stored as strings in the text files
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return value
+
+
+def quantize_positions(vertices):
+    """
+    Quantizes positions to normalized int16 in the bounding box of the mesh.
+
+    Returns:
+        tuple: int16 positions (n x 3) and the (translation, scale) of the glTF
+            node that maps them back, vertices = translation + scale * q / 32767.
+    """
+    low, high = vertices.min(axis=0), vertices.max(axis=0)
+    translation = (low + high) / 2
+    scale = (high - low) / 2
+    scale[scale == 0] = 1.0
+    q = np.rint((vertices - translation) / scale * SHORT_MAX)
+    return np.clip(q, -SHORT_MAX, SHORT_MAX).astype(np.int16), translation, scale
+
+
+class GlbBuilder:
+    # Collects binary buffer views and accessors of a single-buffer GLB
+
+    def __init__(self):
+        self.data = bytearray()
+        self.buffer_views = []
+        self.accessors = []
+
+    def add_view(self, array, target=None, stride=None):
+        # Buffer views start on 4-byte boundaries
+        self.data.extend(b"\0" * (-len(self.data) % 4))
+        view = {"buffer": 0, "byteOffset": len(self.data), "byteLength": array.nbytes}
+        if target is not None:
+            view["target"] = target
+        if stride is not None:
+            view["byteStride"] = stride
+        self.data.extend(np.ascontiguousarray(array).tobytes())
+        self.buffer_views.append(view)
+        return len(self.buffer_views) - 1
+
+    def add_accessor(self, array, component_type, accessor_type, target=None, normalized=False, width=None):
+        """
+        Adds an accessor of array (count x components).
+
+        width pads each element to that many components, for vertex attributes
+        that must be 4-byte aligned (e.g. int16 VEC3 is stored in 8 bytes).
+        """
+        count, components = array.shape[0], TYPE_SIZES[accessor_type]
+        stored = array.reshape(count, components)
+        stride = None
+        if width is not None and width != components:
+            padded = np.zeros((count, width), dtype=array.dtype)
+            padded[:, :components] = stored
+            stored = padded
+            stride = width * array.dtype.itemsize
+        view = self.add_view(stored, target, stride)
+        accessor = {
+            "bufferView": view,
+            "componentType": component_type,
+            "count": int(count),
+            "type": accessor_type,
+        }
+        if normalized:
+            accessor["normalized"] = True
+        if accessor_type != "SCALAR" or target == ARRAY_BUFFER:
+            accessor["min"] = array.reshape(count, components).min(axis=0).tolist()
+            accessor["max"] = array.reshape(count, components).max(axis=0).tolist()
+        self.accessors.append(accessor)
+        return len(self.accessors) - 1
+
+    def write(self, path, gltf):
+        gltf["bufferViews"] = self.buffer_views
+        gltf["accessors"] = self.accessors
+        self.data.extend(b"\0" * (-len(self.data) % 4))
+        gltf["buffers"] = [{"byteLength": len(self.data)}]
+        header = json.dumps(gltf, separators=(",", ":")).encode()
+        header += b" " * (-len(header) % 4)
+        length = 12 + 8 + len(header) + 8 + len(self.data)
+        with open(path, "wb") as f:
+            f.write(struct.pack("<III", GLB_MAGIC, 2, length))
+            f.write(struct.pack("<II", len(header), CHUNK_JSON))
+            f.write(header)
+            f.write(struct.pack("<II", len(self.data), CHUNK_BIN))
+            f.write(self.data)
+        return length
+
+
+# Legends of the analysis values: colour stops from the lowest to the highest value, evenly
+# spaced, and the colour of vertices without a value. They are the legends of the Grasshopper
+# exports, whose colours lie on these stops to within rounding.
+LEGENDS = {
+    "sun_hours": {"stops": [[0, 128, 0], [255, 255, 0], [255, 0, 0]], "no_data": [47, 79, 79]},
+    "view": {"stops": [[0, 150, 255], [255, 255, 255], [255, 80, 0]], "no_data": [47, 79, 79]},
+}
+# Entries of a legend lookup table: steps of well under one RGB unit
+LEGEND_TABLE_SIZE = 1024
+# Legacy colours farther than this in RGB from every legend stop segment are not read as values
+LEGEND_TOLERANCE = 2.0
+
+# Analysis values are stored as uint16 steps of their legend range: 0 is low, VALUE_STEPS is high,
+# and VALUE_NO_DATA marks the vertices without a value
+VALUE_STEPS = 65534
+VALUE_NO_DATA = 65535
+
+legend_tables = {}
+
+
+def legend_table(legend, size=LEGEND_TABLE_SIZE):
+    # (size + 1) x 3 uint8 lookup table of a legend, computed once: size entries from the lowest
+    # to the highest value, then the no-data colour
+    if (legend, size) not in legend_tables:
+        stops = np.asarray(LEGENDS[legend]["stops"], dtype=np.float64)
+        position = np.linspace(0, len(stops) - 1, size)
+        table = np.column_stack([np.interp(position, np.arange(len(stops)), stops[:, c]) for c in range(3)])
+        legend_tables[legend, size] = np.vstack((np.rint(table), LEGENDS[legend]["no_data"])).astype(np.uint8)
+    return legend_tables[legend, size]
+
+
+def apply_legend(values, legend="sun_hours", low=0.0, high=1.0):
+    """
+    Colours of analysis values on a legend, through its lookup table.
+
+    Values of any shape are coloured at once, e.g. a scenarios x vertices
+    matrix; values outside low..high get the end colours and NaN values the
+    no-data colour.
+
+    Parameters:
+        values (np.ndarray): Analysis values.
+        legend (str): Name in LEGENDS.
+        low (float): Value of the first colour stop.
+        high (float): Value of the last colour stop.
+
+    Returns:
+        np.ndarray: uint8 colours, values.shape x 3.
+    """
+    table = legend_table(legend)
+    values = np.asarray(values, dtype=np.float32)
+    scale = (len(table) - 2) / (high - low) if high > low else 0.0
+    position = values - np.float32(low)
+    position *= np.float32(scale)
+    np.clip(position, 0, len(table) - 2, out=position)
+    position += np.float32(0.5)
+    with np.errstate(invalid="ignore"):
+        index = position.astype(np.intp)
+    index[np.isnan(values)] = len(table) - 1
+    # take is several times faster than fancy indexing for the row lookups
+    return np.take(table, index, axis=0)
+
+
+def quantize_values(values, low, high):
+    # uint16 steps of analysis values on low..high, clipped to the range; NaN becomes VALUE_NO_DATA
+    values = np.asarray(values, dtype=np.float64)
+    scale = VALUE_STEPS / (high - low) if high > low else 0.0
+    steps = np.rint(np.clip((values - low) * scale, 0, VALUE_STEPS))
+    steps[np.isnan(values)] = VALUE_NO_DATA
+    return steps.astype(np.uint16)
+
+
+def dequantize_values(steps, low, high):
+    # float32 analysis values of quantize_values steps, NaN for no data
+    steps = np.asarray(steps)
+    values = (low + steps * ((high - low) / VALUE_STEPS)).astype(np.float32)
+    values[steps == VALUE_NO_DATA] = np.nan
+    return values
+
+
+def legend_positions(colors, legend):
+    # Position in 0..1 on the legend of the closest point of its stop segments to each colour, and the RGB distance to it
+    stops = np.asarray(LEGENDS[legend]["stops"], dtype=np.float64)
+    colors = np.asarray(colors, dtype=np.float64).reshape(-1, 3)
+    positions = np.zeros(len(colors))
+    distances = np.full(len(colors), np.inf)
+    for k in range(len(stops) - 1):
+        segment = stops[k + 1] - stops[k]
+        t = np.clip((colors - stops[k]) @ segment / (segment @ segment), 0, 1)
+        d = np.linalg.norm(colors - (stops[k] + t[:, np.newaxis] * segment), axis=1)
+        closer = d < distances
+        positions[closer] = (k + t[closer]) / (len(stops) - 1)
+        distances[closer] = d[closer]
+    return positions, distances
+
+
+def legacy_field(mesh, legend=None, tolerance=LEGEND_TOLERANCE, low=0.0, high=1.0):
+    """
+    Converts a mesh with baked colours to analysis values on a legend.
+
+    The values are the positions of the colours on the legend mapped onto
+    low..high, the range the colours were made with. The legacy files do not
+    store that range, so by default the values are the positions themselves,
+    0 to 1; apply_legend over the same range gives back the colours to within
+    one RGB unit. No-data colours become NaN. Other colours off the legend,
+    like markers, are kept per vertex as overrides.
+
+    Parameters:
+        mesh (dict): Mesh as returned by read_viewer_text.
+        legend (str): Name in LEGENDS, by default the legend the colours lie closest to.
+        tolerance (float): Largest RGB distance from the legend of a colour read as a value.
+        low (float): Value of the first legend colour in the original analysis.
+        high (float): Value of the last legend colour in the original analysis.
+
+    Returns:
+        dict: The mesh with values (float32), legend, and overrides instead of colors.
+    """
+    colors = np.asarray(mesh["colors"], dtype=np.uint8).reshape(-1, 3)
+    # Each distinct colour is placed on the legend once
+    palette, index = np.unique(colors, axis=0, return_inverse=True)
+    index = index.reshape(-1)
+    if legend is None:
+        legend = min(LEGENDS, key=lambda name: np.minimum(legend_positions(palette, name)[1], 255).sum())
+    positions, distances = legend_positions(palette, legend)
+    no_data = (palette == LEGENDS[legend]["no_data"]).all(axis=1)
+    positions[no_data | (distances > tolerance)] = np.nan
+    override = (distances > tolerance) & ~no_data
+    vertices = np.flatnonzero(override[index])
+    result = {k: v for k, v in mesh.items() if k != "colors"}
+    result.update({
+        "values": (low + positions[index] * (high - low)).astype(np.float32),
+        "legend": {"name": legend, "low": float(low), "high": float(high)},
+        "overrides": {"index": vertices.astype(np.uint32), "colors": colors[vertices]},
+    })
+    return result
+
+
+def field_colors(mesh, low=None, high=None):
+    # Colours of a mesh with analysis values, on its legend range or low..high, with its overrides
+    legend = mesh["legend"]
+    colors = apply_legend(mesh["values"], legend["name"],
+                          legend["low"] if low is None else low, legend["high"] if high is None else high)
+    overrides = mesh.get("overrides")
+    if overrides is not None and len(overrides["index"]):
+        colors[overrides["index"]] = overrides["colors"]
+    return colors
+
+
+def write_glb(path, mesh, name=None, quantize=True):
+    """
+    Writes a ViewerData mesh as a binary glTF (GLB) file.
+
+    Positions are normalized int16 dequantized by the node transform
+    (KHR_mesh_quantization), or float32 with quantize=False. Faces are
+    triangulated into uint16 indices, or uint32 when the mesh has more than
+    65535 vertices. Colours are normalized uint8. The size of each original
+    face is kept in a uint8 buffer view referenced from the mesh extras, so
+    quads can be rebuilt, and the summary metrics are stored as numbers in
+    the scene extras. A mesh with analysis values (see legacy_field) stores
+    them instead of colours as a normalized uint16 _VALUE attribute of steps
+    of the legend range (see quantize_values), padded to 4 bytes like the
+    colours, with the legend range, stops and steps and the colour overrides
+    in the mesh extras: value = low + step / steps * (high - low), and a step
+    above steps is no data.
+
+    Parameters:
+        path (str): Output .glb file.
+        mesh (dict): Mesh as returned by read_viewer_text, or with values, legend and overrides.
+        name (str): Mesh name, defaults to the file name.
+        quantize (bool): Quantize the positions.
+
+    Returns:
+        int: Size of the file in bytes.
+    """
+    name = name or os.path.splitext(os.path.basename(path))[0]
+    builder = GlbBuilder()
+    node = {"mesh": 0, "name": name}
+    gltf = {
+        "asset": {"version": "2.0", "generator": "3d-scan-with-spatial-analysis viewerdata.py"},
+        "scene": 0,
+        "scenes": [{"nodes": [0], "extras": {"metrics": {k: metric_value(v) for k, v in mesh["metrics"].items()}}}],
+        "nodes": [node],
+    }
+
+    vertices = mesh["vertices"]
+    if quantize and len(vertices):
+        q, translation, scale = quantize_positions(vertices)
+        position = builder.add_accessor(q, SHORT, "VEC3", ARRAY_BUFFER, normalized=True, width=4)
+        node["translation"] = translation.tolist()
+        node["scale"] = scale.tolist()
+        gltf["extensionsUsed"] = gltf["extensionsRequired"] = ["KHR_mesh_quantization"]
+    else:
+        position = builder.add_accessor(vertices.astype(np.float32), FLOAT, "VEC3", ARRAY_BUFFER)
+    attributes = {"POSITION": position}
+    extras = {}
+    if "values" in mesh:
+        # The viewer colours the values with the legend, so no colours are stored
+        legend = mesh["legend"]
+        steps = quantize_values(mesh["values"], legend["low"], legend["high"])
+        attributes["_VALUE"] = builder.add_accessor(steps.reshape(-1, 1), UNSIGNED_SHORT, "SCALAR", ARRAY_BUFFER,
+                                                    normalized=True, width=2)
+        extras["legend"] = {**legend, **LEGENDS[legend["name"]], "steps": VALUE_STEPS}
+        overrides = mesh.get("overrides")
+        if overrides is not None and len(overrides["index"]):
+            extras["overrides"] = {"index": builder.add_view(np.asarray(overrides["index"], dtype=np.uint32)),
+                                   "colors": builder.add_view(np.asarray(overrides["colors"], dtype=np.uint8))}
+    else:
+        attributes["COLOR_0"] = builder.add_accessor(mesh["colors"].astype(np.uint8), UNSIGNED_BYTE, "VEC3",
+                                                     ARRAY_BUFFER, normalized=True, width=4)
+
+    faces = mesh["faces"]
+    triangles = triangulate(faces)
+    if len(vertices) <= np.iinfo(np.uint16).max:
+        indices = builder.add_accessor(triangles.astype(np.uint16).reshape(-1, 1), UNSIGNED_SHORT, "SCALAR",
+                                       ELEMENT_ARRAY_BUFFER)
+    else:
+        indices = builder.add_accessor(triangles.astype(np.uint32).reshape(-1, 1), UNSIGNED_INT, "SCALAR",
+                                       ELEMENT_ARRAY_BUFFER)
+    extras["faceSizes"] = builder.add_view(face_sizes(faces))
+
+    gltf["meshes"] = [{
+        "name": name,
+        "primitives": [{"attributes": attributes, "indices": indices, "mode": 4}],
+        "extras": extras,
+    }]
+    return builder.write(path, gltf)
+
+
+def read_glb(path):
+    """
+    Reads a GLB file written by write_glb.
+
+    Returns:
+        dict: vertices, faces, colors and metrics like read_viewer_text; the
+            metrics are numbers. Meshes with analysis values also have their
+            values, legend and overrides, and colors from the legend.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    magic, version, _ = struct.unpack_from("<III", data, 0)
+    if magic != GLB_MAGIC or version != 2:
+        raise ValueError(path + " is not a glTF 2.0 binary file")
+    json_length, _ = struct.unpack_from("<II", data, 12)
+    gltf = json.loads(data[20:20 + json_length])
+    bin_offset = 20 + json_length
+    bin_length, _ = struct.unpack_from("<II", data, bin_offset)
+    binary = memoryview(data)[bin_offset + 8:bin_offset + 8 + bin_length]
+
+    def view_array(index, dtype, count, width):
+        view = gltf["bufferViews"][index]
+        itemsize = np.dtype(dtype).itemsize
+        stride_items = view.get("byteStride", width * itemsize) // itemsize
+        array = np.frombuffer(binary, dtype=dtype, count=count * stride_items, offset=view["byteOffset"])
+        return array.reshape(count, stride_items)[:, :width]
+
+    def accessor_array(index):
+        accessor = gltf["accessors"][index]
+        return view_array(accessor["bufferView"], COMPONENT_DTYPES[accessor["componentType"]],
+                          accessor["count"], TYPE_SIZES[accessor["type"]])
+
+    node = gltf["nodes"][0]
+    primitive = gltf["meshes"][node["mesh"]]["primitives"][0]
+    positions = accessor_array(primitive["attributes"]["POSITION"]).astype(np.float64)
+    if gltf["accessors"][primitive["attributes"]["POSITION"]].get("normalized"):
+        positions = positions / SHORT_MAX
+    vertices = np.asarray(node.get("translation", [0, 0, 0])) + np.asarray(node.get("scale", [1, 1, 1])) * positions
+
+    triangles = accessor_array(primitive["indices"]).astype(np.int64).reshape(-1, 3)
+    extras = gltf["meshes"][node["mesh"]]["extras"]
+    sizes_view = extras["faceSizes"]
+    sizes = view_array(sizes_view, np.uint8, gltf["bufferViews"][sizes_view]["byteLength"], 1).reshape(-1)
+    mesh = {
+        "vertices": vertices,
+        "faces": untriangulate(triangles, sizes),
+        "metrics": gltf["scenes"][gltf.get("scene", 0)].get("extras", {}).get("metrics", {}),
+    }
+    if "_VALUE" in primitive["attributes"]:
+        mesh["legend"] = {k: extras["legend"][k] for k in ("name", "low", "high")}
+        mesh["values"] = dequantize_values(accessor_array(primitive["attributes"]["_VALUE"]).reshape(-1),
+                                           mesh["legend"]["low"], mesh["legend"]["high"])
+        if "overrides" in extras:
+            views = extras["overrides"]
+            count = gltf["bufferViews"][views["index"]]["byteLength"] // 4
+            mesh["overrides"] = {"index": view_array(views["index"], np.uint32, count, 1).reshape(-1),
+                                 "colors": view_array(views["colors"], np.uint8, count * 3, 1).reshape(-1, 3)}
+        mesh["colors"] = field_colors(mesh)
+    else:
+        mesh["colors"] = accessor_array(primitive["attributes"]["COLOR_0"]).astype(np.uint8)
+    return mesh
+
+
+def check_round_trip(text_path, glb_path):
+    """
+    Compares a GLB file with the text file it was written from.
+
+    Faces, colours and metrics must match exactly, positions within half a
+    quantization step (plus float32 rounding for unquantized files). Colours
+    of a GLB with analysis values may differ by one RGB unit, the rounding of
+    the legend.
+
+    Returns:
+        dict: max_position_error, tolerance, max_color_error and ok.
+    """
+    text = read_viewer_text(text_path)
+    glb = read_glb(glb_path)
+    color_error = int(np.abs(glb["colors"].astype(np.int64) - text["colors"]).max()) if len(text["colors"]) else 0
+    vertices = text["vertices"]
+    if len(vertices):
+        step = float(np.max((vertices.max(axis=0) - vertices.min(axis=0)) / 2 / SHORT_MAX))
+        tolerance = 0.5 * step + float(np.abs(vertices).max() * np.finfo(np.float32).eps)
+        error = float(np.abs(glb["vertices"] - vertices).max())
+    else:
+        tolerance, error = 0.0, 0.0
+    ok = (
+        glb["vertices"].shape == vertices.shape and error <= tolerance
+        and np.array_equal(glb["faces"], text["faces"])
+        and glb["colors"].shape == text["colors"].shape and color_error <= (1 if "values" in glb else 0)
+        and glb["metrics"] == {k: metric_value(v) for k, v in text["metrics"].items()}
+    )
+    return {"max_position_error": error, "tolerance": tolerance, "max_color_error": color_error, "ok": bool(ok)}
+
+
+def convert_directory(directory, output_directory=None, quantize=True, fields=False):
+    # Writes a .glb next to (or into output_directory for) every ViewerData .txt file
+    # and checks it against the text; returns one result dict per file. With fields
+    # the colours are converted to analysis values on their legend (see legacy_field)
+    output_directory = output_directory or directory
+    os.makedirs(output_directory, exist_ok=True)
+    results = []
+    for fileName in sorted(os.listdir(directory)):
+        if not fileName.endswith(".txt"):
+            continue
+        text_path = os.path.join(directory, fileName)
+        glb_path = os.path.join(output_directory, fileName[:-4] + ".glb")
+        mesh = read_viewer_text(text_path)
+        size = write_glb(glb_path, legacy_field(mesh) if fields else mesh, quantize=quantize)
+        results.append({"name": fileName, "text_bytes": os.path.getsize(text_path), "glb_bytes": size,
+                        "check": check_round_trip(text_path, glb_path)})
+    return results
+
+
+if __name__ == "__main__":
+    # Convert the ViewerData text files to GLB and check each against its text file, with
+    # --fields storing analysis values and legends instead of colours:
+    #   python viewerdata.py ../ViewerData [output directory] [--fields]
+    import sys
+
+    fields = "--fields" in sys.argv
+    paths = [a for a in sys.argv[1:] if a != "--fields"]
+    results = convert_directory(paths[0], paths[1] if len(paths) > 1 else None, fields=fields)
+    for r in results:
+        print("%-24s %9d -> %8d bytes  %4.1fx  round trip %s (max error %.2e, colours %d)" % (
+            r["name"], r["text_bytes"], r["glb_bytes"], r["text_bytes"] / r["glb_bytes"],
+            "ok" if r["check"]["ok"] else "FAILED", r["check"]["max_position_error"], r["check"]["max_color_error"]))
@@ -0,0 +1,177 @@
+import numpy as np
+import pandas as pd
+
+
+# Voxel indices are packed into one int64 key, 21 bits per axis
+KEY_BITS = 21
+KEY_OFFSET = 1 << (KEY_BITS - 1)
+KEY_MASK = (1 << KEY_BITS) - 1
+
+
+def voxel_keys(x, y, z, voxel_size):
+    """
+    Spatial hash of points on a voxel grid anchored at the origin.
+
+    The grid does not depend on the points, so keys of different categories,
+    batches or runs refer to the same voxels.
+
+    Parameters:
+        x, y, z (np.ndarray): Point coordinates.
+        voxel_size (float): Edge length of a voxel.
+
+    Returns:
+        np.ndarray: int64 key of the voxel of each point.
+    """
+    keys = np.zeros(len(x), dtype=np.int64)
+    for axis in (x, y, z):
+        index = np.floor(np.asarray(axis, dtype=np.float64) / voxel_size).astype(np.int64) + KEY_OFFSET
+        keys = (keys << KEY_BITS) | (index & KEY_MASK)
+    return keys
+
+
+def voxel_sums(points, voxel_size):
+    """
+    Per-voxel point counts and coordinate/colour sums.
+
+    Parameters:
+        points (dict or pd.DataFrame): x, y, z, r, g, b, cat and inst columns.
+        voxel_size (float): Edge length of a voxel.
+
+    Returns:
+        dict: keys, counts, sums (x, y, z, r, g, b) and the cat/inst of the first point of each voxel.
+    """
+    keys = voxel_keys(points['x'], points['y'], points['z'], voxel_size)
+    # Hash-based grouping, no sort
+    codes, unique_keys = pd.factorize(keys)
+    n = len(unique_keys)
+    counts = np.bincount(codes, minlength=n)
+    sums = np.column_stack([np.bincount(codes, weights=np.asarray(points[c], dtype=np.float64), minlength=n)
+                            for c in ('x', 'y', 'z', 'r', 'g', 'b')])
+    # Index of the first point of each voxel: later writes win, so write in reverse
+    first = np.empty(n, dtype=np.int64)
+    first[codes[::-1]] = np.arange(len(codes))[::-1]
+    return {
+        "keys": np.asarray(unique_keys),
+        "counts": counts,
+        "sums": sums,
+        "cat": np.asarray(points['cat'])[first],
+        "inst": np.asarray(points['inst'])[first],
+    }
+
+
+def merge_voxel_sums(*parts):
+    # Combines the voxel sums of point sets, e.g. consecutive batches of a scan, with one
+    # factorize of all their keys; voxels stay in order of first appearance. None parts are skipped.
+    parts = [p for p in parts if p is not None]
+    if len(parts) < 2:
+        return parts[0] if parts else None
+    keys = np.concatenate([p["keys"] for p in parts])
+    codes, unique_keys = pd.factorize(keys)
+    n = len(unique_keys)
+    counts = np.bincount(codes, weights=np.concatenate([p["counts"] for p in parts]), minlength=n).astype(np.int64)
+    all_sums = np.vstack([p["sums"] for p in parts])
+    sums = np.column_stack([np.bincount(codes, weights=all_sums[:, i], minlength=n) for i in range(all_sums.shape[1])])
+    first = np.empty(n, dtype=np.int64)
+    first[codes[::-1]] = np.arange(len(codes))[::-1]
+    return {
+        "keys": np.asarray(unique_keys),
+        "counts": counts,
+        "sums": sums,
+        "cat": np.concatenate([p["cat"] for p in parts])[first],
+        "inst": np.concatenate([p["inst"] for p in parts])[first],
+    }
+
+
+class VoxelAccumulator:
+    """
+    Voxel sums of a stream of batches, merged in amortized linear time.
+
+    Merging every batch into the running sums re-groups all voxels seen so far
+    each time, quadratic in the number of batches. Batch sums are instead held
+    back until they have as many voxels as the running sums, then merged with
+    them at once, so every voxel is re-grouped a bounded number of times on
+    average and at most about twice the voxels of the result are held.
+    """
+
+    def __init__(self):
+        self.merged = None
+        self.pending = []
+        self.pending_voxels = 0
+
+    def add(self, sums):
+        self.pending.append(sums)
+        self.pending_voxels += len(sums["keys"])
+        if self.pending_voxels >= (len(self.merged["keys"]) if self.merged is not None else 0):
+            self.merged = merge_voxel_sums(self.merged, *self.pending)
+            self.pending, self.pending_voxels = [], 0
+
+    def result(self):
+        # The voxel sums of every batch added, None when there were none
+        return merge_voxel_sums(self.merged, *self.pending)
+
+
+def voxel_frame(sums):
+    # One point per voxel: the centroid of its points with their average colour
+    means = sums["sums"] / sums["counts"][:, np.newaxis]
+    return pd.DataFrame({
+        'x': means[:, 0],
+        'y': means[:, 1],
+        'z': means[:, 2],
+        'r': np.rint(means[:, 3]).astype(np.uint8),
+        'g': np.rint(means[:, 4]).astype(np.uint8),
+        'b': np.rint(means[:, 5]).astype(np.uint8),
+        'cat': sums["cat"],
+        'inst': sums["inst"],
+    })
+
+
+def voxel_downsample(df, voxel_size):
+    """
+    Replaces the points in each occupied voxel by their centroid and average colour.
+
+    Parameters:
+        df (pd.DataFrame): Points with x, y, z, r, g, b, cat and inst columns.
+        voxel_size (float): Edge length of a voxel.
+
+    Returns:
+        pd.DataFrame: One point per occupied voxel, in order of first appearance.
+    """
+    if len(df) == 0:
+        return df
+    return voxel_frame(voxel_sums(df, voxel_size))
+
+
+def voxel_size_for_budget(df, budget, tolerance=0.05, max_iterations=8):
+    """
+    Voxel size at which df occupies about budget voxels.
+
+    Scan points lie on surfaces, so the number of occupied voxels falls with
+    the square of the voxel size; the size is refined with that model until the
+    count is within tolerance of the budget.
+
+    Parameters:
+        df (pd.DataFrame): Points with x, y and z columns.
+        budget (int): Target number of points.
+        tolerance (float): Accepted relative deviation from the budget.
+        max_iterations (int): Maximum number of refinements.
+
+    Returns:
+        float: The voxel size.
+    """
+    extent = np.array([df[c].max() - df[c].min() for c in ('x', 'y', 'z')], dtype=np.float64)
+    extent = np.sort(np.maximum(extent, 1e-6))
+    # Start from the area of the two largest extents spread over the budget
+    voxel_size = np.sqrt(extent[1] * extent[2] / budget)
+    for _ in range(max_iterations):
+        count = len(pd.unique(voxel_keys(df["x"], df["y"], df["z"], voxel_size)))
+        if abs(count - budget) <= tolerance * budget:
+            break
+        voxel_size *= np.sqrt(count / budget)
+    return float(voxel_size)
+
+
+def budget_downsample(df, budget):
+    # Voxel downsampling to about budget points; smaller point sets are returned unchanged
+    if len(df) <= budget:
+        return df
+    return voxel_downsample(df, voxel_size_for_budget(df, budget))